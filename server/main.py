@@ -8,11 +8,25 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from server.routers import router
 from server.utils.auth_middleware import is_public_path
 from src.utils.logging_config import logger
+from src import knowledge_base
+from src.knowledge.url_fetcher import close_url_fetcher
 
 
 app = FastAPI()
 app.include_router(router, prefix="/api")
 
+
+@app.on_event("startup")
+async def start_ingestion_jobs():
+    """启动后台入库任务，并恢复上次未完成的任务"""
+    knowledge_base.job_manager.start()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """关闭 URL 抓取的连接池"""
+    await close_url_fetcher()
+
 # CORS 设置
 app.add_middleware(
     CORSMiddleware,
@@ -1,10 +1,14 @@
 import os
+import json
 import asyncio
 import traceback
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Body, Form, Query
+from fastapi.responses import StreamingResponse
 
 from src.utils import logger, hashstr
 from src import executor, config, knowledge_base
+from src.knowledge.knowledge_base import KBNotFoundError
+from src.knowledge.kb_utils import save_stream, UploadTooLargeError
 from server.utils.auth_middleware import get_admin_user
 from server.models.user_model import User
 
@@ -30,9 +34,10 @@ async def create_database(
     description: str = Body(...),
     embed_model_name: str = Body(...),
     kb_type: str = Body("lightrag"),
+    additional_params: dict = Body({}),
     current_user: User = Depends(get_admin_user)
 ):
-    """创建知识库"""
+    """创建知识库，additional_params 为数据库级别的配置（如 ingest_concurrency）"""
     logger.debug(f"Create database {database_name} with kb_type {kb_type}")
     try:
         embed_info = config.embed_model_names[embed_model_name]
@@ -40,7 +45,8 @@ async def create_database(
             database_name,
             description,
             kb_type=kb_type,
-            embed_info=embed_info
+            embed_info=embed_info,
+            **additional_params
         )
         return database_info
     except Exception as e:
@@ -93,32 +99,51 @@ async def add_documents(
     params: dict = Body(...),
     current_user: User = Depends(get_admin_user)
 ):
-    """添加文档到知识库"""
+    """添加文档到知识库（提交后台入库任务，立即返回任务ID）"""
     logger.debug(f"Add documents for db_id {db_id}: {items} {params=}")
 
     content_type = params.get('content_type', 'file')
 
     try:
-        processed_items = await knowledge_base.add_content(db_id, items, params=params)
+        job = knowledge_base.submit_ingest_job(db_id, items, params=params)
         item_type = "URLs" if content_type == 'url' else "files"
-        processed_failed_count = len([_p for _p in processed_items if _p['status'] == 'failed'])
-        processed_info = f"Processed {len(processed_items)} {item_type}, {processed_failed_count} {item_type} failed"
-        return {"message": processed_info, "items": processed_items, "status": "success"}
+        return {
+            "message": f"Submitted {len(items)} {item_type} for processing",
+            "job_id": job["job_id"],
+            "job": job,
+            "status": "success"
+        }
     except Exception as e:
-        logger.error(f"Failed to process {content_type}s: {e}, {traceback.format_exc()}")
-        return {"message": f"Failed to process {content_type}s: {e}", "status": "failed"}
+        logger.error(f"Failed to submit {content_type}s: {e}, {traceback.format_exc()}")
+        return {"message": f"Failed to submit {content_type}s: {e}", "status": "failed"}
+
+@knowledge.get("/databases/{db_id}/documents")
+async def list_documents(
+    db_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    status: str | None = Query(None),
+    current_user: User = Depends(get_admin_user)
+):
+    """分页获取知识库中的文档"""
+    try:
+        return knowledge_base.list_files(db_id, page=page, page_size=page_size, status=status)
+    except KBNotFoundError:
+        raise HTTPException(status_code=404, detail="Database not found")
 
 @knowledge.get("/databases/{db_id}/documents/{doc_id}")
 async def get_document_info(
     db_id: str,
     doc_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int | None = Query(None, ge=1, le=1000),
     current_user: User = Depends(get_admin_user)
 ):
-    """获取文档详细信息"""
+    """获取文档详细信息，指定 page_size 时分页返回 chunks"""
     logger.debug(f"GET document {doc_id} info in {db_id}")
 
     try:
-        info = await knowledge_base.get_file_info(db_id, doc_id)
+        info = await knowledge_base.get_file_info(db_id, doc_id, page=page, page_size=page_size)
         return info
     except Exception as e:
         logger.error(f"Failed to get file info, {e}, {db_id=}, {doc_id=}, {traceback.format_exc()}")
@@ -139,6 +164,58 @@ async def delete_document(
         logger.error(f"删除文档失败 {e}, {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"删除文档失败: {e}")
 
+@knowledge.get("/databases/{db_id}/index")
+async def get_index_info(db_id: str, current_user: User = Depends(get_admin_user)):
+    """获取向量索引信息：当前索引、向量数量、推荐索引与重建进度"""
+    try:
+        return await knowledge_base.aget_index_info(db_id)
+    except KBNotFoundError:
+        raise HTTPException(status_code=404, detail="Database not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@knowledge.post("/databases/{db_id}/reindex")
+async def reindex_database(
+    db_id: str,
+    index_type: str | None = Body(None),
+    index_params: dict = Body({}),
+    recall_target: float | None = Body(None),
+    current_user: User = Depends(get_admin_user)
+):
+    """在线重建向量索引，index_type 为空时按集合规模与召回率目标自动选择"""
+    try:
+        return await knowledge_base.reindex_database(db_id, index_type=index_type,
+                                                     index_params=index_params, recall_target=recall_target)
+    except KBNotFoundError:
+        raise HTTPException(status_code=404, detail="Database not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# =============================================================================
+# === 入库任务分组 ===
+# =============================================================================
+
+@knowledge.get("/jobs")
+async def list_ingest_jobs(
+    db_id: str | None = Query(None),
+    current_user: User = Depends(get_admin_user)
+):
+    """获取入库任务列表"""
+    try:
+        jobs = knowledge_base.list_ingest_jobs(db_id)
+        return {"jobs": jobs, "message": "success"}
+    except Exception as e:
+        logger.error(f"获取入库任务列表失败 {e}, {traceback.format_exc()}")
+        return {"message": f"获取入库任务列表失败 {e}", "jobs": []}
+
+@knowledge.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str, current_user: User = Depends(get_admin_user)):
+    """获取入库任务进度（每个文件的阶段、分块数、吞吐与预计剩余时间）"""
+    job = knowledge_base.get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # =============================================================================
 # === 查询分组 ===
 # =============================================================================
@@ -159,6 +236,75 @@ async def query_knowledge_base(
         logger.error(f"知识库查询失败 {e}, {traceback.format_exc()}")
         return {"message": f"知识库查询失败: {e}", "status": "failed"}
 
+@knowledge.post("/databases/{db_id}/batch-query")
+async def batch_query_knowledge_base(
+    db_id: str,
+    queries: list[str] = Body(...),
+    meta: dict = Body({}),
+    current_user: User = Depends(get_admin_user)
+):
+    """批量查询知识库，results 与 queries 一一对应"""
+    logger.debug(f"Batch query knowledge base {db_id}: {len(queries)} queries")
+    try:
+        results = await knowledge_base.abatch_query(queries, db_id=db_id, **meta)
+        return {"results": results, "status": "success"}
+    except Exception as e:
+        logger.error(f"知识库批量查询失败 {e}, {traceback.format_exc()}")
+        return {"message": f"知识库批量查询失败: {e}", "status": "failed"}
+
+@knowledge.post("/databases/{db_id}/retrieve")
+async def retrieve_knowledge_base(
+    db_id: str,
+    query: str = Body(...),
+    meta: dict = Body({}),
+    stream: bool = Body(False),
+    current_user: User = Depends(get_admin_user)
+):
+    """结构化检索，返回带分数、分块ID、文件ID的检索结果；stream 为 true 时在排序完成后逐行（NDJSON）返回"""
+    logger.debug(f"Retrieve from knowledge base {db_id}: {query}")
+    if not stream:
+        try:
+            hits = await knowledge_base.aretrieve(query, db_id=db_id, **meta)
+            return {"hits": [hit.to_dict() for hit in hits], "status": "success"}
+        except Exception as e:
+            logger.error(f"知识库检索失败 {e}, {traceback.format_exc()}")
+            return {"message": f"知识库检索失败: {e}", "status": "failed"}
+
+    def make_chunk(**kwargs):
+        return json.dumps(kwargs, ensure_ascii=False).encode('utf-8') + b"\n"
+
+    async def stream_hits():
+        try:
+            async for hit in knowledge_base.aiter_ranked_hits(query, db_id=db_id, **meta):
+                yield make_chunk(hit=hit.to_dict(), status="loading")
+            yield make_chunk(status="finished")
+        except Exception as e:
+            logger.error(f"知识库检索失败 {e}, {traceback.format_exc()}")
+            yield make_chunk(message=f"知识库检索失败: {e}", status="error")
+
+    return StreamingResponse(stream_hits(), media_type='application/json')
+
+@knowledge.post("/federated-query")
+async def federated_query(
+    query: str = Body(...),
+    db_ids: list[str] | None = Body(None),
+    top_k: int = Body(10, ge=1, le=100),
+    timeout: float | None = Body(None, gt=0),
+    meta: dict = Body({}),
+    current_user: User = Depends(get_admin_user)
+):
+    """联合检索：并发查询多个知识库并合并去重，db_ids 为空时查询所有知识库"""
+    logger.debug(f"Federated query in {db_ids or 'all databases'}: {query}")
+    try:
+        result = await knowledge_base.afederated_query(query, db_ids=db_ids, top_k=top_k, timeout=timeout, **meta)
+        return {"hits": [hit.to_dict() for hit in result["hits"]], "databases": result["databases"],
+                "status": "success"}
+    except KBNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"联合检索失败 {e}, {traceback.format_exc()}")
+        return {"message": f"联合检索失败: {e}", "status": "failed"}
+
 @knowledge.post("/databases/{db_id}/query-test")
 async def query_test(
     db_id: str,
@@ -261,6 +407,34 @@ async def get_knowledge_base_query_params(
                         "type": "boolean",
                         "default": True,
                         "description": "在结果中显示相似度分数"
+                    },
+                    {
+                        "key": "fusion_mode",
+                        "label": "检索方式",
+                        "type": "select",
+                        "default": "vector",
+                        "options": [
+                            {"value": "vector", "label": "向量检索", "description": "只使用语义相似度"},
+                            {"value": "hybrid", "label": "混合检索", "description": "关键词与向量检索并行，按倒数排名融合"},
+                            {"value": "lexical", "label": "关键词检索", "description": "只使用 BM25，适合型号、人名、成语等精确匹配"}
+                        ],
+                        "description": "关键词检索与向量检索的组合方式"
+                    },
+                    {
+                        "key": "use_reranker",
+                        "label": "重排序",
+                        "type": "boolean",
+                        "default": config.enable_reranker,
+                        "description": "召回更多候选后用重排序模型打分，保留 TopK 个结果"
+                    },
+                    {
+                        "key": "rerank_candidates",
+                        "label": "重排序候选数",
+                        "type": "number",
+                        "default": 30,
+                        "min": 1,
+                        "max": 200,
+                        "description": "开启重排序时召回的候选数量"
                     }
                 ]
             }
@@ -294,6 +468,34 @@ async def get_knowledge_base_query_params(
                         "default": True,
                         "description": "在结果中显示相似度分数"
                     },
+                    {
+                        "key": "fusion_mode",
+                        "label": "检索方式",
+                        "type": "select",
+                        "default": "vector",
+                        "options": [
+                            {"value": "vector", "label": "向量检索", "description": "只使用语义相似度"},
+                            {"value": "hybrid", "label": "混合检索", "description": "关键词与向量检索并行，按倒数排名融合"},
+                            {"value": "lexical", "label": "关键词检索", "description": "只使用 BM25，适合型号、人名、成语等精确匹配"}
+                        ],
+                        "description": "关键词检索与向量检索的组合方式"
+                    },
+                    {
+                        "key": "use_reranker",
+                        "label": "重排序",
+                        "type": "boolean",
+                        "default": config.enable_reranker,
+                        "description": "召回更多候选后用重排序模型打分，保留 TopK 个结果"
+                    },
+                    {
+                        "key": "rerank_candidates",
+                        "label": "重排序候选数",
+                        "type": "number",
+                        "default": 30,
+                        "min": 1,
+                        "max": 200,
+                        "description": "开启重排序时召回的候选数量"
+                    },
                     {
                         "key": "metric_type",
                         "label": "距离度量类型",
@@ -305,6 +507,34 @@ async def get_knowledge_base_query_params(
                             {"value": "IP", "label": "内积", "description": "适合标准化向量"}
                         ],
                         "description": "向量相似度计算方法"
+                    },
+                    {
+                        "key": "recall_target",
+                        "label": "召回率目标",
+                        "type": "number",
+                        "default": 0.95,
+                        "min": 0.8,
+                        "max": 0.99,
+                        "step": 0.01,
+                        "description": "召回率目标越高，检索范围（ef / nprobe）越大，速度越慢"
+                    },
+                    {
+                        "key": "ef",
+                        "label": "HNSW ef",
+                        "type": "number",
+                        "default": None,
+                        "min": 1,
+                        "max": 4096,
+                        "description": "HNSW 索引的检索宽度，留空则按召回率目标自动计算"
+                    },
+                    {
+                        "key": "nprobe",
+                        "label": "IVF nprobe",
+                        "type": "number",
+                        "default": None,
+                        "min": 1,
+                        "max": 65536,
+                        "description": "IVF 索引检索的聚类数量，留空则按召回率目标自动计算"
                     }
                 ]
             }
@@ -335,31 +565,121 @@ async def get_knowledge_base_query_params(
 # === 文件管理分组 ===
 # =============================================================================
 
+def get_upload_target(filename: str, db_id: str | None) -> str:
+    """
+    上传文件的保存路径，每次上传都保存到不同的路径，排队中的入库任务读取的文件不会被之后的上传替换
+
+    指定数据库时保存到该数据库上传目录下的随机子目录中并保留原文件名，入库时按文件名找到同名文件的已有记录并增量更新；
+    未指定数据库时保存到默认目录，文件名追加随机后缀
+    """
+    basename, ext = os.path.splitext(os.path.basename(filename))
+    if db_id:
+        upload_dir = os.path.join(knowledge_base.get_db_upload_path(db_id), hashstr(basename, 6, with_salt=True))
+        filename = f"{basename}{ext}"
+    else:
+        upload_dir = os.path.join(config.save_dir, "database", "uploads")
+        filename = f"{basename}_{hashstr(basename, 4, with_salt=True)}{ext}".lower()
+
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, filename)
+
+def get_max_upload_size() -> int | None:
+    """上传文件大小上限（字节），None 表示不限制"""
+    return int(config.max_upload_size_mb or 0) * 1024 * 1024 or None
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the maximum upload size of {config.max_upload_size_mb} MB")
+
 @knowledge.post("/files/upload")
 async def upload_file(
     file: UploadFile = File(...),
     db_id: str | None = Query(None),
     current_user: User = Depends(get_admin_user)
 ):
-    """上传文件"""
+    """上传文件：分块写入磁盘并计算内容哈希，入库时复用该哈希去重而无需重新读取文件"""
     if not file.filename:
         raise HTTPException(status_code=400, detail="No selected file")
 
-    # 根据db_id获取上传路径，如果db_id为None则使用默认路径
-    if db_id:
-        upload_dir = knowledge_base.get_db_upload_path(db_id)
-    else:
-        upload_dir = os.path.join(config.save_dir, "database", "uploads")
+    # 已知大小时在写入前拒绝超出上限的文件，未知时在写入过程中检查
+    max_size = get_max_upload_size()
+    if max_size and file.size is not None and file.size > max_size:
+        raise upload_too_large()
 
-    basename, ext = os.path.splitext(file.filename)
-    filename = f"{basename}_{hashstr(basename, 4, with_salt=True)}{ext}".lower()
-    file_path = os.path.join(upload_dir, filename)
-    os.makedirs(upload_dir, exist_ok=True)
+    file_path = get_upload_target(file.filename, db_id)
+    try:
+        content_hash, size = await asyncio.to_thread(save_stream, file.file, file_path, max_size)
+    except UploadTooLargeError:
+        raise upload_too_large()
 
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    return {"message": "File successfully uploaded", "file_path": file_path, "db_id": db_id,
+            "content_hash": content_hash, "size": size}
 
-    return {"message": "File successfully uploaded", "file_path": file_path, "db_id": db_id}
+# 可续传的分片上传：创建会话 -> 并发上传分片（可查询已收到的分片并补传）-> 合并
+
+@knowledge.post("/files/uploads")
+async def initiate_upload(
+    filename: str = Body(...),
+    db_id: str | None = Body(None),
+    total_size: int | None = Body(None, ge=0),
+    current_user: User = Depends(get_admin_user)
+):
+    """创建分片上传会话，合并后的文件与普通上传保存在相同的目录"""
+    max_size = get_max_upload_size()
+    if max_size and total_size is not None and total_size > max_size:
+        raise upload_too_large()
+
+    file_path = get_upload_target(filename, db_id)
+    return await asyncio.to_thread(knowledge_base.upload_sessions.initiate, filename, file_path, total_size, db_id)
+
+@knowledge.put("/files/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(
+    upload_id: str,
+    part_number: int,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_admin_user)
+):
+    """上传一个分片（编号从 1 开始），重复上传会覆盖同编号的分片"""
+    try:
+        return await asyncio.to_thread(knowledge_base.upload_sessions.save_part, upload_id, part_number,
+                                       file.file, get_max_upload_size())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UploadTooLargeError:
+        raise upload_too_large()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@knowledge.get("/files/uploads/{upload_id}")
+async def get_upload_status(upload_id: str, current_user: User = Depends(get_admin_user)):
+    """查询已收到的分片，用于断点续传"""
+    try:
+        return await asyncio.to_thread(knowledge_base.upload_sessions.get_status, upload_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@knowledge.post("/files/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    total_parts: int | None = Body(None, embed=True, ge=1),
+    current_user: User = Depends(get_admin_user)
+):
+    """合并分片，返回与普通上传相同的结果"""
+    try:
+        result = await asyncio.to_thread(knowledge_base.upload_sessions.complete, upload_id, total_parts)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "File successfully uploaded", **result}
+
+@knowledge.delete("/files/uploads/{upload_id}")
+async def abort_upload(upload_id: str, current_user: User = Depends(get_admin_user)):
+    """取消分片上传并删除已上传的分片"""
+    try:
+        await asyncio.to_thread(knowledge_base.upload_sessions.abort, upload_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"message": "Upload aborted", "upload_id": upload_id}
 
 # =============================================================================
 # === 知识库类型分组 ===
@@ -18,18 +18,39 @@ from src.knowledge.milvus_kb import MilvusKB  # noqa: E402
 
 # 注册知识库类型
 KnowledgeBaseFactory.register("lightrag", LightRagKB, {
+    "ingest_concurrency": 8,
+    "insert_batch_size": 8,
+    "insert_linger": 2.0,
+    "llm_max_async": 4,
+    "embedding_batch_size": 32,
+    "max_parallel_insert": 4,
+    "federated_timeout": 30.0,
+    "max_instances": 8,
+    "instance_idle_timeout": 1800,
     "description": "基于图检索的知识库，支持实体关系构建和复杂查询"
 })
 
 KnowledgeBaseFactory.register("chroma", ChromaKB, {
     "chunk_size": 1000,
     "chunk_overlap": 200,
+    "ingest_concurrency": 4,
+    "fusion_mode": "vector",
+    "chroma_max_workers": 4,
+    "add_batch_size": 1000,
+    "max_instances": 64,
     "description": "基于 ChromaDB 的轻量级向量知识库，适合开发和小规模部署"
 })
 
 KnowledgeBaseFactory.register("milvus", MilvusKB, {
     "chunk_size": 1000,
     "chunk_overlap": 200,
+    "ingest_concurrency": 4,
+    "bulk_insert_rows": 2000,
+    "bulk_linger": 1.0,
+    "flush_interval": 60,
+    "fusion_mode": "vector",
+    "max_instances": 16,
+    "instance_idle_timeout": 1800,
     "description": "基于 Milvus 的生产级向量知识库，适合大规模高性能部署"
 })
 
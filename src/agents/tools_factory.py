@@ -10,6 +10,7 @@ from langchain_core.tools import StructuredTool, tool
 from langchain_tavily import TavilySearch
 
 from src import config, graph_base, knowledge_base
+from src.knowledge.retrieval import format_hits
 from src.utils import logger
 
 
@@ -25,6 +26,12 @@ class KnowledgeRetrieverModel(BaseModel):
         )
     )
 
+class FederatedRetrieverModel(KnowledgeRetrieverModel):
+    db_ids: list[str] | None = Field(
+        default=None,
+        description="要检索的知识库ID列表，不指定时检索所有知识库。"
+    )
+
 def get_runnable_tools():
     """获取所有可运行的工具（给大模型使用）"""
     tools = _TOOLS_REGISTRY.copy()
@@ -60,8 +67,44 @@ def get_runnable_tools():
             metadata=retrieve_info
         )
 
+    # 多个知识库时提供联合检索工具，一次调用并发检索多个知识库
+    retrievers = knowledge_base.get_retrievers()
+    if len(retrievers) > 1:
+        tools["retrieve_federated"] = create_federated_retriever_tool(retrievers)
+
     return tools
 
+def create_federated_retriever_tool(retrievers: dict):
+    """创建联合检索工具，可检索的知识库列在工具描述中"""
+    db_names = {db_id: info["name"] for db_id, info in retrievers.items()}
+    description = (
+        "同时检索多个知识库，结果合并去重后按相关度排序，需要查询多个知识库时优先使用。\n"
+        "可用的知识库（ID: 名称 - 描述）：\n"
+        + "\n".join(f"{db_id}: {info['name']} - {info['description']}" for db_id, info in retrievers.items())
+    )
+
+    async def federated_retriever(query_text: str, db_ids: list[str] | None = None):
+        """联合检索包装函数"""
+        try:
+            result = await knowledge_base.afederated_query(query_text, db_ids=db_ids)
+            failed = [f"{db_names.get(db_id, db_id)}: {report['error']}"
+                      for db_id, report in result["databases"].items() if report["status"] != "success"]
+            context = format_hits(result["hits"], include_distances=False, db_names=db_names)
+            if failed:
+                context += "\n以下知识库检索失败：\n" + "\n".join(failed)
+            return context
+        except Exception as e:
+            logger.error(f"Error in federated retriever: {e}")
+            return f"检索失败: {str(e)}"
+
+    return StructuredTool.from_function(
+        coroutine=federated_retriever,
+        name="retrieve_federated",
+        description=description,
+        args_schema=FederatedRetrieverModel,
+        metadata={"name": "联合检索", "description": "并发检索多个知识库并合并结果"}
+    )
+
 def get_all_tools_info():
     """获取所有工具的信息（用于前端展示）"""
     tools_info = {}
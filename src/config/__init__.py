@@ -59,6 +59,8 @@ class Config(SimpleConfig):
 
         self.add_item("embed_model", default="siliconflow/BAAI/bge-m3", des="Embedding 模型", choices=list(self.embed_model_names.keys()))
         self.add_item("reranker", default="siliconflow/BAAI/bge-reranker-v2-m3", des="Re-Ranker 模型", choices=list(self.reranker_names.keys()))  # noqa: E501
+        # 知识库配置
+        self.add_item("max_upload_size_mb", default=1024, des="上传文件大小上限（MB），0 表示不限制")
         ### <<< 默认配置结束
 
         self.load()
@@ -1,9 +1,11 @@
 import os
 import time
+import asyncio
 import traceback
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Callable
 from datetime import datetime
 
 import chromadb
@@ -11,10 +13,11 @@ from chromadb.config import Settings
 from chromadb.api.types import EmbeddingFunction, Documents, Embeddings
 from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
 
-
-
 from src.knowledge.knowledge_base import KnowledgeBase
-from src.knowledge.kb_utils import split_text_into_chunks, prepare_item_metadata, get_embedding_config
+from src.knowledge.ingestion import IngestionPipeline
+from src.knowledge.retrieval import RetrievalHit, format_hits
+from src.knowledge.kb_utils import iter_chunks, prepare_item_metadata, get_embedding_config
+from src.models.embedding import get_embedding_client
 from src.utils import logger, hashstr
 from src import config
 
@@ -30,7 +33,7 @@ class ChromaKB(KnowledgeBase):
             work_dir: 工作目录
             **kwargs: 其他配置参数
         """
-        super().__init__(work_dir)
+        super().__init__(work_dir, **kwargs)
 
         if chromadb is None:
             raise ImportError("chromadb is not installed. Please install it with: pip install chromadb")
@@ -45,13 +48,25 @@ class ChromaKB(KnowledgeBase):
             settings=Settings(anonymized_telemetry=False)
         )
 
-        # 存储集合映射 {db_id: collection}
-        self.collections: Dict[str, Any] = {}
+        # 存储集合映射 {db_id: collection}，集合句柄只占用少量内存，淘汰时直接丢弃
+        self.collections = self._create_instance_pool()
 
         # 分块配置
         self.chunk_size = kwargs.get('chunk_size', 1000)
         self.chunk_overlap = kwargs.get('chunk_overlap', 200)
 
+        # 单次 embedding 请求的文本数量
+        self.embed_batch_size = kwargs.get('embed_batch_size', 64)
+
+        # chromadb 客户端是同步的，所有调用在专用的有界线程池中执行，避免阻塞事件循环；
+        # 写入按 add_batch_size（不超过客户端的 max_batch_size）分批，耗时超过 slow_op_threshold 秒的操作记录警告
+        self.max_workers = kwargs.get('chroma_max_workers', 4)
+        self.add_batch_size = kwargs.get('add_batch_size', 1000)
+        self.slow_op_threshold = kwargs.get('slow_op_threshold', 1.0)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chroma")
+        self._op_stats: Dict[str, Dict] = {}
+        self._max_batch_size = None
+
         logger.info("ChromaKB initialized")
 
     @property
@@ -59,6 +74,63 @@ class ChromaKB(KnowledgeBase):
         """知识库类型标识"""
         return "chroma"
 
+    async def _run(self, op: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        在 ChromaDB 线程池中执行同步调用，并按操作类型统计排队与执行耗时
+
+        Args:
+            op: 操作名称（add / query / get / delete 等）
+            func: 同步函数
+            *args, **kwargs: 函数参数
+
+        Returns:
+            函数返回值
+        """
+        submitted = time.perf_counter()
+        timing = {}
+
+        def call():
+            timing["start"] = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timing["end"] = time.perf_counter()
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            if "start" in timing:
+                wait_time = timing["start"] - submitted
+                run_time = timing.get("end", time.perf_counter()) - timing["start"]
+                stats = self._op_stats.setdefault(op, {"count": 0, "total_time": 0.0, "max_time": 0.0, "wait_time": 0.0})
+                stats["count"] += 1
+                stats["total_time"] += run_time
+                stats["max_time"] = max(stats["max_time"], run_time)
+                stats["wait_time"] += wait_time
+                if run_time + wait_time > self.slow_op_threshold:
+                    logger.warning(f"Slow ChromaDB {op}: {run_time:.2f}s (queued {wait_time:.2f}s)")
+
+    def get_io_stats(self) -> Dict:
+        """ChromaDB 调用的耗时统计 {操作: {count, avg_time, max_time, avg_wait}}（秒）"""
+        return {
+            op: {
+                "count": stats["count"],
+                "avg_time": round(stats["total_time"] / stats["count"], 4),
+                "max_time": round(stats["max_time"], 4),
+                "avg_wait": round(stats["wait_time"] / stats["count"], 4),
+            }
+            for op, stats in self._op_stats.items() if stats["count"]
+        }
+
+    def _get_add_batch_size(self) -> int:
+        """单次 add 的最大条数，不超过客户端允许的 max_batch_size"""
+        if self._max_batch_size is None:
+            try:
+                self._max_batch_size = self.chroma_client.get_max_batch_size()
+            except Exception:
+                self._max_batch_size = self.add_batch_size
+        return max(1, min(self.add_batch_size, self._max_batch_size))
+
     async def _create_kb_instance(self, db_id: str, config: Dict) -> Any:
         """创建向量数据库集合"""
         logger.info(f"Creating ChromaDB collection for {db_id}")
@@ -74,7 +146,8 @@ class ChromaKB(KnowledgeBase):
 
         try:
             # 尝试获取现有集合
-            collection = self.chroma_client.get_collection(
+            collection = await self._run(
+                "get_collection", self.chroma_client.get_collection,
                 name=collection_name,
                 embedding_function=embedding_function
             )
@@ -89,7 +162,7 @@ class ChromaKB(KnowledgeBase):
             # 如果模型不匹配，删除现有集合并重新创建
             if current_model != expected_model:
                 logger.warning(f"Collection {collection_name} uses model '{current_model}', but expected '{expected_model}'. Recreating collection.")
-                self.chroma_client.delete_collection(name=collection_name)
+                await self._run("delete_collection", self.chroma_client.delete_collection, name=collection_name)
                 raise Exception("Model mismatch, recreating collection")
 
         except Exception as e:
@@ -100,7 +173,8 @@ class ChromaKB(KnowledgeBase):
                 "created_at": datetime.now().isoformat(),
                 "embedding_model": embed_info.get("name") if embed_info else "default"
             }
-            collection = self.chroma_client.create_collection(
+            collection = await self._run(
+                "create_collection", self.chroma_client.create_collection,
                 name=collection_name,
                 embedding_function=embedding_function,
                 metadata=collection_metadata
@@ -123,6 +197,16 @@ class ChromaKB(KnowledgeBase):
             api_base=config_dict["base_url"].replace('/embeddings', '')
         )
 
+    async def _aembed_texts(self, db_id: str, texts: List[str]) -> List[List[float]]:
+        """
+        计算向量（经过 embedding 缓存），集合本身的 embedding 函数不再被调用；
+        未命中的文本通过按 embedding 配置共享的长连接客户端并发请求
+        """
+        embed_info = self.databases_meta[db_id].get("embed_info", {})
+        config_dict = get_embedding_config(embed_info)
+        client = get_embedding_client(config_dict["model"], config_dict["base_url"], config_dict["api_key"])
+        return await client.abatch_encode(list(texts), batch_size=self.embed_batch_size)
+
     async def _get_chroma_collection(self, db_id: str):
         """获取或创建 ChromaDB 集合"""
         if db_id in self.collections:
@@ -131,35 +215,46 @@ class ChromaKB(KnowledgeBase):
         if db_id not in self.databases_meta:
             return None
 
-        try:
-            # 创建集合
-            collection = await self._create_kb_instance(db_id, {})
-            await self._initialize_kb_instance(collection)
-
-            self.collections[db_id] = collection
-            return collection
-
-        except Exception as e:
-            logger.error(f"Failed to create vector collection for {db_id}: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return None
-
-    def _split_text_into_chunks(self, text: str, file_id: str, filename: str) -> List[Dict]:
-        """将文本分割成块"""
-        chunks = split_text_into_chunks(text, file_id, filename, self.chunk_size, self.chunk_overlap)
-
-        # 为 ChromaDB 添加特定的 metadata 格式
-        for chunk in chunks:
+        async def create():
+            try:
+                collection = await self._create_kb_instance(db_id, {})
+                await self._initialize_kb_instance(collection)
+                return collection
+            except Exception as e:
+                logger.error(f"Failed to create vector collection for {db_id}: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                return None
+
+        return await self.collections.get_or_create(db_id, create)
+
+    def get_instance_stats(self) -> Dict:
+        """常驻集合统计"""
+        return self.collections.stats()
+
+    def _split_text_into_chunks(self, text: str, file_id: str, filename: str,
+                                params: Optional[Dict] = None) -> List[Dict]:
+        """将文本分割成块，params 中的 chunk_size / chunk_overlap / chunk_unit 优先于知识库默认配置"""
+        params = params or {}
+        chunks = []
+        for chunk in iter_chunks(text, file_id, filename,
+                                 chunk_size=int(params.get("chunk_size") or self.chunk_size),
+                                 chunk_overlap=int(params.get("chunk_overlap", self.chunk_overlap)),
+                                 chunk_unit=params.get("chunk_unit", "char")):
+            # 为 ChromaDB 添加特定的 metadata 格式
             chunk["metadata"] = {
                 "source": chunk["source"],
                 "chunk_id": chunk["chunk_id"],
-                "full_doc_id": file_id
+                "full_doc_id": file_id,
+                "chunk_index": chunk["chunk_index"],
+                "content_hash": chunk["content_hash"]
             }
+            chunks.append(chunk)
 
         return chunks
 
     async def add_content(self, db_id: str, items: List[str],
-                         params: Optional[Dict] = None) -> List[Dict]:
+                         params: Optional[Dict] = None,
+                         progress_callback: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
         """添加内容（文件/URL）"""
         if db_id not in self.databases_meta:
             raise ValueError(f"Database {db_id} not found")
@@ -168,115 +263,179 @@ class ChromaKB(KnowledgeBase):
         if not collection:
             raise ValueError(f"Failed to get ChromaDB collection for {db_id}")
 
-        content_type = params.get('content_type', 'file') if params else 'file'
-        processed_items_info = []
+        return await IngestionPipeline(self, db_id, params, progress_callback).run(items)
 
-        for item in items:
-            # 准备文件元数据
-            metadata = prepare_item_metadata(item, content_type, db_id)
-            file_id = metadata["file_id"]
-            filename = metadata["filename"]
-            item_path = metadata["path"]
+    def _ingest_chunk(self, db_id: str, file_meta: Dict, content: str,
+                      params: Optional[Dict] = None) -> List[Dict]:
+        """分块阶段"""
+        return self._split_text_into_chunks(content, file_meta["file_id"], file_meta["filename"], params)
 
-            # 添加文件记录
-            file_record = metadata.copy()
-            self.files_meta[file_id] = file_record
-            self._save_metadata()
+    async def _ingest_embed(self, db_id: str, chunks: List[Dict]) -> Optional[List[List[float]]]:
+        """向量化阶段：预先计算向量，使其与其他文件的解析/写入重叠执行"""
+        if not chunks:
+            return None
 
-            try:
-                # 根据内容类型处理内容
-                if content_type == "file":
-                    markdown_content = await self._process_file_to_markdown(item, params=params)
-                else:  # URL
-                    markdown_content = await self._process_url_to_markdown(item, params=params)
-
-                # 分割文本成块
-                chunks = self._split_text_into_chunks(markdown_content, file_id, filename)
-                logger.info(f"Split {filename} into {len(chunks)} chunks")
-
-                # 准备向量数据库插入的数据
-                if chunks:
-                    documents = [chunk["content"] for chunk in chunks]
-                    metadatas = [chunk["metadata"] for chunk in chunks]
-                    ids = [chunk["id"] for chunk in chunks]
-
-                    # 插入到 ChromaDB
-                    collection.add(
-                        documents=documents,
-                        metadatas=metadatas,
-                        ids=ids
-                    )
-
-                logger.info(f"Inserted {content_type} {item} into ChromaDB. Done.")
-
-                # 更新状态为完成
-                self.files_meta[file_id]["status"] = "done"
-                self._save_metadata()
-                file_record['status'] = "done"
+        return await self._aembed_texts(db_id, [chunk["content"] for chunk in chunks])
 
-            except Exception as e:
-                logger.error(f"处理{content_type} {item} 失败: {e}, {traceback.format_exc()}")
-                self.files_meta[file_id]["status"] = "failed"
-                self._save_metadata()
-                file_record['status'] = "failed"
+    async def _ingest_insert(self, db_id: str, file_meta: Dict, content: str,
+                             chunks: List[Dict], embeddings: Optional[List[List[float]]]) -> None:
+        """写入阶段"""
+        if not chunks:
+            return
+
+        collection = await self._get_chroma_collection(db_id)
+        if not collection:
+            raise ValueError(f"Failed to get ChromaDB collection for {db_id}")
 
-            processed_items_info.append(file_record)
+        # 分批插入到 ChromaDB
+        batch_size = self._get_add_batch_size()
+        for i in range(0, len(chunks), batch_size):
+            batch = chunks[i:i + batch_size]
+            await self._run(
+                "add", collection.add,
+                documents=[chunk["content"] for chunk in batch],
+                metadatas=[chunk["metadata"] for chunk in batch],
+                ids=[chunk["id"] for chunk in batch],
+                embeddings=embeddings[i:i + batch_size] if embeddings is not None else None
+            )
+        await self._lexical_add(db_id, chunks)
 
-        return processed_items_info
+    async def _get_file_chunk_index(self, db_id: str, file_id: str) -> Optional[Dict[str, int]]:
+        """获取文件已入库分块的 {chunk_id: chunk_index}"""
+        collection = await self._get_chroma_collection(db_id)
+        if not collection:
+            raise ValueError(f"Failed to get ChromaDB collection for {db_id}")
 
-    async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
-        """异步查询知识库"""
+        results = await self._run("get", collection.get, where={"full_doc_id": file_id}, include=["metadatas"])
+        metadatas = results.get("metadatas") or []
+        return {
+            chunk_id: (metadatas[i] or {}).get("chunk_index", -1) if i < len(metadatas) else -1
+            for i, chunk_id in enumerate(results.get("ids") or [])
+        }
+
+    async def _ingest_remove(self, db_id: str, file_id: str,
+                             chunk_ids: Optional[List[str]] = None) -> None:
+        """删除文件的旧分块"""
         collection = await self._get_chroma_collection(db_id)
         if not collection:
-            raise ValueError(f"Database {db_id} not found")
+            raise ValueError(f"Failed to get ChromaDB collection for {db_id}")
 
-        try:
-            # 设置查询参数 - ChromaDB 知识库特有的参数
-            top_k = kwargs.get("top_k", 10)
-            similarity_threshold = kwargs.get("similarity_threshold", 0.0)  # 相似度阈值
-            include_distances = kwargs.get("include_distances", True)  # 是否包含距离信息
+        if chunk_ids is None:
+            await self._run("delete", collection.delete, where={"full_doc_id": file_id})
+        elif chunk_ids:
+            await self._run("delete", collection.delete, ids=chunk_ids)
+            logger.info(f"Deleted {len(chunk_ids)} stale chunks for file {file_id}")
+        await self._lexical_remove(db_id, file_id, chunk_ids)
 
-            # 执行相似性搜索
-            results = collection.query(
-                query_texts=[query_text],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"] if include_distances else ["documents", "metadatas"]
-            )
+    async def _ingest_update_chunks(self, db_id: str, chunks: List[Dict]) -> None:
+        """更新位置变化的分块元数据"""
+        collection = await self._get_chroma_collection(db_id)
+        if not collection:
+            raise ValueError(f"Failed to get ChromaDB collection for {db_id}")
+
+        await self._run(
+            "update", collection.update,
+            ids=[chunk["id"] for chunk in chunks],
+            metadatas=[chunk["metadata"] for chunk in chunks]
+        )
+
+    async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
+        """异步查询知识库"""
+        return (await self.abatch_query([query_text], db_id, **kwargs))[0]
 
-            # 处理结果
-            if results and results.get("documents") and results["documents"][0]:
-                documents = results["documents"][0]
-                metadatas = results["metadatas"][0] if results.get("metadatas") else []
-                distances = results["distances"][0] if results.get("distances") else []
-
-                # 构建上下文，应用相似度阈值过滤
-                contexts = []
-                for i, doc in enumerate(documents):
-                    # 计算相似度（距离越小相似度越高）
-                    similarity = 1 - distances[i] if i < len(distances) else 1.0
-
-                    # 应用相似度阈值过滤
-                    if similarity < similarity_threshold:
-                        continue
-
-                    context = f"[文档片段 {i+1}]:\n{doc}\n"
-                    if i < len(metadatas) and metadatas[i]:
-                        source = metadatas[i].get("source", "未知来源")
-                        chunk_id = metadatas[i].get("chunk_id", f"chunk_{i}")
-                        context += f"来源: {source} ({chunk_id})\n"
-                    if include_distances and i < len(distances):
-                        context += f"相似度: {similarity:.3f}\n"
-                    contexts.append(context)
-
-                response = "\n".join(contexts)
-                logger.debug(f"ChromaDB query response: {len(contexts)} chunks found (after similarity filtering)")
-                return response
-
-            return ""
+    async def abatch_query(self, queries: List[str], db_id: str, **kwargs) -> List[str]:
+        """批量查询：检索后格式化为上下文文本"""
+        if not queries:
+            return []
+
+        try:
+            include_distances = kwargs.get("include_distances", True)  # 是否包含距离信息
+            results = await self.abatch_retrieve(queries, db_id, **kwargs)
+            logger.debug(f"ChromaDB query response: {[len(hits) for hits in results]} chunks found")
+            return [format_hits(hits, include_distances) for hits in results]
 
         except Exception as e:
             logger.error(f"ChromaDB query error: {e}, {traceback.format_exc()}")
-            return ""
+            return [""] * len(queries)
+
+    async def abatch_retrieve(self, queries: List[str], db_id: str, **kwargs) -> List[List[RetrievalHit]]:
+        """批量结构化检索：向量检索一次计算所有查询向量、一次 collection.query 完成，按 fusion_mode 与 BM25 结果融合"""
+        collection = await self._get_chroma_collection(db_id)
+        if not collection:
+            raise ValueError(f"Database {db_id} not found")
+
+        return await super().abatch_retrieve(queries, db_id, **kwargs)
+
+    def _to_hit(self, db_id: str, chunk_id: str, content: str, metadata: Optional[Dict],
+                similarity: Optional[float] = None) -> RetrievalHit:
+        metadata = metadata or {}
+        return RetrievalHit(
+            id=chunk_id,
+            content=content or "",
+            chunk_id=metadata.get("chunk_id"),
+            file_id=metadata.get("full_doc_id"),
+            chunk_index=metadata.get("chunk_index"),
+            source=metadata.get("source"),
+            similarity=similarity,
+            db_id=db_id,
+        )
+
+    async def _vector_search(self, db_id: str, queries: List[str], top_k: int,
+                             params: Dict) -> List[List[RetrievalHit]]:
+        """向量检索"""
+        collection = await self._get_chroma_collection(db_id)
+        query_embeddings = await self._aembed_texts(db_id, queries)
+        results = await self._run(
+            "query", collection.query,
+            query_embeddings=query_embeddings,
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"]
+        )
+
+        hits = []
+        for q in range(len(queries)):
+            ids = results["ids"][q] if results and results.get("ids") else []
+            documents = results["documents"][q] if results.get("documents") else []
+            metadatas = results["metadatas"][q] if results.get("metadatas") else []
+            distances = results["distances"][q] if results.get("distances") else []
+            hits.append([self._to_hit(
+                db_id, chunk_id,
+                documents[i] if i < len(documents) else "",
+                metadatas[i] if i < len(metadatas) else None,
+                # 计算相似度（距离越小相似度越高）
+                similarity=1 - distances[i] if i < len(distances) else 1.0,
+            ) for i, chunk_id in enumerate(ids)])
+        return hits
+
+    async def _fetch_chunks(self, db_id: str, chunk_ids: List[str]) -> Dict[str, RetrievalHit]:
+        """按分块ID读取分块内容"""
+        collection = await self._get_chroma_collection(db_id)
+        results = await self._run("get", collection.get, ids=chunk_ids, include=["documents", "metadatas"])
+        documents = results.get("documents") or []
+        metadatas = results.get("metadatas") or []
+        return {
+            chunk_id: self._to_hit(db_id, chunk_id,
+                                   documents[i] if i < len(documents) else "",
+                                   metadatas[i] if i < len(metadatas) else None)
+            for i, chunk_id in enumerate(results.get("ids") or [])
+        }
+
+    async def _iter_stored_chunks(self, db_id: str, batch_size: int = 1000):
+        """分批读取集合中的全部分块"""
+        collection = await self._get_chroma_collection(db_id)
+        offset = 0
+        while True:
+            results = await self._run("get", collection.get, include=["documents", "metadatas"],
+                                      limit=batch_size, offset=offset)
+            ids = results.get("ids") or []
+            if not ids:
+                break
+            yield [{
+                "id": chunk_id,
+                "file_id": (results["metadatas"][i] or {}).get("full_doc_id", ""),
+                "content": results["documents"][i] or "",
+            } for i, chunk_id in enumerate(ids)]
+            offset += len(ids)
 
     async def delete_file(self, db_id: str, file_id: str) -> None:
         """删除文件"""
@@ -284,25 +443,23 @@ class ChromaKB(KnowledgeBase):
         if collection:
             try:
                 # 查找所有相关的chunks
-                results = collection.get(
-                    where={"full_doc_id": file_id},
-                    include=["metadatas"]
-                )
+                results = await self._run("get", collection.get, where={"full_doc_id": file_id}, include=[])
 
                 # 删除所有相关chunks
                 if results and results.get("ids"):
-                    collection.delete(ids=results["ids"])
+                    await self._run("delete", collection.delete, ids=results["ids"])
                     logger.info(f"Deleted {len(results['ids'])} chunks for file {file_id}")
 
             except Exception as e:
                 logger.error(f"Error deleting file {file_id} from ChromaDB: {e}")
 
+        await self._lexical_remove(db_id, file_id)
+
         # 删除文件记录
-        if file_id in self.files_meta:
-            del self.files_meta[file_id]
-            self._save_metadata()
+        self._remove_file_meta(file_id)
 
-    async def get_file_info(self, db_id: str, file_id: str) -> Dict:
+    async def get_file_info(self, db_id: str, file_id: str, page: int = 1,
+                            page_size: Optional[int] = None) -> Dict:
         """获取文件信息和chunks"""
         if file_id not in self.files_meta:
             raise Exception(f"File not found: {file_id}")
@@ -312,7 +469,8 @@ class ChromaKB(KnowledgeBase):
         if collection:
             try:
                 # 获取文档的所有chunks
-                results = collection.get(
+                results = await self._run(
+                    "get", collection.get,
                     where={"full_doc_id": file_id},
                     include=["documents", "metadatas"]
                 )
@@ -331,7 +489,7 @@ class ChromaKB(KnowledgeBase):
 
                 # 按 chunk_order_index 排序
                 doc_chunks.sort(key=lambda x: x.get("chunk_order_index", 0))
-                return {"lines": doc_chunks}
+                return self._paginate_lines(doc_chunks, page, page_size)
 
             except Exception as e:
                 logger.error(f"Error getting chunks for file {file_id}: {e}")
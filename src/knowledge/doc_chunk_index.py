@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import time
+import threading
+from typing import List, Optional, Tuple
+
+from src.utils import logger
+
+
+class DocChunkIndex:
+    """
+    文档到分块的索引，保存在 SQLite 中
+
+    记录 (文档ID, 分块ID, 分块序号)，按文档读取分块ID时只访问该文档的记录，并支持按序号分页；
+    meta 表记录索引是否已从 text_chunks 全量重建过，重启后无需再次重建。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS doc_chunks (
+                doc_id TEXT NOT NULL,
+                chunk_order_index INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (doc_id, chunk_order_index, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self._rebuilt = self._conn.execute("SELECT 1 FROM meta WHERE key = 'rebuilt'").fetchone() is not None
+
+    @property
+    def rebuilt(self) -> bool:
+        """是否已从 text_chunks 全量重建过，且之后每个文档的分块都已记录"""
+        return self._rebuilt
+
+    def set_rebuilt(self, rebuilt: bool) -> None:
+        """记录或清除全量重建标记，单个文档的分块记录失败时清除，下次读取时重新全量重建"""
+        if rebuilt == self._rebuilt:
+            return
+        with self._lock, self._conn:
+            if rebuilt:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rebuilt', ?)",
+                                   (str(time.time()),))
+            else:
+                self._conn.execute("DELETE FROM meta WHERE key = 'rebuilt'")
+        self._rebuilt = rebuilt
+
+    def set_doc(self, doc_id: str, chunks: List[Tuple[str, int]]) -> None:
+        """
+        设置文档的分块（覆盖已有记录）
+
+        Args:
+            doc_id: 文档ID
+            chunks: [(分块ID, 分块序号)]
+        """
+        self.set_docs({doc_id: chunks})
+
+    def set_docs(self, docs: dict) -> None:
+        """批量设置多个文档的分块 {doc_id: [(分块ID, 分块序号)]}"""
+        with self._lock, self._conn:
+            for doc_id, chunks in docs.items():
+                self._conn.execute("DELETE FROM doc_chunks WHERE doc_id = ?", (doc_id,))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO doc_chunks (doc_id, chunk_order_index, chunk_id) VALUES (?, ?, ?)",
+                    [(doc_id, order, chunk_id) for chunk_id, order in chunks]
+                )
+
+    def remove_doc(self, doc_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM doc_chunks WHERE doc_id = ?", (doc_id,))
+
+    def count(self, doc_id: str) -> int:
+        """文档的分块数量，未建立索引的文档返回 0"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM doc_chunks WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+
+    def get_chunk_ids(self, doc_id: str, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """
+        按分块序号读取文档的分块ID
+
+        Args:
+            doc_id: 文档ID
+            offset: 跳过的数量
+            limit: 返回的数量，None 表示全部
+
+        Returns:
+            分块ID列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM doc_chunks WHERE doc_id = ? ORDER BY chunk_order_index LIMIT ? OFFSET ?",
+                (doc_id, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.warning(f"Failed to close doc chunk index {self.db_path}: {e}")
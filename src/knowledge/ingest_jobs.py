@@ -0,0 +1,265 @@
+import time
+import asyncio
+import traceback
+from typing import Dict, List, Optional
+
+from src.knowledge.metadata_store import MetadataStore
+from src.utils import logger, hashstr
+
+
+class IngestionJobManager:
+    """
+    入库任务管理器
+
+    将 add_content 包装为持久化的后台任务：提交后立即返回任务ID，由后台 worker 从队列中依次取出执行。
+    任务及每个文件的进度按行保存在 MetadataStore 中，服务重启后未完成的任务会重新入队，并跳过已经完成的文件。
+    已结束的任务保留 retention_days 天后清理。
+    """
+
+    def __init__(self, kb_manager, metadata_store: MetadataStore,
+                 num_workers: int = 2, retention_days: float = 7):
+        """
+        Args:
+            kb_manager: 知识库管理器（KnowledgeBaseManager）
+            metadata_store: 保存任务记录的元数据存储
+            num_workers: 同时执行的任务数量
+            retention_days: 已结束任务的保留天数
+        """
+        self.kb_manager = kb_manager
+        self.metadata_store = metadata_store
+        self.num_workers = num_workers
+        self.retention = retention_days * 24 * 3600
+
+        # 任务记录 {job_id: job}
+        self.jobs: Dict[str, Dict] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+        self._load_jobs()
+
+    def start(self):
+        """启动后台 worker 并恢复未完成的任务，需要在事件循环中调用"""
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        self._prune_jobs()
+        for job in sorted(self.jobs.values(), key=lambda j: j["created_at"]):
+            if job["status"] in ("pending", "running"):
+                job["status"] = "pending"
+                self._save_job(job)
+                self._queue.put_nowait(job["job_id"])
+                logger.info(f"Resuming ingestion job {job['job_id']} for {job['db_id']}")
+
+        for _ in range(self.num_workers):
+            self._workers.append(asyncio.create_task(self._worker()))
+        logger.info(f"Ingestion job manager started with {self.num_workers} workers")
+
+    def submit(self, db_id: str, items: List[str], params: Optional[Dict] = None) -> Dict:
+        """
+        提交入库任务
+
+        Args:
+            db_id: 数据库ID
+            items: 文件路径或URL列表
+            params: 处理参数
+
+        Returns:
+            任务信息
+        """
+        # 先启动 worker（恢复历史任务），再登记新任务，避免新任务被重复入队
+        self.start()
+
+        job_id = f"job_{hashstr(db_id + str(items), 8, with_salt=True)}"
+        job = {
+            "job_id": job_id,
+            "db_id": db_id,
+            "params": params or {},
+            "status": "pending",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "files": [{
+                "item": item,
+                "file_id": None,
+                "stage": "pending",
+                "status": "pending",
+                "chunks": 0,
+                "error": None,
+                "finished_at": None,
+                "created_new": None,
+            } for item in items],
+        }
+        self.jobs[job_id] = job
+        self._save_job(job, with_files=True)
+
+        self._queue.put_nowait(job_id)
+        logger.info(f"Submitted ingestion job {job_id} for {db_id} with {len(items)} items")
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str, with_files: bool = True) -> Optional[Dict]:
+        """
+        获取任务信息及进度
+
+        Args:
+            job_id: 任务ID
+            with_files: 是否包含每个文件的进度
+
+        Returns:
+            任务信息或None
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        info = {k: v for k, v in job.items() if k != "files"}
+        info["progress"] = self._compute_progress(job)
+        if with_files:
+            info["files"] = [f.copy() for f in job["files"]]
+        return info
+
+    def list_jobs(self, db_id: Optional[str] = None) -> List[Dict]:
+        """列出任务（不含文件明细），按创建时间倒序"""
+        jobs = [j for j in self.jobs.values() if db_id is None or j["db_id"] == db_id]
+        jobs.sort(key=lambda j: j["created_at"], reverse=True)
+        return [self.get_job(j["job_id"], with_files=False) for j in jobs]
+
+    def _compute_progress(self, job: Dict) -> Dict:
+        """根据文件状态计算进度、吞吐与预计剩余时间"""
+        files = job["files"]
+        total = len(files)
+        finished = [f for f in files if f["status"] in ("done", "failed")]
+        chunks = sum(f.get("chunks") or 0 for f in files)
+        stages = {}
+        for f in files:
+            stages[f["stage"]] = stages.get(f["stage"], 0) + 1
+
+        progress = {
+            "total": total,
+            "completed": len(finished),
+            "failed": len([f for f in finished if f["status"] == "failed"]),
+            "chunks": chunks,
+            "stages": stages,
+            "files_per_second": None,
+            "chunks_per_second": None,
+            "eta_seconds": None,
+        }
+
+        # 吞吐只统计本次运行期间完成的文件，避免恢复的任务把之前完成的文件算进来
+        started_at = job.get("started_at")
+        if started_at:
+            end = job.get("finished_at") or time.time()
+            elapsed = max(end - started_at, 1e-6)
+            run_finished = [f for f in finished if (f.get("finished_at") or 0) >= started_at]
+            run_chunks = sum(f.get("chunks") or 0 for f in run_finished)
+            files_per_second = len(run_finished) / elapsed
+            progress["files_per_second"] = round(files_per_second, 4)
+            progress["chunks_per_second"] = round(run_chunks / elapsed, 4)
+            if job["status"] == "running" and files_per_second > 0:
+                progress["eta_seconds"] = round((total - len(finished)) / files_per_second, 1)
+
+        return progress
+
+    async def _worker(self):
+        """后台 worker，从队列中取出任务执行"""
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} crashed: {e}, {traceback.format_exc()}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str):
+        """执行任务中尚未完成的文件"""
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != "pending":
+            return
+
+        db_id = job["db_id"]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        self._save_job(job)
+
+        # 跳过已有结果的文件。上次中断时处理到一半的文件：本任务新建的记录先清理再重新处理；
+        # 更新已有文件的记录不能删除（其中仍是上一版本的内容），重新处理时会按路径找到它并再次执行更新
+        positions = [i for i, f in enumerate(job["files"]) if f["status"] not in ("done", "failed")]
+        for position in positions:
+            file_state = job["files"][position]
+            if file_state["file_id"] and file_state.get("created_new"):
+                try:
+                    await self.kb_manager.delete_file(db_id, file_state["file_id"])
+                except Exception as e:
+                    logger.warning(f"Failed to clean up interrupted file {file_state['file_id']}: {e}")
+            if file_state["file_id"]:
+                file_state.update(file_id=None, stage="pending", status="pending", chunks=0, error=None,
+                                  created_new=None)
+                self._save_job_file(job, position)
+
+        def on_progress(index: int, update: Dict):
+            file_state = job["files"][positions[index]]
+            for key in ("stage", "file_id", "chunks", "status", "error", "created_new"):
+                if key in update:
+                    file_state[key] = update[key]
+            if update.get("status") in ("done", "failed"):
+                file_state["finished_at"] = time.time()
+            # 只在文件开始和结束时落盘，阶段变化仅保存在内存中
+            if "file_id" in update or "status" in update:
+                self._save_job_file(job, positions[index])
+
+        try:
+            if positions:
+                await self.kb_manager.add_content(db_id, [job["files"][i]["item"] for i in positions],
+                                                  job["params"], progress_callback=on_progress)
+            job["status"] = "done"
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}, {traceback.format_exc()}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+        job["finished_at"] = time.time()
+        self._save_job(job)
+        logger.info(f"Ingestion job {job_id} finished with status {job['status']}")
+        self._prune_jobs()
+
+    def _prune_jobs(self):
+        """清理超过保留期限的已结束任务"""
+        if not self.retention:
+            return
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job["status"] in ("done", "failed") and (job.get("finished_at") or 0) < cutoff]
+        if not expired:
+            return
+        try:
+            self.metadata_store.delete_jobs(expired)
+        except Exception as e:
+            logger.error(f"Failed to delete expired ingestion jobs: {e}")
+            return
+        for job_id in expired:
+            del self.jobs[job_id]
+        logger.info(f"Removed {len(expired)} expired ingestion jobs")
+
+    def _load_jobs(self):
+        """加载任务记录"""
+        try:
+            self.jobs = self.metadata_store.load_jobs()
+            logger.info(f"Loaded {len(self.jobs)} ingestion jobs")
+        except Exception as e:
+            logger.error(f"Failed to load ingestion jobs: {e}")
+
+    def _save_job(self, job: Dict, with_files: bool = False):
+        """保存任务记录（不含文件进度，提交任务时除外）"""
+        try:
+            self.metadata_store.save_job(job, with_files=with_files)
+        except Exception as e:
+            logger.error(f"Failed to save ingestion job {job['job_id']}: {e}")
+
+    def _save_job_file(self, job: Dict, position: int):
+        """保存任务中一个文件的进度"""
+        try:
+            self.metadata_store.save_job_file(job["job_id"], position, job["files"][position])
+        except Exception as e:
+            logger.error(f"Failed to save ingestion job {job['job_id']} file {position}: {e}")
@@ -0,0 +1,196 @@
+import asyncio
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from src.knowledge.kb_utils import prepare_item_metadata, hash_file, hash_text
+from src.utils import logger
+
+
+class IngestionPipeline:
+    """
+    多文件并发入库流水线
+
+    每个文件依次经过 解析(parse) -> 分块(chunk) -> 向量化(embed) -> 写入(insert) 四个阶段，
+    不同文件处于不同阶段时相互重叠执行。同一知识库内同时处理的文件数量受
+    KnowledgeBase.get_ingest_concurrency 限制，各阶段的具体实现由 KnowledgeBase 的
+    _ingest_parse / _ingest_chunk / _ingest_embed / _ingest_insert 提供。
+    """
+
+    STAGES = ("parse", "chunk", "embed", "insert")
+
+    def __init__(self, kb, db_id: str, params: Optional[Dict] = None,
+                 progress_callback: Optional[Callable[[int, Dict], None]] = None):
+        """
+        Args:
+            kb: 知识库实例（KnowledgeBase 子类）
+            db_id: 数据库ID
+            params: 处理参数
+            progress_callback: 进度回调，参数为 (item 在输入列表中的下标, 进度信息)
+        """
+        self.kb = kb
+        self.db_id = db_id
+        self.params = params or {}
+        self.progress_callback = progress_callback
+        self.content_type = self.params.get('content_type', 'file')
+
+        concurrency = kb.get_ingest_concurrency(db_id)
+        self.stage_limits = {
+            "parse": asyncio.Semaphore(concurrency),
+            "chunk": asyncio.Semaphore(max(1, concurrency // 2)),
+            "embed": asyncio.Semaphore(concurrency),
+            "insert": asyncio.Semaphore(kb.insert_concurrency),
+        }
+
+    async def run(self, items: List[str]) -> List[Dict]:
+        """
+        并发处理所有文件，按输入顺序返回每个文件的处理记录
+
+        Args:
+            items: 文件路径或URL列表
+
+        Returns:
+            处理结果列表
+        """
+        start = time.time()
+        # 入库期间数据库实例不会被实例池淘汰
+        with self.kb.instance_in_use(self.db_id):
+            results = await asyncio.gather(*[self._process_item(index, item) for index, item in enumerate(items)])
+
+            # 所有文件写入完成后统一收尾（如落盘、压缩），失败不影响已写入的文件
+            try:
+                await self.kb._ingest_finalize(self.db_id)
+            except Exception as e:
+                logger.error(f"Failed to finalize ingestion for {self.db_id}: {e}, {traceback.format_exc()}")
+
+        failed = len([r for r in results if r.get("status") == "failed"])
+        logger.info(f"Ingested {len(items)} {self.content_type}s into {self.db_id} "
+                    f"in {time.time() - start:.2f}s, {failed} failed")
+        return list(results)
+
+    def _report(self, index: int, **update):
+        """上报单个文件的进度，回调异常不影响入库"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(index, update)
+        except Exception as e:
+            logger.warning(f"Ingestion progress callback failed: {e}")
+
+    async def _process_item(self, index: int, item: str) -> Dict:
+        """处理单个文件/URL，失败时记录状态而不是抛出异常"""
+        kb = self.kb
+
+        # 准备文件元数据，文件内容哈希在线程中流式计算
+        metadata = prepare_item_metadata(item, self.content_type, self.db_id)
+        if self.content_type == "file":
+            metadata["content_hash"] = await asyncio.to_thread(hash_file, item)
+
+        # 去重检查与登记文件记录在同一把数据库锁内完成，同一批次或并发任务中的相同内容只会入库一次
+        async with kb.get_ingest_lock(self.db_id):
+            # 相同内容已经入库或正在入库：不做任何处理
+            if self.content_type == "file":
+                duplicate_id = kb.find_file(self.db_id, content_hash=metadata["content_hash"],
+                                            statuses=("done", "processing"))
+                if duplicate_id:
+                    return self._skip(index, duplicate_id)
+
+            # 同一路径的旧版本，或上传到该数据库的同名文件：复用其 file_id，只更新有变化的分块
+            previous_id = kb.find_file(self.db_id, path=metadata["path"], statuses=("done", "failed"))
+            if not previous_id and self.content_type == "file" and kb.is_upload_path(self.db_id, item):
+                previous_id = kb.find_file(self.db_id, filename=metadata["filename"], statuses=("done", "failed"))
+                if previous_id and not kb.is_upload_path(self.db_id, kb.files_meta[previous_id].get("path", "")):
+                    previous_id = None
+            previous_hash = kb.files_meta[previous_id].get("content_hash") if previous_id else None
+            if previous_id:
+                metadata["file_id"] = previous_id
+                logger.info(f"{item} changed, updating existing file {previous_id}")
+            file_id = metadata["file_id"]
+
+            # 添加文件记录（与 files_meta 中的记录为同一对象，状态更新会同步反映）
+            file_record = metadata.copy()
+            kb.files_meta[file_id] = file_record
+            kb._save_file_meta(file_id)
+        self._report(index, stage="waiting", file_id=file_id, created_new=not previous_id)
+
+        async with kb.get_ingest_semaphore(self.db_id):
+            try:
+                self._report(index, stage="parse")
+                async with self.stage_limits["parse"]:
+                    content = await kb._ingest_parse(self.db_id, item, self.content_type, self.params)
+
+                # URL 只能在获取内容后计算哈希，内容未变化时直接结束
+                if self.content_type != "file":
+                    file_record["content_hash"] = metadata["content_hash"] = hash_text(content)
+                    if previous_id and previous_hash == metadata["content_hash"]:
+                        file_record['status'] = "done"
+                        kb._save_file_meta(file_id)
+                        return self._skip(index, file_id)
+
+                self._report(index, stage="chunk")
+                async with self.stage_limits["chunk"]:
+                    chunks = await asyncio.to_thread(kb._ingest_chunk, self.db_id, metadata, content, self.params)
+                if chunks:
+                    logger.info(f"Split {metadata['filename']} into {len(chunks)} chunks")
+
+                # 对比已入库的分块，只向量化新增的分块
+                existing = await kb._get_file_chunk_index(self.db_id, file_id) if previous_id else {}
+                if existing is None:
+                    new_chunks, stale_ids, moved_chunks = chunks, None, []
+                else:
+                    current_ids = {chunk["id"] for chunk in chunks}
+                    new_chunks = [chunk for chunk in chunks if chunk["id"] not in existing]
+                    stale_ids = [chunk_id for chunk_id in existing if chunk_id not in current_ids]
+                    moved_chunks = [chunk for chunk in chunks
+                                    if chunk["id"] in existing and existing[chunk["id"]] != chunk["chunk_index"]]
+                if previous_id:
+                    logger.info(f"{metadata['filename']}: {len(new_chunks)} new chunks, "
+                                f"{'all' if stale_ids is None else len(stale_ids)} stale chunks")
+
+                self._report(index, stage="embed", chunks=len(chunks))
+                async with self.stage_limits["embed"]:
+                    embeddings = await kb._ingest_embed(self.db_id, new_chunks)
+
+                self._report(index, stage="insert")
+                async with self.stage_limits["insert"]:
+                    # 不支持分块级增量更新时，先整体删除旧版本再写入
+                    if previous_id and stale_ids is None:
+                        await kb._ingest_remove(self.db_id, file_id, None)
+                    await kb._ingest_insert(self.db_id, metadata, content, new_chunks, embeddings)
+                    if stale_ids:
+                        await kb._ingest_remove(self.db_id, file_id, stale_ids)
+                    if moved_chunks:
+                        await kb._ingest_update_chunks(self.db_id, moved_chunks)
+
+                # 等待写入真正提交（底层可能缓冲后批量写入），不占用写入阶段的并发额度
+                await kb._ingest_commit(self.db_id, file_id)
+
+                logger.info(f"Inserted {self.content_type} {item} into {kb.kb_type}. Done.")
+
+                # 更新状态为完成
+                file_record['chunk_count'] = len(chunks)
+                file_record['status'] = "done"
+                kb._save_file_meta(file_id)
+
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"处理{self.content_type} {item} 失败: {error_msg}, {traceback.format_exc()}")
+                file_record['status'] = "failed"
+                file_record['error'] = error_msg
+                kb._save_file_meta(file_id)
+                try:
+                    await kb._ingest_abort(self.db_id, file_id)
+                except Exception as abort_error:
+                    logger.error(f"Failed to clean up buffered writes of {file_id}: {abort_error}")
+
+        self._report(index, stage=file_record['status'], status=file_record['status'], error=file_record.get('error'))
+        return file_record
+
+    def _skip(self, index: int, file_id: str) -> Dict:
+        """内容未变化，返回已有的文件记录"""
+        logger.info(f"Content of {file_id} unchanged, skipped")
+        record = self.kb.files_meta[file_id].copy()
+        record["file_id"] = file_id
+        record["skipped"] = True
+        self._report(index, stage="done", file_id=file_id, status="done", error=None)
+        return record
@@ -0,0 +1,177 @@
+import time
+import asyncio
+import inspect
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.utils import logger
+
+
+class InstancePool:
+    """
+    按数据库缓存底层实例（LightRAG 实例、向量集合）的 LRU 池
+
+    超过 max_size 时淘汰最久未使用的实例，超过 idle_timeout 秒未使用的实例由后台任务淘汰；
+    正在使用（is_busy 返回 True）的实例不会被淘汰。淘汰时调用 release 释放资源，
+    下次使用时由 get_or_create 重新创建，释放完成前不会重新创建同一数据库的实例。
+    """
+
+    def __init__(self, name: str, max_size: int = 32, idle_timeout: float = 1800,
+                 release: Optional[Callable[[str, Any], Any]] = None,
+                 is_busy: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            name: 池名称，用于日志
+            max_size: 最多常驻的实例数量
+            idle_timeout: 空闲多少秒后淘汰，0 表示不按空闲时间淘汰
+            release: 释放实例的函数 (db_id, instance)，可以是协程函数
+            is_busy: 判断数据库是否正在使用的函数 (db_id) -> bool
+        """
+        self.name = name
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._release_func = release
+        self._is_busy = is_busy or (lambda key: False)
+
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._releasing: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, key: str) -> Any:
+        instance = self._entries[key]
+        self._touch(key)
+        return instance
+
+    def __setitem__(self, key: str, instance: Any) -> None:
+        self._entries[key] = instance
+        self._touch(key)
+        self._evict_overflow()
+        self._ensure_sweeper()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self._entries:
+            return default
+        return self[key]
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        """移出实例但不释放，用于调用方自行处理（如删除数据库）"""
+        self._last_used.pop(key, None)
+        return self._entries.pop(key, default)
+
+    def keys(self):
+        return self._entries.keys()
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        获取实例，不存在时调用 factory 创建；同一数据库的并发创建只执行一次
+
+        Args:
+            key: 数据库ID
+            factory: 创建实例的协程函数，返回 None 表示创建失败（不缓存）
+
+        Returns:
+            实例或 None
+        """
+        if key in self._entries:
+            return self[key]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key in self._entries:
+                return self[key]
+
+            # 等待上一次淘汰的释放完成，避免新加载的实例被随后的释放操作卸载
+            releasing = self._releasing.get(key)
+            if releasing is not None:
+                await asyncio.shield(releasing)
+
+            instance = await factory()
+            if instance is not None:
+                self.loads += 1
+                self[key] = instance
+            return instance
+
+    def evict_idle(self) -> int:
+        """淘汰空闲超时的实例，返回淘汰数量"""
+        if not self.idle_timeout:
+            return 0
+        now = time.time()
+        expired = [key for key in self._entries
+                   if now - self._last_used.get(key, now) > self.idle_timeout and not self._is_busy(key)]
+        for key in expired:
+            self._evict(key, "idle")
+        return len(expired)
+
+    def stats(self) -> Dict:
+        """常驻实例统计"""
+        return {
+            "resident": len(self._entries),
+            "max_size": self.max_size,
+            "idle_timeout": self.idle_timeout,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "releasing": len(self._releasing),
+        }
+
+    def _touch(self, key: str) -> None:
+        self._entries.move_to_end(key)
+        self._last_used[key] = time.time()
+
+    def _evict_overflow(self) -> None:
+        """超出容量时按最久未使用的顺序淘汰，跳过正在使用的实例"""
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            if not self._is_busy(key):
+                self._evict(key, "lru")
+
+    def _evict(self, key: str, reason: str) -> None:
+        instance = self.pop(key)
+        self.evictions += 1
+        logger.info(f"Evicting {self.name} instance {key} ({reason}), {len(self._entries)} resident")
+        if self._release_func is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning(f"No running event loop, {self.name} instance {key} is dropped without release")
+            return
+
+        task = loop.create_task(self._release(key, instance))
+        self._releasing[key] = task
+        task.add_done_callback(lambda _: self._releasing.pop(key, None) if self._releasing.get(key) is task else None)
+
+    async def _release(self, key: str, instance: Any) -> None:
+        try:
+            result = self._release_func(key, instance)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.warning(f"Failed to release {self.name} instance {key}: {e}")
+
+    def _ensure_sweeper(self) -> None:
+        """首次写入时在当前事件循环中启动空闲淘汰任务"""
+        if not self.idle_timeout or (self._sweeper is not None and not self._sweeper.done()):
+            return
+        try:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        except RuntimeError:
+            pass
+
+    async def _sweep(self) -> None:
+        interval = max(1.0, min(self.idle_timeout / 2, 60))
+        while self._entries:
+            await asyncio.sleep(interval)
+            self.evict_idle()
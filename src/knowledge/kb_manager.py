@@ -1,11 +1,19 @@
 import os
 import json
 import time
-from typing import Dict, Optional, List, Any
+import asyncio
+import hashlib
+from typing import Dict, Optional, List, Any, Callable
 from datetime import datetime
 
 from src.knowledge.knowledge_base import KnowledgeBase, KBNotFoundError, KBOperationError
 from src.knowledge.kb_factory import KnowledgeBaseFactory
+from src.knowledge.ingest_jobs import IngestionJobManager
+from src.knowledge.upload_sessions import UploadSessionManager
+from src.knowledge.metadata_store import MetadataStore
+from src.knowledge.query_cache import QueryCache
+from src.knowledge.retrieval import RetrievalHit
+from src.knowledge.lexical_index import reciprocal_rank_fusion
 from src.utils import logger
 
 
@@ -38,33 +46,43 @@ class KnowledgeBaseManager:
         # 初始化已存在的知识库实例
         self._initialize_existing_kbs()
 
+        # 后台入库任务
+        self.job_manager = IngestionJobManager(
+            self, self.metadata_store,
+            retention_days=float(os.getenv("INGEST_JOB_RETENTION_DAYS", "7")))
+
+        # 可续传的分片上传会话
+        self.upload_sessions = UploadSessionManager(work_dir)
+
+        # 检索结果缓存，数据库内容变化时失效
+        self.query_cache = QueryCache(max_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+                                      ttl=float(os.getenv("QUERY_CACHE_TTL", "300")))
+
         logger.info("KnowledgeBaseManager initialized")
 
     def _load_global_metadata(self):
-        """加载全局元数据"""
-        meta_file = os.path.join(self.work_dir, "global_metadata.json")
-        if os.path.exists(meta_file):
-            try:
-                with open(meta_file, encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.global_databases_meta = data.get("databases", {})
-                logger.info(f"Loaded global metadata for {len(self.global_databases_meta)} databases")
-            except Exception as e:
-                logger.error(f"Failed to load global metadata: {e}")
+        """加载全局元数据，首次启动时导入旧版 global_metadata.json"""
+        self.metadata_store = MetadataStore(os.path.join(self.work_dir, "global_metadata.db"))
+        try:
+            self.metadata_store.import_json(os.path.join(self.work_dir, "global_metadata.json"), file_key=None)
+        except Exception as e:
+            logger.error(f"Failed to import global JSON metadata: {e}")
 
-    def _save_global_metadata(self):
-        """保存全局元数据"""
-        meta_file = os.path.join(self.work_dir, "global_metadata.json")
         try:
-            data = {
-                "databases": self.global_databases_meta,
-                "updated_at": datetime.now().isoformat(),
-                "version": "2.0"  # 标识新版本
-            }
-            with open(meta_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.global_databases_meta = self.metadata_store.load_databases()
+            logger.info(f"Loaded global metadata for {len(self.global_databases_meta)} databases")
         except Exception as e:
-            logger.error(f"Failed to save global metadata: {e}")
+            logger.error(f"Failed to load global metadata: {e}")
+
+    def _save_global_metadata(self, db_id: str):
+        """保存单个数据库的全局元数据"""
+        try:
+            if db_id in self.global_databases_meta:
+                self.metadata_store.save_database(db_id, self.global_databases_meta[db_id])
+            else:
+                self.metadata_store.delete_database(db_id)
+        except Exception as e:
+            logger.error(f"Failed to save global metadata for {db_id}: {e}")
 
     def _initialize_existing_kbs(self):
         """初始化已存在的知识库实例"""
@@ -176,7 +194,7 @@ class KnowledgeBaseManager:
             "kb_type": kb_type,
             "created_at": datetime.now().isoformat()
         }
-        self._save_global_metadata()
+        self._save_global_metadata(db_id)
 
         logger.info(f"Created {kb_type} database: {database_name} ({db_id})")
         return db_info
@@ -186,11 +204,12 @@ class KnowledgeBaseManager:
         try:
             kb_instance = self._get_kb_for_database(db_id)
             result = kb_instance.delete_database(db_id)
+            self.query_cache.invalidate(db_id)
 
             # 从全局元数据中删除
             if db_id in self.global_databases_meta:
                 del self.global_databases_meta[db_id]
-                self._save_global_metadata()
+                self._save_global_metadata(db_id)
 
             return result
         except KBNotFoundError as e:
@@ -198,15 +217,167 @@ class KnowledgeBaseManager:
             return {"message": "删除成功"}  # 兼容性：即使不存在也返回成功
 
     async def add_content(self, db_id: str, items: List[str],
-                         params: Optional[Dict] = None) -> List[Dict]:
+                         params: Optional[Dict] = None,
+                         progress_callback: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
         """添加内容（文件/URL）"""
         kb_instance = self._get_kb_for_database(db_id)
-        return await kb_instance.add_content(db_id, items, params)
+        try:
+            return await kb_instance.add_content(db_id, items, params, progress_callback=progress_callback)
+        finally:
+            self.query_cache.invalidate(db_id)
+
+    def submit_ingest_job(self, db_id: str, items: List[str],
+                          params: Optional[Dict] = None) -> Dict:
+        """提交后台入库任务，立即返回任务信息"""
+        self._get_kb_for_database(db_id)  # 提前校验数据库是否存在
+        return self.job_manager.submit(db_id, items, params)
+
+    def get_ingest_job(self, job_id: str) -> Optional[Dict]:
+        """获取入库任务进度"""
+        return self.job_manager.get_job(job_id)
+
+    def list_ingest_jobs(self, db_id: Optional[str] = None) -> List[Dict]:
+        """列出入库任务"""
+        return self.job_manager.list_jobs(db_id)
+
+    async def aquery(self, query_text: str, db_id: str, use_cache: bool = True, **kwargs) -> str:
+        """异步查询知识库，相同的查询优先返回缓存结果"""
+        return (await self.abatch_query([query_text], db_id, use_cache=use_cache, **kwargs))[0]
+
+    async def abatch_query(self, queries: List[str], db_id: str, use_cache: bool = True, **kwargs) -> List[str]:
+        """批量查询知识库，结果与 queries 一一对应，只对未命中缓存的查询执行检索"""
+        kb_instance = self._get_kb_for_database(db_id)
+
+        async def fetch(missing_queries: List[str]) -> List[str]:
+            if len(missing_queries) == 1:
+                return [await kb_instance.aquery(missing_queries[0], db_id, **kwargs)]
+            return await kb_instance.abatch_query(missing_queries, db_id, **kwargs)
+
+        return await self._cached_batch(db_id, queries, kwargs, fetch, use_cache)
 
-    async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
-        """异步查询知识库"""
+    async def aretrieve(self, query_text: str, db_id: str, use_cache: bool = True, **kwargs) -> List[RetrievalHit]:
+        """结构化检索，返回检索结果对象，可用 format_hits 格式化为上下文文本"""
+        return (await self.abatch_retrieve([query_text], db_id, use_cache=use_cache, **kwargs))[0]
+
+    async def abatch_retrieve(self, queries: List[str], db_id: str, use_cache: bool = True,
+                              **kwargs) -> List[List[RetrievalHit]]:
+        """批量结构化检索，与文本结果分开缓存"""
         kb_instance = self._get_kb_for_database(db_id)
-        return await kb_instance.aquery(query_text, db_id, **kwargs)
+
+        async def fetch(missing_queries: List[str]) -> List[List[RetrievalHit]]:
+            return await kb_instance.abatch_retrieve(missing_queries, db_id, **kwargs)
+
+        return await self._cached_batch(db_id, queries, {**kwargs, "result_type": "hits"}, fetch, use_cache)
+
+    async def aiter_ranked_hits(self, query_text: str, db_id: str, use_cache: bool = True, **kwargs):
+        """逐条产出最终排序后的检索结果（检索完成后才开始产出），命中缓存时直接产出缓存的结果"""
+        key = self.query_cache.make_key(db_id, query_text, {**kwargs, "result_type": "hits"})
+        cached = self.query_cache.get(key) if use_cache else None
+        if cached is not None:
+            for hit in cached:
+                yield hit
+            return
+
+        # 检索期间数据库内容变化时（版本号改变）结果不写入缓存
+        generation = self.query_cache.generation(db_id)
+        hits = []
+        async for hit in self._get_kb_for_database(db_id).aiter_ranked_hits(query_text, db_id, **kwargs):
+            hits.append(hit)
+            yield hit
+        if use_cache and hits:
+            self.query_cache.put(key, hits, generation=generation)
+
+    async def afederated_query(self, query_text: str, db_ids: Optional[List[str]] = None, top_k: int = 10,
+                               timeout: Optional[float] = None, use_cache: bool = True, **kwargs) -> Dict:
+        """
+        联合检索：并发查询多个数据库（可以属于不同类型的知识库），合并去重后返回
+
+        各数据库的分数不可直接比较（相似度、BM25、RRF），因此按各自的排名做 RRF 融合；
+        内容相同的分块只保留排名最靠前的一个。LightRAG 数据库返回的是整段上下文，作为一条结果参与融合。
+
+        Args:
+            query_text: 查询文本
+            db_ids: 数据库ID列表，为 None 时查询所有数据库
+            top_k: 返回的结果数量，同时作为每个数据库的召回数量
+            timeout: 每个数据库的超时时间（秒），为 None 时使用各知识库类型的 federated_timeout
+            use_cache: 是否使用检索结果缓存
+            **kwargs: 向量知识库（chroma / milvus）的查询参数
+
+        Returns:
+            {"hits": 融合后的检索结果, "databases": {db_id: {status, hits, time, error}}}
+
+        Raises:
+            KBNotFoundError: 某个数据库不存在
+        """
+        db_ids = list(dict.fromkeys(db_ids or self.global_databases_meta.keys()))
+        for db_id in db_ids:
+            self._get_kb_for_database(db_id)
+
+        async def search(db_id: str) -> List[RetrievalHit]:
+            kb_instance = self._get_kb_for_database(db_id)
+            db_timeout = timeout if timeout is not None else kb_instance.federated_timeout
+            if self.is_lightrag_database(db_id):
+                context = await asyncio.wait_for(
+                    self.aquery(query_text, db_id, use_cache=use_cache, top_k=top_k), db_timeout)
+                name = self.global_databases_meta[db_id].get("name")
+                return [RetrievalHit(id=f"{db_id}:context", content=context, source=name, db_id=db_id)] if context else []
+            return await asyncio.wait_for(
+                self.aretrieve(query_text, db_id, use_cache=use_cache, top_k=top_k, **kwargs), db_timeout)
+
+        async def timed_search(db_id: str) -> Dict:
+            start = time.time()
+            report = {"status": "success", "hits": [], "error": None}
+            try:
+                report["hits"] = await search(db_id)
+            except asyncio.TimeoutError:
+                report.update(status="timeout", error="检索超时")
+                logger.warning(f"Federated query timed out on {db_id}")
+            except Exception as e:
+                report.update(status="failed", error=str(e))
+                logger.error(f"Federated query failed on {db_id}: {e}")
+            report["time"] = round(time.time() - start, 4)
+            return report
+
+        reports = dict(zip(db_ids, await asyncio.gather(*[timed_search(db_id) for db_id in db_ids])))
+
+        # 按内容去重：同一文档入库到多个数据库时只保留排名最靠前的分块
+        first_hits: Dict[str, RetrievalHit] = {}
+        rankings = []
+        for report in reports.values():
+            ranking = []
+            for hit in report["hits"]:
+                key = hashlib.sha1(" ".join(hit.content.split()).encode("utf-8")).hexdigest()
+                first_hits.setdefault(key, hit)
+                ranking.append(key)
+            rankings.append(list(dict.fromkeys(ranking)))
+
+        fused = reciprocal_rank_fusion(rankings)[:top_k]
+        hits = [first_hits[key].with_scores(score=score) for key, score in fused]
+        for db_id, report in reports.items():
+            report["hits"] = len(report["hits"])
+        return {"hits": hits, "databases": reports}
+
+    async def _cached_batch(self, db_id: str, queries: List[str], params: Dict,
+                            fetch: Callable, use_cache: bool) -> List[Any]:
+        """按查询逐条读取缓存，未命中的查询一次交给 fetch 批量检索，非空结果写入缓存"""
+        if not use_cache:
+            return await fetch(queries)
+
+        keys = [self.query_cache.make_key(db_id, query_text, params) for query_text in queries]
+        results = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            # 检索期间数据库内容变化时（版本号改变）结果不写入缓存
+            generation = self.query_cache.generation(db_id)
+            fetched = await fetch([queries[i] for i in missing])
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                # 空结果可能来自检索异常，不缓存
+                if result:
+                    self.query_cache.put(keys[i], result, generation=generation)
+
+        return results
 
     def query(self, query_text: str, db_id: str, **kwargs) -> str:
         """同步查询知识库（兼容性方法）"""
@@ -221,15 +392,25 @@ class KnowledgeBaseManager:
         except KBNotFoundError:
             return None
 
+    def list_files(self, db_id: str, page: int = 1, page_size: int = 50,
+                   status: Optional[str] = None) -> Dict:
+        """分页获取数据库中的文件"""
+        kb_instance = self._get_kb_for_database(db_id)
+        return kb_instance.list_files(db_id, page=page, page_size=page_size, status=status)
+
     async def delete_file(self, db_id: str, file_id: str) -> None:
         """删除文件"""
         kb_instance = self._get_kb_for_database(db_id)
-        await kb_instance.delete_file(db_id, file_id)
+        try:
+            await kb_instance.delete_file(db_id, file_id)
+        finally:
+            self.query_cache.invalidate(db_id)
 
-    async def get_file_info(self, db_id: str, file_id: str) -> Dict:
-        """获取文件信息"""
+    async def get_file_info(self, db_id: str, file_id: str, page: int = 1,
+                            page_size: Optional[int] = None) -> Dict:
+        """获取文件信息，page_size 不为空时分页返回 chunks"""
         kb_instance = self._get_kb_for_database(db_id)
-        return await kb_instance.get_file_info(db_id, file_id)
+        return await kb_instance.get_file_info(db_id, file_id, page=page, page_size=page_size)
 
     def get_db_upload_path(self, db_id: Optional[str] = None) -> str:
         """获取数据库上传路径"""
@@ -255,21 +436,45 @@ class KnowledgeBaseManager:
         if db_id in self.global_databases_meta:
             self.global_databases_meta[db_id]["name"] = name
             self.global_databases_meta[db_id]["description"] = description
-            self._save_global_metadata()
+            self._save_global_metadata(db_id)
 
         return result
 
+    async def aget_index_info(self, db_id: str) -> Dict:
+        """获取向量索引信息（目前仅 Milvus 支持）"""
+        kb_instance = self._get_kb_for_database(db_id)
+        if not hasattr(kb_instance, "aget_index_info"):
+            raise ValueError(f"{kb_instance.kb_type} 类型的知识库不支持索引管理")
+        return await kb_instance.aget_index_info(db_id)
+
+    async def reindex_database(self, db_id: str, index_type: Optional[str] = None,
+                               index_params: Optional[Dict] = None,
+                               recall_target: Optional[float] = None) -> Dict:
+        """在线重建向量索引（目前仅 Milvus 支持）"""
+        kb_instance = self._get_kb_for_database(db_id)
+        if not hasattr(kb_instance, "reindex"):
+            raise ValueError(f"{kb_instance.kb_type} 类型的知识库不支持重建索引")
+        return await kb_instance.reindex(db_id, index_type=index_type, index_params=index_params,
+                                         recall_target=recall_target)
+
     def get_retrievers(self) -> Dict[str, Dict]:
         """获取所有检索器"""
         all_retrievers = {}
 
-        # 收集所有知识库的检索器
+        # 收集所有知识库的检索器，检索经过管理器以使用结果缓存
         for kb_instance in self.kb_instances.values():
             retrievers = kb_instance.get_retrievers()
+            for db_id, retriever_info in retrievers.items():
+                retriever_info["retriever"] = self._make_cached_retriever(db_id)
             all_retrievers.update(retrievers)
 
         return all_retrievers
 
+    def _make_cached_retriever(self, db_id: str):
+        async def retriever(query_text):
+            return await self.aquery(query_text, db_id)
+        return retriever
+
     # =============================================================================
     # 管理器特有的方法
     # =============================================================================
@@ -324,6 +529,26 @@ class KnowledgeBaseManager:
         for kb_instance in self.kb_instances.values():
             stats["total_files"] += len(kb_instance.files_meta)
 
+        # embedding 缓存命中情况
+        from src.models.embedding_cache import get_embedding_cache
+        stats["embedding_cache"] = get_embedding_cache().stats()
+        stats["query_cache"] = self.query_cache.stats()
+        from src.knowledge.url_fetcher import get_url_fetcher
+        stats["url_cache"] = get_url_fetcher().stats()
+        from src.knowledge.parse_cache import get_parse_cache
+        stats["parse_cache"] = get_parse_cache().stats()
+
+        # 底层存储调用耗时（目前只有 ChromaDB 统计）
+        stats["io_stats"] = {
+            kb_type: kb_instance.get_io_stats()
+            for kb_type, kb_instance in self.kb_instances.items() if hasattr(kb_instance, "get_io_stats")
+        }
+
+        # 常驻的数据库实例（LightRAG 实例、向量集合）数量与淘汰次数
+        stats["instances"] = {
+            kb_type: kb_instance.get_instance_stats() for kb_type, kb_instance in self.kb_instances.items()
+        }
+
         return stats
 
     # =============================================================================
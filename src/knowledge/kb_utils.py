@@ -1,13 +1,261 @@
 import os
+import re
 import time
+import hashlib
+import threading
+from collections import deque, OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, BinaryIO, Iterator, Optional, Tuple
 from src.utils import hashstr, get_docker_safe_url, logger
 from src import config
 
 
+class UploadTooLargeError(ValueError):
+    """写入的文件超过大小上限"""
+
+
+# 写入时已计算过的文件哈希 {路径: (大小, 修改时间, sha256)}，文件未变化时 hash_file 直接复用
+_known_hashes: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_known_hashes_lock = threading.Lock()
+_KNOWN_HASHES_LIMIT = 10000
+
+
+def _remember_file_hash(file_path: str, sha256: str) -> None:
+    stat = os.stat(file_path)
+    with _known_hashes_lock:
+        _known_hashes[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns, sha256)
+        _known_hashes.move_to_end(os.path.abspath(file_path))
+        while len(_known_hashes) > _KNOWN_HASHES_LIMIT:
+            _known_hashes.popitem(last=False)
+
+
+def _lookup_file_hash(file_path: str) -> Optional[str]:
+    with _known_hashes_lock:
+        known = _known_hashes.get(os.path.abspath(file_path))
+    if known is None:
+        return None
+    stat = os.stat(file_path)
+    return known[2] if (stat.st_size, stat.st_mtime_ns) == known[:2] else None
+
+
+def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    流式计算文件内容的 sha256，避免一次性读入大文件；上传时已计算过且文件未变化时直接返回
+
+    Args:
+        file_path: 文件路径
+        block_size: 每次读取的字节数
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    known = _lookup_file_hash(file_path)
+    if known is not None:
+        return known
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    _remember_file_hash(file_path, sha256.hexdigest())
+    return sha256.hexdigest()
+
+
+def save_stream(stream: BinaryIO, file_path: str, max_size: Optional[int] = None,
+                block_size: int = 1 << 20) -> Tuple[str, int]:
+    """
+    将文件流分块写入磁盘，写入的同时计算 sha256 与大小，不把整个文件读入内存
+
+    先写入临时文件，完成后再重命名，失败或超出大小时删除已写入的部分；同一路径的并发写入互不干扰，以最后完成的为准。
+
+    Args:
+        stream: 可读的二进制流
+        file_path: 目标路径
+        max_size: 最大字节数，None 表示不限制
+        block_size: 每次读写的字节数
+
+    Returns:
+        (十六进制哈希值, 文件大小)
+
+    Raises:
+        UploadTooLargeError: 文件超过 max_size
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    tmp_path = f"{file_path}.{hashstr(file_path, 6, with_salt=True)}.part"
+    try:
+        with open(tmp_path, 'wb') as f:
+            for block in iter(lambda: stream.read(block_size), b''):
+                size += len(block)
+                if max_size is not None and size > max_size:
+                    raise UploadTooLargeError(f"File exceeds the maximum upload size of {max_size} bytes")
+                sha256.update(block)
+                f.write(block)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    content_hash = sha256.hexdigest()
+    _remember_file_hash(file_path, content_hash)
+    return content_hash, size
+
+
+def hash_text(text: str) -> str:
+    """计算文本内容的 sha256"""
+    return hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+
+
+def _make_chunk(content: str, file_id: str, filename: str, chunk_index: int,
+                seen_ids: Dict[str, int]) -> Dict:
+    """
+    构建分块，分块ID由文件ID和内容哈希组成，内容不变的分块在重新入库时ID保持不变
+    同一文件中内容完全相同的分块按出现次序追加序号
+    """
+    content_hash = hashstr(content)
+    chunk_id = f"{file_id}_{content_hash[:16]}"
+    occurrence = seen_ids.get(chunk_id, 0)
+    seen_ids[chunk_id] = occurrence + 1
+    if occurrence:
+        chunk_id = f"{chunk_id}_{occurrence}"
+
+    return {
+        "id": chunk_id,
+        "content": content,
+        "file_id": file_id,
+        "filename": filename,
+        "chunk_index": chunk_index,
+        "source": filename,
+        "chunk_id": chunk_id,
+        "content_hash": content_hash
+    }
+
+
+# 句子：以非空白字符开头，到中英文句末标点（含紧随的引号、括号）、英文句点后的空白或换行为止
+_SENTENCE = re.compile(r'\S(?:[^\n。！？；!?;.]++|\.(?!\s))*+(?:[。！？；!?;]+[”’」』"\'）)]*|\.)?')
+
+
+@lru_cache(maxsize=8)
+def get_tokenizer(encoding_name: str = "cl100k_base"):
+    """
+    获取缓存的 tokenizer，未安装 tiktoken 时返回 None
+
+    Args:
+        encoding_name: tiktoken 编码名称
+
+    Returns:
+        tokenizer 或 None
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, falling back to character based chunk size")
+        return None
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _iter_sentence_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """按句子边界切分文本，返回去除首尾空白后的 (start, end)，不复制文本"""
+    for match in _SENTENCE.finditer(text):
+        start, end = match.span()
+        if text[end - 1].isspace():
+            end = start + len(match.group().rstrip())
+        yield start, end
+
+
+def iter_text_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                     tokenizer=None) -> Iterator[Tuple[int, int]]:
+    """
+    流式分块，逐个返回分块在原文中的字符区间
+
+    以句子（中英文句末标点或换行）为最小单元累积到 chunk_size，超长的句子按长度硬切分；
+    相邻分块之间保留不超过 chunk_overlap 的完整句子作为重叠。
+
+    Args:
+        text: 要分割的文本
+        chunk_size: 块大小（字符数，指定 tokenizer 时为 token 数）
+        chunk_overlap: 块重叠大小，单位同 chunk_size
+        tokenizer: 可选，带 encode 方法的 tokenizer
+
+    Yields:
+        Tuple[int, int]: 分块的 (start, end) 字符偏移，text[start:end] 即分块内容
+    """
+    chunk_size = max(1, chunk_size)
+    chunk_overlap = max(0, min(chunk_overlap, chunk_size - 1))
+
+    def measure(start: int, end: int) -> int:
+        if tokenizer is None:
+            return end - start
+        return len(tokenizer.encode(text[start:end], disallowed_special=()))
+
+    def iter_units() -> Iterator[Tuple[int, int, int]]:
+        for start, end in _iter_sentence_spans(text):
+            size = measure(start, end)
+            if size <= chunk_size:
+                yield start, end, size
+                continue
+
+            # 超长句子按比例换算为字符步长后硬切分
+            step = max(1, (end - start) * chunk_size // size)
+            for piece_start in range(start, end, step):
+                piece_end = min(piece_start + step, end)
+                yield piece_start, piece_end, measure(piece_start, piece_end)
+
+    # 当前块中的句子 (start, end, size)；字符模式下块大小由偏移量计算，token 模式下以各句 token 数之和近似
+    units = deque()
+    token_total = 0
+
+    for start, end, size in iter_units():
+        if units and (end - units[0][0] if tokenizer is None else token_total + size) > chunk_size:
+            yield units[0][0], units[-1][1]
+
+            # 从头部移除句子，直到剩余部分不超过重叠大小且能放下新句子
+            while units:
+                if tokenizer is None:
+                    overlap, new_size = units[-1][1] - units[0][0], end - units[0][0]
+                else:
+                    overlap, new_size = token_total, token_total + size
+                if overlap <= chunk_overlap and new_size <= chunk_size:
+                    break
+                token_total -= units.popleft()[2]
+
+        units.append((start, end, size))
+        token_total += size
+
+    if units:
+        yield units[0][0], units[-1][1]
+
+
+def iter_chunks(text: str, file_id: str, filename: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                chunk_unit: str = "char") -> Iterator[Dict]:
+    """
+    流式分块，逐个生成分块字典（包含 start / end 字符偏移）
+
+    Args:
+        text: 要分割的文本
+        file_id: 文件ID
+        filename: 文件名
+        chunk_size: 块大小
+        chunk_overlap: 块重叠大小
+        chunk_unit: 块大小的单位，'char' 或 'token'
+
+    Yields:
+        Dict: 文本块
+    """
+    tokenizer = get_tokenizer() if chunk_unit == "token" else None
+    seen_ids = {}
+    for chunk_index, (start, end) in enumerate(iter_text_chunks(text, chunk_size, chunk_overlap, tokenizer)):
+        chunk = _make_chunk(text[start:end], file_id, filename, chunk_index, seen_ids)
+        chunk["start"] = start
+        chunk["end"] = end
+        yield chunk
+
+
 def split_text_into_chunks(text: str, file_id: str, filename: str,
-                          chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Dict]:
+                          chunk_size: int = 1000, chunk_overlap: int = 200,
+                          chunk_unit: str = "char") -> List[Dict]:
     """
     将文本分割成块
 
@@ -17,60 +265,12 @@ def split_text_into_chunks(text: str, file_id: str, filename: str,
         filename: 文件名
         chunk_size: 块大小
         chunk_overlap: 块重叠大小
+        chunk_unit: 块大小的单位，'char' 或 'token'
 
     Returns:
         List[Dict]: 分割后的文本块列表
     """
-    chunks = []
-
-    # 简单的分块策略：按段落和长度分割
-    paragraphs = text.split('\n\n')
-
-    current_chunk = ""
-    chunk_index = 0
-
-    for paragraph in paragraphs:
-        paragraph = paragraph.strip()
-        if not paragraph:
-            continue
-
-        # 如果当前块加上新段落会超过限制，保存当前块
-        if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
-            chunks.append({
-                "id": f"{file_id}_chunk_{chunk_index}",
-                "content": current_chunk.strip(),
-                "file_id": file_id,
-                "filename": filename,
-                "chunk_index": chunk_index,
-                "source": filename,
-                "chunk_id": f"{file_id}_chunk_{chunk_index}"
-            })
-
-            # 开始新块，包含重叠内容
-            if len(current_chunk) > chunk_overlap:
-                current_chunk = current_chunk[-chunk_overlap:] + "\n\n" + paragraph
-            else:
-                current_chunk = paragraph
-            chunk_index += 1
-        else:
-            if current_chunk:
-                current_chunk += "\n\n" + paragraph
-            else:
-                current_chunk = paragraph
-
-    # 添加最后一块
-    if current_chunk.strip():
-        chunks.append({
-            "id": f"{file_id}_chunk_{chunk_index}",
-            "content": current_chunk.strip(),
-            "file_id": file_id,
-            "filename": filename,
-            "chunk_index": chunk_index,
-            "source": filename,
-            "chunk_id": f"{file_id}_chunk_{chunk_index}"
-        })
-
-    return chunks
+    return list(iter_chunks(text, file_id, filename, chunk_size, chunk_overlap, chunk_unit))
 
 
 def prepare_item_metadata(item: str, content_type: str, db_id: str) -> Dict:
@@ -104,7 +304,8 @@ def prepare_item_metadata(item: str, content_type: str, db_id: str) -> Dict:
         "file_type": file_type,
         "status": "processing",
         "created_at": time.time(),
-        "file_id": file_id
+        "file_id": file_id,
+        "content_hash": None
     }
 
 
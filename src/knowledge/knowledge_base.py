@@ -1,12 +1,33 @@
 import os
 import json
 import time
+import asyncio
+import inspect
+import functools
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any, AsyncGenerator
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Any, AsyncGenerator, Callable
 from pathlib import Path
 from datetime import datetime
 
+from src.knowledge.metadata_store import MetadataStore
+from src.knowledge.instance_pool import InstancePool
+from src.knowledge.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from src.knowledge.retrieval import RetrievalHit
 from src.utils import logger
+from src import config
+
+
+def holds_instance(func):
+    """标记方法执行期间参数 db_id（位置或关键字参数均可）对应的数据库实例正在使用，实例池不会将其淘汰"""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        db_id = signature.bind_partial(self, *args, **kwargs).arguments["db_id"]
+        with self.instance_in_use(db_id):
+            return await func(self, *args, **kwargs)
+    return wrapper
 
 
 class KnowledgeBaseException(Exception):
@@ -27,18 +48,49 @@ class KBOperationError(KnowledgeBaseException):
 class KnowledgeBase(ABC):
     """知识库抽象基类，定义统一接口"""
 
-    def __init__(self, work_dir: str):
+    def __init__(self, work_dir: str, **kwargs):
         """
         初始化知识库
 
         Args:
             work_dir: 工作目录
+            **kwargs: 其他配置参数
         """
         self.work_dir = work_dir
         self.databases_meta: Dict[str, Dict] = {}
         self.files_meta: Dict[str, Dict] = {}
         os.makedirs(work_dir, exist_ok=True)
 
+        # 入库并发配置：每个数据库同时处理的文件数量，以及同时写入底层存储的文件数量
+        self.ingest_concurrency = kwargs.get('ingest_concurrency', 4)
+        self.insert_concurrency = kwargs.get('insert_concurrency', 1)
+        self._ingest_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._ingest_locks: Dict[str, asyncio.Lock] = {}
+
+        # 数据库到文件的二级索引 {db_id: {file_id: None}}（dict 保持插入顺序），以及按数据库缓存的聚合统计
+        self._db_file_index: Dict[str, Dict[str, None]] = {}
+        self._db_stats: Dict[str, Dict] = {}
+
+        # 混合检索：每个数据库的 BM25 倒排索引，默认的融合模式（vector / lexical / hybrid）与 RRF 平滑常数，
+        # 默认只用向量检索，hybrid 可在创建数据库或查询时指定
+        self.fusion_mode = kwargs.get('fusion_mode', 'vector')
+        self.rrf_k = kwargs.get('rrf_k', 60)
+        self._lexical_indexes: Dict[str, LexicalIndex] = {}
+        self._lexical_backfills: Dict[str, asyncio.Task] = {}
+
+        # 重排序：召回的候选数量、每个请求的文本数量与整体超时（秒），是否启用由 config.enable_reranker 或查询参数决定
+        self.rerank_candidates = kwargs.get('rerank_candidates', 30)
+        self.rerank_batch_size = kwargs.get('rerank_batch_size', 16)
+        self.rerank_timeout = kwargs.get('rerank_timeout', 5.0)
+
+        # 实例池：最多常驻的数据库实例数量与空闲淘汰时间（秒），以及每个数据库正在进行的操作数量
+        self.max_instances = kwargs.get('max_instances', 32)
+        self.instance_idle_timeout = kwargs.get('instance_idle_timeout', 1800)
+        self._active_uses: Dict[str, int] = {}
+
+        # 联合检索（KnowledgeBaseManager.afederated_query）中每个数据库的超时时间（秒）
+        self.federated_timeout = kwargs.get('federated_timeout', 10.0)
+
         # 自动加载元数据
         self._load_metadata()
 
@@ -72,6 +124,40 @@ class KnowledgeBase(ABC):
         """
         pass
 
+    def _create_instance_pool(self, release: Optional[Callable[[str, Any], Any]] = None) -> InstancePool:
+        """
+        创建按数据库缓存底层实例的池，正在使用的数据库（见 _is_instance_busy）不会被淘汰
+
+        Args:
+            release: 淘汰时释放实例的函数 (db_id, instance)，可以是协程函数
+
+        Returns:
+            实例池
+        """
+        return InstancePool(self.kb_type, max_size=self.max_instances, idle_timeout=self.instance_idle_timeout,
+                            release=release, is_busy=self._is_instance_busy)
+
+    @contextmanager
+    def instance_in_use(self, db_id: str):
+        """在上下文内将数据库标记为正在使用"""
+        self._active_uses[db_id] = self._active_uses.get(db_id, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._active_uses.get(db_id, 1) - 1
+            if remaining > 0:
+                self._active_uses[db_id] = remaining
+            else:
+                self._active_uses.pop(db_id, None)
+
+    def _is_instance_busy(self, db_id: str) -> bool:
+        """数据库是否有正在进行的操作，子类可以补充后台任务等状态"""
+        return self._active_uses.get(db_id, 0) > 0
+
+    def get_instance_stats(self) -> Dict:
+        """常驻实例统计，没有实例池的知识库返回空字典"""
+        return {}
+
     def create_database(self, database_name: str, description: str,
                        embed_info: Optional[Dict] = None, **kwargs) -> Dict:
         """
@@ -99,7 +185,7 @@ class KnowledgeBase(ABC):
             "metadata": kwargs,
             "created_at": datetime.now().isoformat()
         }
-        self._save_metadata()
+        self._save_database_meta(db_id)
 
         # 创建工作目录
         working_dir = os.path.join(self.work_dir, db_id)
@@ -124,14 +210,26 @@ class KnowledgeBase(ABC):
         """
         if db_id in self.databases_meta:
             # 删除相关文件记录
-            files_to_delete = [fid for fid, finfo in self.files_meta.items()
-                             if finfo.get("database_id") == db_id]
-            for file_id in files_to_delete:
-                del self.files_meta[file_id]
-
-            # 删除数据库记录
+            for file_id in self._db_file_index.pop(db_id, {}):
+                self.files_meta.pop(file_id, None)
+            self._db_stats.pop(db_id, None)
+
+            # 关闭倒排索引，其文件位于工作目录中，随工作目录一并删除
+            lexical_index = self._lexical_indexes.pop(db_id, None)
+            if lexical_index is not None:
+                lexical_index.close()
+            backfill = self._lexical_backfills.pop(db_id, None)
+            if backfill is not None:
+                backfill.cancel()
+
+            # 删除数据库记录（数据库与文件记录在同一事务中删除）
             del self.databases_meta[db_id]
-            self._save_metadata()
+            self._ingest_semaphores.pop(db_id, None)
+            self._ingest_locks.pop(db_id, None)
+            try:
+                self.metadata_store.delete_database(db_id)
+            except Exception as e:
+                logger.error(f"Failed to delete {self.kb_type} database metadata {db_id}: {e}")
 
         # 删除工作目录
         working_dir = os.path.join(self.work_dir, db_id)
@@ -146,7 +244,8 @@ class KnowledgeBase(ABC):
 
     @abstractmethod
     async def add_content(self, db_id: str, items: List[str],
-                         params: Optional[Dict] = None) -> List[Dict]:
+                         params: Optional[Dict] = None,
+                         progress_callback: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
         """
         添加内容（文件/URL）
 
@@ -154,12 +253,207 @@ class KnowledgeBase(ABC):
             db_id: 数据库ID
             items: 文件路径或URL列表
             params: 处理参数
+            progress_callback: 进度回调，参数为 (item 下标, 进度信息)
 
         Returns:
             处理结果列表
         """
         pass
 
+    def get_ingest_concurrency(self, db_id: str) -> int:
+        """
+        获取数据库的入库并发上限，优先使用创建数据库时指定的 ingest_concurrency
+
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            并发上限
+        """
+        db_config = self.databases_meta.get(db_id, {}).get("metadata") or {}
+        return max(1, int(db_config.get("ingest_concurrency") or self.ingest_concurrency))
+
+    def get_fusion_mode(self, db_id: str) -> str:
+        """
+        获取数据库的默认融合模式，优先使用创建数据库时指定的 fusion_mode
+
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            融合模式（vector / lexical / hybrid）
+        """
+        db_config = self.databases_meta.get(db_id, {}).get("metadata") or {}
+        return db_config.get("fusion_mode") or self.fusion_mode
+
+    def get_ingest_semaphore(self, db_id: str) -> asyncio.Semaphore:
+        """获取数据库级别的入库信号量，多次 add_content 调用共享同一并发上限"""
+        if db_id not in self._ingest_semaphores:
+            self._ingest_semaphores[db_id] = asyncio.Semaphore(self.get_ingest_concurrency(db_id))
+        return self._ingest_semaphores[db_id]
+
+    def get_ingest_lock(self, db_id: str) -> asyncio.Lock:
+        """获取数据库级别的入库锁，用于原子地完成去重检查与文件记录登记"""
+        if db_id not in self._ingest_locks:
+            self._ingest_locks[db_id] = asyncio.Lock()
+        return self._ingest_locks[db_id]
+
+    async def _ingest_parse(self, db_id: str, item: str, content_type: str,
+                            params: Optional[Dict] = None) -> str:
+        """
+        入库流水线：解析阶段，将文件/URL转换为markdown
+
+        Args:
+            db_id: 数据库ID
+            item: 文件路径或URL
+            content_type: 内容类型 ('file' 或 'url')
+            params: 处理参数
+
+        Returns:
+            markdown格式内容
+        """
+        if content_type == "file":
+            return await self._process_file_to_markdown(item, params=params)
+        return await self._process_url_to_markdown(item, params=params)
+
+    def _ingest_chunk(self, db_id: str, file_meta: Dict, content: str,
+                      params: Optional[Dict] = None) -> List[Dict]:
+        """
+        入库流水线：分块阶段（同步方法，在线程中执行）
+
+        默认不分块，由底层知识库在写入阶段自行处理原始内容
+
+        Args:
+            db_id: 数据库ID
+            file_meta: 文件元数据（prepare_item_metadata 的返回值）
+            content: markdown格式内容
+            params: 处理参数
+
+        Returns:
+            分块列表
+        """
+        return []
+
+    async def _ingest_embed(self, db_id: str, chunks: List[Dict]) -> Optional[List[List[float]]]:
+        """
+        入库流水线：向量化阶段，默认不预先计算向量
+
+        Args:
+            db_id: 数据库ID
+            chunks: 分块列表
+
+        Returns:
+            与 chunks 一一对应的向量列表，或 None
+        """
+        return None
+
+    @abstractmethod
+    async def _ingest_insert(self, db_id: str, file_meta: Dict, content: str,
+                             chunks: List[Dict], embeddings: Optional[List[List[float]]]) -> None:
+        """
+        入库流水线：写入阶段，将内容写入底层存储
+
+        Args:
+            db_id: 数据库ID
+            file_meta: 文件元数据（prepare_item_metadata 的返回值）
+            content: markdown格式内容
+            chunks: 分块列表
+            embeddings: 向量列表，可能为 None
+        """
+        pass
+
+    async def _get_file_chunk_index(self, db_id: str, file_id: str) -> Optional[Dict[str, int]]:
+        """
+        获取文件已入库分块的 {chunk_id: chunk_index}，用于增量更新
+
+        Args:
+            db_id: 数据库ID
+            file_id: 文件ID
+
+        Returns:
+            分块索引；返回 None 表示不支持分块级增量更新，文件变更时整体替换
+        """
+        return None
+
+    async def _ingest_remove(self, db_id: str, file_id: str,
+                             chunk_ids: Optional[List[str]] = None) -> None:
+        """
+        入库流水线：删除文件的旧分块
+
+        Args:
+            db_id: 数据库ID
+            file_id: 文件ID
+            chunk_ids: 需要删除的分块ID，为 None 时删除该文件的全部内容
+        """
+        pass
+
+    async def _ingest_update_chunks(self, db_id: str, chunks: List[Dict]) -> None:
+        """
+        入库流水线：更新内容未变但位置变化的分块元数据（如 chunk_index）
+
+        Args:
+            db_id: 数据库ID
+            chunks: 新的分块数据
+        """
+        pass
+
+    async def _ingest_commit(self, db_id: str, file_id: str) -> None:
+        """
+        入库流水线：等待文件的写入提交，_ingest_insert 只缓冲数据时在这里等待缓冲区写入底层存储
+
+        Args:
+            db_id: 数据库ID
+            file_id: 文件ID
+        """
+        pass
+
+    async def _ingest_abort(self, db_id: str, file_id: str) -> None:
+        """
+        入库流水线：文件处理失败时调用，清理已缓冲但尚未提交的写入
+
+        Args:
+            db_id: 数据库ID
+            file_id: 文件ID
+        """
+        pass
+
+    async def _ingest_finalize(self, db_id: str) -> None:
+        """
+        入库流水线：一次 add_content 的所有文件处理完后调用，用于落盘、压缩等收尾工作
+
+        Args:
+            db_id: 数据库ID
+        """
+        pass
+
+    def find_file(self, db_id: str, content_hash: Optional[str] = None, path: Optional[str] = None,
+                  statuses: tuple = ("done",), filename: Optional[str] = None) -> Optional[str]:
+        """
+        在数据库中按内容哈希、路径或文件名查找文件，用于去重与增量更新
+
+        Args:
+            db_id: 数据库ID
+            content_hash: 文件内容哈希
+            path: 文件路径或URL
+            statuses: 允许的文件状态
+            filename: 文件名
+
+        Returns:
+            文件ID或None
+        """
+        for file_id in self._db_file_index.get(db_id, {}):
+            file_info = self.files_meta[file_id]
+            if file_info.get("status") not in statuses:
+                continue
+            if content_hash is not None and file_info.get("content_hash") != content_hash:
+                continue
+            if path is not None and file_info.get("path") != path:
+                continue
+            if filename is not None and file_info.get("filename") != filename:
+                continue
+            return file_id
+        return None
+
     @abstractmethod
     async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
         """
@@ -175,6 +469,296 @@ class KnowledgeBase(ABC):
         """
         pass
 
+    async def abatch_query(self, queries: List[str], db_id: str, **kwargs) -> List[str]:
+        """
+        批量查询知识库，默认并发执行多个 aquery
+
+        Args:
+            queries: 查询文本列表
+            db_id: 数据库ID
+            **kwargs: 查询参数（所有查询共用）
+
+        Returns:
+            与 queries 一一对应的查询结果
+        """
+        return list(await asyncio.gather(*[self.aquery(query_text, db_id, **kwargs) for query_text in queries]))
+
+    async def aretrieve(self, query_text: str, db_id: str, **kwargs) -> List[RetrievalHit]:
+        """
+        结构化检索，返回检索结果对象而不是格式化后的文本
+
+        Args:
+            query_text: 查询文本
+            db_id: 数据库ID
+            **kwargs: 查询参数（与 aquery 相同）
+
+        Returns:
+            按分数降序的检索结果
+        """
+        return (await self.abatch_retrieve([query_text], db_id, **kwargs))[0]
+
+    async def abatch_retrieve(self, queries: List[str], db_id: str, **kwargs) -> List[List[RetrievalHit]]:
+        """
+        批量结构化检索，仅向量知识库支持
+
+        Args:
+            queries: 查询文本列表
+            db_id: 数据库ID
+            **kwargs: 查询参数（所有查询共用）
+
+        Returns:
+            与 queries 一一对应的检索结果
+        """
+        if not queries:
+            return []
+        return await self._retrieve(db_id, list(queries), **kwargs)
+
+    async def aiter_ranked_hits(self, query_text: str, db_id: str, **kwargs) -> AsyncGenerator[RetrievalHit, None]:
+        """
+        逐条产出最终排序后的检索结果。融合与重排序都需要全部候选，因此检索完成后才开始产出，
+        调用方（如 NDJSON 接口）可以逐条序列化发送，而不是先格式化整个列表
+
+        Args:
+            query_text: 查询文本
+            db_id: 数据库ID
+            **kwargs: 查询参数
+
+        Returns:
+            检索结果的异步生成器
+        """
+        for hit in await self.aretrieve(query_text, db_id, **kwargs):
+            yield hit
+
+    def get_lexical_index(self, db_id: str) -> LexicalIndex:
+        """获取数据库的 BM25 倒排索引，保存在数据库工作目录下"""
+        index = self._lexical_indexes.get(db_id)
+        if index is None:
+            index = LexicalIndex(os.path.join(self.work_dir, db_id, "lexical_index.db"))
+            self._lexical_indexes[db_id] = index
+        return index
+
+    async def _lexical_add(self, db_id: str, chunks: List[Dict]) -> None:
+        """将分块写入倒排索引，失败时只记录日志，不影响向量入库"""
+        try:
+            await asyncio.to_thread(self.get_lexical_index(db_id).add, chunks)
+        except Exception as e:
+            logger.error(f"Failed to add {len(chunks)} chunks to lexical index of {db_id}: {e}")
+
+    async def _lexical_remove(self, db_id: str, file_id: str, chunk_ids: Optional[List[str]] = None) -> None:
+        """从倒排索引中删除文件的全部分块，或指定的分块"""
+        try:
+            await asyncio.to_thread(self.get_lexical_index(db_id).remove, file_id, chunk_ids)
+        except Exception as e:
+            logger.error(f"Failed to remove file {file_id} from lexical index of {db_id}: {e}")
+
+    async def _iter_stored_chunks(self, db_id: str) -> AsyncGenerator[List[Dict], None]:
+        """
+        分批读取底层存储中的全部分块，用于为已有数据库补建倒排索引
+
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            分块列表（包含 id、file_id、content）的异步生成器
+        """
+        return
+        yield
+
+    async def _ensure_lexical_index(self, db_id: str) -> Optional[LexicalIndex]:
+        """
+        获取已可用于检索的倒排索引。早于倒排索引创建的数据库需要从底层存储补建一次，
+        补建在后台进行，完成后在索引中记录标记；补建期间返回 None，由调用方退回向量检索
+
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            倒排索引，补建尚未完成时为 None
+        """
+        index = self.get_lexical_index(db_id)
+        if index.backfilled:
+            return index
+
+        if not self.get_database_stats(db_id).get("chunk_count"):
+            # 空数据库无需补建，之后的分块由入库流程写入
+            await asyncio.to_thread(index.mark_backfilled)
+            return index
+
+        task = self._lexical_backfills.get(db_id)
+        if task is None or task.done():
+            self._lexical_backfills[db_id] = asyncio.create_task(self._backfill_lexical_index(db_id, index))
+        return None
+
+    async def _backfill_lexical_index(self, db_id: str, index: LexicalIndex) -> None:
+        """从底层存储读取全部分块写入倒排索引（已存在的分块会被覆盖），失败时下次检索重新补建"""
+        start = time.time()
+        try:
+            async for chunks in self._iter_stored_chunks(db_id):
+                await asyncio.to_thread(index.add, chunks)
+            await asyncio.to_thread(index.mark_backfilled)
+            logger.info(f"Backfilled lexical index of {db_id} with {index.num_docs} chunks "
+                        f"in {time.time() - start:.2f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to backfill lexical index of {db_id}: {e}")
+        finally:
+            if self._lexical_backfills.get(db_id) is asyncio.current_task():
+                self._lexical_backfills.pop(db_id, None)
+
+    async def _vector_search(self, db_id: str, queries: List[str], top_k: int,
+                             params: Dict) -> List[List[RetrievalHit]]:
+        """
+        向量检索，由向量知识库实现
+
+        Args:
+            db_id: 数据库ID
+            queries: 查询文本列表
+            top_k: 每个查询返回的数量
+            params: 查询参数
+
+        Returns:
+            每个查询的检索结果（需包含 similarity），按相似度降序
+        """
+        raise NotImplementedError(f"{self.kb_type} does not support vector search")
+
+    async def _fetch_chunks(self, db_id: str, chunk_ids: List[str]) -> Dict[str, RetrievalHit]:
+        """
+        按分块ID读取分块内容，用于补全只被关键词检索命中的结果
+
+        Args:
+            db_id: 数据库ID
+            chunk_ids: 分块ID列表
+
+        Returns:
+            {分块ID: 检索结果（不含分数）}，不存在的分块不返回
+        """
+        raise NotImplementedError(f"{self.kb_type} does not support fetching chunks")
+
+    @holds_instance
+    async def _retrieve(self, db_id: str, queries: List[str], **kwargs) -> List[List[RetrievalHit]]:
+        """
+        检索并（可选）重排序：开启重排序时先召回 rerank_candidates 个候选，重排序后保留 top_k 个
+
+        Args:
+            db_id: 数据库ID
+            queries: 查询文本列表
+            **kwargs: 查询参数（top_k、use_reranker、rerank_candidates，以及 _search 的参数）
+
+        Returns:
+            每个查询的检索结果，重排序后 rerank_score 有值
+        """
+        top_k = int(kwargs.get("top_k", 10))
+        use_reranker = kwargs.get("use_reranker")
+        if use_reranker is None:
+            use_reranker = config.enable_reranker
+        if not use_reranker:
+            return await self._search(db_id, queries, **kwargs)
+
+        num_candidates = max(top_k, int(kwargs.get("rerank_candidates") or self.rerank_candidates))
+        candidates = await self._search(db_id, queries, **{**kwargs, "top_k": num_candidates})
+        return list(await asyncio.gather(*[
+            self._rerank(query_text, hits, top_k) for query_text, hits in zip(queries, candidates)
+        ]))
+
+    async def _rerank(self, query_text: str, hits: List[RetrievalHit], top_k: int) -> List[RetrievalHit]:
+        """
+        用重排序模型对候选重新打分，分批并发请求；超时或出错时退回检索顺序
+
+        Args:
+            query_text: 查询文本
+            hits: 候选命中列表
+            top_k: 保留的数量
+
+        Returns:
+            重排序后的前 top_k 个命中
+        """
+        if len(hits) <= 1:
+            return hits[:top_k]
+
+        from src.models.rerank_model import get_reranker
+
+        try:
+            reranker = get_reranker(config.reranker)
+            scores = await asyncio.wait_for(
+                reranker.acompute_score((query_text, [hit.content for hit in hits]), batch_size=self.rerank_batch_size),
+                timeout=self.rerank_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Rerank of {len(hits)} candidates timed out after {self.rerank_timeout}s, "
+                           f"falling back to retrieval order")
+            return hits[:top_k]
+        except Exception as e:
+            logger.warning(f"Rerank failed ({e}), falling back to retrieval order")
+            return hits[:top_k]
+
+        hits = [hit.with_scores(rerank_score=float(score)) for hit, score in zip(hits, scores)]
+        return sorted(hits, key=lambda hit: hit.rerank_score, reverse=True)[:top_k]
+
+    async def _search(self, db_id: str, queries: List[str], **kwargs) -> List[List[RetrievalHit]]:
+        """
+        按融合模式检索：vector 只用向量检索；lexical 只用 BM25；hybrid 并发执行两路检索，
+        各取 2 * top_k 个候选后用倒数排名融合（RRF）合并
+
+        Args:
+            db_id: 数据库ID
+            queries: 查询文本列表
+            **kwargs: 查询参数（top_k、similarity_threshold、fusion_mode 等）
+
+        Returns:
+            每个查询的检索结果，score 为相似度、BM25 分数或 RRF 分数
+        """
+        top_k = int(kwargs.get("top_k", 10))
+        similarity_threshold = kwargs.get("similarity_threshold", 0.0)
+        fusion_mode = kwargs.get("fusion_mode") or self.get_fusion_mode(db_id)
+        if fusion_mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Unsupported fusion_mode: {fusion_mode}")
+
+        async def vector_search(k: int) -> List[List[RetrievalHit]]:
+            results = await self._vector_search(db_id, queries, k, kwargs)
+            # 阈值在融合前应用，低相似度的向量结果不参与排名
+            return [[hit for hit in hits if hit.similarity >= similarity_threshold] for hits in results]
+
+        index = await self._ensure_lexical_index(db_id) if fusion_mode != "vector" else None
+        if index is None:
+            # 倒排索引仍在后台补建时只用向量检索
+            fusion_mode = "vector"
+
+        async def lexical_search(k: int) -> List[List[tuple]]:
+            return await asyncio.to_thread(lambda: [index.search(query_text, k) for query_text in queries])
+
+        if fusion_mode == "vector":
+            results = await vector_search(top_k)
+            return [[hit.with_scores(score=hit.similarity) for hit in hits] for hits in results]
+
+        if fusion_mode == "lexical":
+            vector_results = [[] for _ in queries]
+            fused = await lexical_search(top_k)
+        else:
+            vector_results, lexical_results = await asyncio.gather(vector_search(2 * top_k), lexical_search(2 * top_k))
+            fused = [
+                reciprocal_rank_fusion([[hit.id for hit in vector_hits], [chunk_id for chunk_id, _ in lexical_hits]],
+                                       k=self.rrf_k)[:top_k]
+                for vector_hits, lexical_hits in zip(vector_results, lexical_results)
+            ]
+
+        # 只被关键词检索命中的分块需要从底层存储读取内容
+        missing = list({chunk_id for ranking, vector_hits in zip(fused, vector_results)
+                        for chunk_id, _ in ranking if chunk_id not in {hit.id for hit in vector_hits}})
+        fetched = await self._fetch_chunks(db_id, missing) if missing else {}
+
+        results = []
+        for ranking, vector_hits in zip(fused, vector_results):
+            known = {hit.id: hit for hit in vector_hits}
+            hits = []
+            for chunk_id, score in ranking:
+                hit = known.get(chunk_id) or fetched.get(chunk_id)
+                if hit is None:
+                    continue
+                hits.append(hit.with_scores(score=score))
+            results.append(hits)
+        return results
+
     def query(self, query_text: str, db_id: str, **kwargs) -> str:
         """
         同步查询知识库（兼容性方法）
@@ -206,22 +790,9 @@ class KnowledgeBase(ABC):
 
         meta = self.databases_meta[db_id].copy()
         meta["db_id"] = db_id
-
-        # 获取文件信息
-        db_files = {}
-        for file_id, file_info in self.files_meta.items():
-            if file_info.get("database_id") == db_id:
-                db_files[file_id] = {
-                    "file_id": file_id,
-                    "filename": file_info.get("filename", ""),
-                    "path": file_info.get("path", ""),
-                    "type": file_info.get("file_type", ""),
-                    "status": file_info.get("status", "done"),
-                    "created_at": file_info.get("created_at", time.time())
-                }
-
-        meta["files"] = db_files
-        meta["row_count"] = len(db_files)
+        meta["files"] = {file_id: self._file_summary(file_id) for file_id in self._db_file_index.get(db_id, {})}
+        meta.update(self.get_database_stats(db_id))
+        meta["row_count"] = meta["file_count"]
         meta["status"] = "已连接"
         return meta
 
@@ -232,30 +803,81 @@ class KnowledgeBase(ABC):
         Returns:
             数据库列表
         """
-        databases = []
-        for db_id, meta in self.databases_meta.items():
-            db_dict = meta.copy()
-            db_dict["db_id"] = db_id
+        databases = [self.get_database_info(db_id) for db_id in self.databases_meta]
+        return {"databases": databases}
 
-            # 获取文件信息
-            db_files = {}
-            for file_id, file_info in self.files_meta.items():
-                if file_info.get("database_id") == db_id:
-                    db_files[file_id] = {
-                        "file_id": file_id,
-                        "filename": file_info.get("filename", ""),
-                        "path": file_info.get("path", ""),
-                        "type": file_info.get("file_type", ""),
-                        "status": file_info.get("status", "done"),
-                        "created_at": file_info.get("created_at", time.time())
-                    }
-
-            db_dict["files"] = db_files
-            db_dict["row_count"] = len(db_files)
-            db_dict["status"] = "已连接"
-            databases.append(db_dict)
+    def get_database_stats(self, db_id: str) -> Dict:
+        """
+        获取数据库的聚合统计（文件数、各状态文件数、分块总数），结果缓存到文件记录变化为止
 
-        return {"databases": databases}
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            统计信息
+        """
+        if db_id not in self._db_stats:
+            status_counts = {}
+            chunk_count = 0
+            file_ids = self._db_file_index.get(db_id, {})
+            for file_id in file_ids:
+                file_info = self.files_meta[file_id]
+                status = file_info.get("status", "done")
+                status_counts[status] = status_counts.get(status, 0) + 1
+                chunk_count += file_info.get("chunk_count") or 0
+            self._db_stats[db_id] = {
+                "file_count": len(file_ids),
+                "status_counts": status_counts,
+                "chunk_count": chunk_count,
+            }
+
+        stats = self._db_stats[db_id]
+        return {**stats, "status_counts": stats["status_counts"].copy()}
+
+    def list_files(self, db_id: str, page: int = 1, page_size: int = 50,
+                   status: Optional[str] = None) -> Dict:
+        """
+        分页获取数据库中的文件，按创建时间倒序
+
+        Args:
+            db_id: 数据库ID
+            page: 页码，从 1 开始
+            page_size: 每页数量
+            status: 只返回指定状态的文件
+
+        Returns:
+            {"files": [...], "total": 总数, "page": 页码, "page_size": 每页数量}
+        """
+        if db_id not in self.databases_meta:
+            raise KBNotFoundError(f"Database {db_id} not found")
+
+        page = max(1, page)
+        page_size = max(1, page_size)
+        file_ids = [file_id for file_id in self._db_file_index.get(db_id, {})
+                    if status is None or self.files_meta[file_id].get("status", "done") == status]
+        file_ids.sort(key=lambda file_id: self.files_meta[file_id].get("created_at") or 0, reverse=True)
+
+        start = (page - 1) * page_size
+        return {
+            "db_id": db_id,
+            "files": [self._file_summary(file_id) for file_id in file_ids[start:start + page_size]],
+            "total": len(file_ids),
+            "page": page,
+            "page_size": page_size,
+        }
+
+    def _file_summary(self, file_id: str) -> Dict:
+        """数据库信息与文件列表中返回的文件摘要"""
+        file_info = self.files_meta[file_id]
+        return {
+            "file_id": file_id,
+            "filename": file_info.get("filename", ""),
+            "path": file_info.get("path", ""),
+            "type": file_info.get("file_type", ""),
+            "status": file_info.get("status", "done"),
+            "chunk_count": file_info.get("chunk_count"),
+            "created_at": file_info.get("created_at", time.time())
+        }
 
     @abstractmethod
     async def delete_file(self, db_id: str, file_id: str) -> None:
@@ -269,19 +891,36 @@ class KnowledgeBase(ABC):
         pass
 
     @abstractmethod
-    async def get_file_info(self, db_id: str, file_id: str) -> Dict:
+    async def get_file_info(self, db_id: str, file_id: str, page: int = 1,
+                            page_size: Optional[int] = None) -> Dict:
         """
         获取文件信息和chunks
 
         Args:
             db_id: 数据库ID
             file_id: 文件ID
+            page: 页码，从 1 开始
+            page_size: 每页的 chunk 数量，None 表示返回全部
 
         Returns:
-            文件信息和chunks
+            {"lines": chunks}，分页时另有 total、page、page_size
         """
         pass
 
+    @staticmethod
+    def _paginate_lines(lines: List[Dict], page: int = 1, page_size: Optional[int] = None) -> Dict:
+        """对已按顺序排列的 chunks 分页，page_size 为 None 时返回全部"""
+        if page_size is None:
+            return {"lines": lines}
+        page, page_size = max(1, page), max(1, page_size)
+        start = (page - 1) * page_size
+        return {"lines": lines[start:start + page_size], "total": len(lines), "page": page, "page_size": page_size}
+
+    def is_upload_path(self, db_id: str, path: str) -> bool:
+        """是否为上传到该数据库的文件（位于数据库上传目录下的子目录中）"""
+        upload_dir = os.path.join(self.work_dir, db_id, "uploads")
+        return os.path.dirname(os.path.dirname(os.path.abspath(path))) == os.path.abspath(upload_dir)
+
     def get_db_upload_path(self, db_id: Optional[str] = None) -> str:
         """
         获取数据库上传路径
@@ -318,7 +957,7 @@ class KnowledgeBase(ABC):
 
         self.databases_meta[db_id]["name"] = name
         self.databases_meta[db_id]["description"] = description
-        self._save_metadata()
+        self._save_database_meta(db_id)
 
         return self.get_database_info(db_id)
 
@@ -344,30 +983,64 @@ class KnowledgeBase(ABC):
         return retrievers
 
     def _load_metadata(self):
-        """加载元数据"""
-        meta_file = os.path.join(self.work_dir, f"metadata_{self.kb_type}.json")
-        if os.path.exists(meta_file):
-            try:
-                with open(meta_file, encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.databases_meta = data.get("databases", {})
-                    self.files_meta = data.get("files", {})
-                logger.info(f"Loaded {self.kb_type} metadata for {len(self.databases_meta)} databases")
-            except Exception as e:
-                logger.error(f"Failed to load {self.kb_type} metadata: {e}")
+        """加载元数据，首次启动时导入旧版 JSON 元数据文件"""
+        self.metadata_store = MetadataStore(os.path.join(self.work_dir, f"metadata_{self.kb_type}.db"))
+        try:
+            self.metadata_store.import_json(os.path.join(self.work_dir, f"metadata_{self.kb_type}.json"))
+        except Exception as e:
+            logger.error(f"Failed to import {self.kb_type} JSON metadata: {e}")
+
+        try:
+            self.databases_meta = self.metadata_store.load_databases()
+            self.files_meta = self.metadata_store.load_files()
+            for file_id, file_info in self.files_meta.items():
+                # 上次运行中断时仍在处理的文件标记为失败，重新入库时按路径找到并更新，也不会被当作重复内容
+                if file_info.get("status") == "processing":
+                    file_info["status"] = "failed"
+                    file_info["error"] = "Interrupted"
+                    self.metadata_store.save_file(file_id, file_info)
+                self._index_file(file_id)
+            logger.info(f"Loaded {self.kb_type} metadata for {len(self.databases_meta)} databases")
+        except Exception as e:
+            logger.error(f"Failed to load {self.kb_type} metadata: {e}")
+
+    def _save_database_meta(self, db_id: str):
+        """保存单个数据库记录"""
+        try:
+            self.metadata_store.save_database(db_id, self.databases_meta[db_id])
+        except Exception as e:
+            logger.error(f"Failed to save {self.kb_type} database metadata {db_id}: {e}")
+
+    def _index_file(self, file_id: str):
+        """将文件加入所属数据库的索引，并使该数据库的统计缓存失效"""
+        db_id = self.files_meta[file_id].get("database_id")
+        self._db_file_index.setdefault(db_id, {})[file_id] = None
+        self._db_stats.pop(db_id, None)
+
+    def _save_file_meta(self, file_id: str):
+        """保存单个文件记录，新增文件和状态变化都需要经过此方法以维护索引"""
+        self._index_file(file_id)
+        try:
+            self.metadata_store.save_file(file_id, self.files_meta[file_id])
+        except Exception as e:
+            logger.error(f"Failed to save {self.kb_type} file metadata {file_id}: {e}")
+
+    def _remove_file_meta(self, file_id: str):
+        """删除单个文件记录"""
+        if file_id not in self.files_meta:
+            return
+        db_id = self.files_meta.pop(file_id).get("database_id")
+        self._db_file_index.get(db_id, {}).pop(file_id, None)
+        self._db_stats.pop(db_id, None)
+        try:
+            self.metadata_store.delete_file(file_id)
+        except Exception as e:
+            logger.error(f"Failed to delete {self.kb_type} file metadata {file_id}: {e}")
 
     def _save_metadata(self):
-        """保存元数据"""
-        meta_file = os.path.join(self.work_dir, f"metadata_{self.kb_type}.json")
+        """保存全部元数据（一次事务），常规的状态变化请使用按行更新的方法"""
         try:
-            data = {
-                "databases": self.databases_meta,
-                "files": self.files_meta,
-                "kb_type": self.kb_type,
-                "updated_at": datetime.now().isoformat()
-            }
-            with open(meta_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.metadata_store.save_all(self.databases_meta, self.files_meta)
         except Exception as e:
             logger.error(f"Failed to save {self.kb_type} metadata: {e}")
 
@@ -376,6 +1049,9 @@ class KnowledgeBase(ABC):
         """
         将不同类型的文件转换为markdown格式
 
+        解析结果按 (文件内容哈希, 解析器, 解析参数) 缓存，同一文件重试或加入其他知识库时不再重复解析；
+        params 中 use_parse_cache 为 False 时强制重新解析。
+
         Args:
             file_path: 文件路径
             params: 处理参数
@@ -383,43 +1059,75 @@ class KnowledgeBase(ABC):
         Returns:
             markdown格式内容
         """
+        from src.knowledge.kb_utils import hash_file
+        from src.knowledge.parse_cache import get_parse_cache
+
+        params = params or {}
         file_path_obj = Path(file_path)
         file_ext = file_path_obj.suffix.lower()
 
-        if file_ext == '.pdf':
-            # 使用 OCR 处理 PDF
-            from src.knowledge.indexing import parse_pdf_async
-            text = await parse_pdf_async(str(file_path_obj), params=params)
-            return f"# {file_path_obj.name}\n\n{text}"
-
-        elif file_ext in ['.txt', '.md']:
+        if file_ext in ['.txt', '.md']:
             # 直接读取文本文件
             with open(file_path_obj, encoding='utf-8') as f:
                 content = f.read()
             return f"# {file_path_obj.name}\n\n{content}"
 
+        # 缓存的是解析器的原始输出，标题中的文件名在返回时添加（同一内容的文件名可能不同）
+        parser, parser_params = self._get_file_parser(file_ext, params)
+        cache = get_parse_cache()
+        content_hash = await asyncio.to_thread(hash_file, str(file_path_obj))
+        text = None
+        if params.get("use_parse_cache", True):
+            text = await asyncio.to_thread(cache.get, content_hash, parser, parser_params)
+            if text is not None:
+                logger.info(f"Using cached {parser} result for {file_path_obj.name}")
+
+        if text is None:
+            try:
+                text = await self._parse_file(file_path_obj, parser, params)
+            except Exception as e:
+                if parser != "textract":
+                    raise
+                logger.error(f"Failed to process file {file_path_obj}: {e}")
+                return f"# {file_path_obj.name}\n\nFailed to process file: {e}"
+            await asyncio.to_thread(cache.put, content_hash, parser, parser_params, text)
+
+        return f"# {file_path_obj.name}\n\n{text}"
+
+    @staticmethod
+    def _get_file_parser(file_ext: str, params: Dict) -> tuple:
+        """根据文件类型选择解析器，返回 (解析器名称, 影响解析结果的参数)"""
+        if file_ext == '.pdf':
+            return "pdf", {"enable_ocr": params.get("enable_ocr", "disable")}
         elif file_ext in ['.doc', '.docx']:
+            return "docx", {}
+        elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp']:
+            return "image_ocr", {}
+        return "textract", {}
+
+    async def _parse_file(self, file_path_obj: Path, parser: str, params: Dict) -> str:
+        """执行解析，耗时的解析在线程中执行"""
+        if parser == "pdf":
+            # 使用 OCR 处理 PDF
+            from src.knowledge.indexing import parse_pdf_async
+            return await parse_pdf_async(str(file_path_obj), params=params)
+
+        elif parser == "docx":
             # 处理 Word 文档
             from docx import Document  # type: ignore
-            doc = Document(file_path_obj)
-            text = '\n'.join([para.text for para in doc.paragraphs])
-            return f"# {file_path_obj.name}\n\n{text}"
 
-        elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp']:
+            def read_docx():
+                return '\n'.join([para.text for para in Document(file_path_obj).paragraphs])
+            return await asyncio.to_thread(read_docx)
+
+        elif parser == "image_ocr":
             # 使用 OCR 处理图片
             from src.plugins import ocr
-            text = ocr.process_image(str(file_path_obj))
-            return f"# {file_path_obj.name}\n\n{text}"
+            return await asyncio.to_thread(ocr.process_image, str(file_path_obj))
 
-        else:
-            # 尝试作为文本文件读取
-            try:
-                import textract  # type: ignore
-                text = textract.process(file_path_obj).decode('utf-8')
-                return f"# {file_path_obj.name}\n\n{text}"
-            except Exception as e:
-                logger.error(f"Failed to process file {file_path_obj}: {e}")
-                return f"# {file_path_obj.name}\n\nFailed to process file: {e}"
+        # 其他类型尝试用 textract 提取文本
+        import textract  # type: ignore
+        return (await asyncio.to_thread(textract.process, file_path_obj)).decode('utf-8')
 
     async def _process_url_to_markdown(self, url: str,
                                      params: Optional[Dict] = None) -> str:
@@ -433,13 +1141,11 @@ class KnowledgeBase(ABC):
         Returns:
             markdown格式内容
         """
-        import requests
-        from bs4 import BeautifulSoup
+        from src.knowledge.url_fetcher import get_url_fetcher
 
         try:
-            response = requests.get(url, timeout=30)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            text_content = soup.get_text()
+            # 异步抓取，共享连接池并按域名限制并发，内容未变化时使用本地缓存
+            text_content = await get_url_fetcher().fetch_text(url)
             return f"# {url}\n\n{text_content}"
         except Exception as e:
             logger.error(f"Failed to process URL {url}: {e}")
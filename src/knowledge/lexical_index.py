@@ -0,0 +1,211 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import time
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from src.utils import logger
+
+# 英文单词/数字（保留型号中的连接符，如 "gpt-4o"、"v1.2"）与连续的中日韩字符
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[぀-ヿ㐀-䶿一-鿿豈-﫿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文与数字按单词切分，中日韩文本按相邻两字（bigram）切分，单字词保留单字
+
+    Args:
+        text: 文本
+
+    Returns:
+        词列表
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word.isascii():
+            tokens.append(word)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    倒数排名融合（RRF），score = Σ 1 / (k + rank)
+
+    Args:
+        rankings: 多路检索结果的ID列表，按相关度降序
+        k: 平滑常数
+
+    Returns:
+        [(id, score)]，按融合分数降序
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    单个数据库的 BM25 倒排索引，保存在 SQLite 中
+
+    postings 表记录 (词, 分块ID, 词频)，docs 表记录分块所属文件与长度，meta 表记录索引状态（如是否已从底层存储补建），
+    检索时只读取查询词对应的倒排列表。
+    """
+
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            db_path: SQLite 文件路径
+            k1: BM25 词频饱和参数
+            b: BM25 长度归一化参数
+        """
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                chunk_id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_file_id ON docs (file_id);
+            CREATE INDEX IF NOT EXISTS idx_postings_chunk_id ON postings (chunk_id);
+        """)
+        self._conn.commit()
+        self._load_stats()
+        self._backfilled = self._conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone() is not None
+
+    def _load_stats(self):
+        """读取文档数与总长度，用于计算 idf 与平均长度；只在打开时全量统计，之后随写入增量更新"""
+        self._num_docs, self._total_length = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+
+    @property
+    def num_docs(self) -> int:
+        return self._num_docs
+
+    @property
+    def backfilled(self) -> bool:
+        """是否已从底层存储补建过全部分块"""
+        return self._backfilled
+
+    def mark_backfilled(self) -> None:
+        """记录补建完成，之后的分块由入库流程增量写入"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled', ?)",
+                               (str(time.time()),))
+        self._backfilled = True
+
+    def add(self, chunks: List[Dict]) -> None:
+        """
+        添加分块（已存在的分块会被覆盖）
+
+        Args:
+            chunks: 分块列表，需包含 id、file_id、content
+        """
+        docs, postings = [], []
+        for chunk in chunks:
+            counts = Counter(tokenize(chunk["content"]))
+            docs.append((chunk["id"], chunk["file_id"], sum(counts.values())))
+            postings.extend((term, chunk["id"], tf) for term, tf in counts.items())
+
+        with self._lock:
+            with self._conn:
+                deleted_docs, deleted_length = self._delete_chunks([doc[0] for doc in docs])
+                self._conn.executemany("INSERT INTO docs (chunk_id, file_id, length) VALUES (?, ?, ?)", docs)
+                self._conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", postings)
+            # 事务提交后按写入与覆盖的行增量更新统计
+            self._num_docs += len(docs) - deleted_docs
+            self._total_length += sum(doc[2] for doc in docs) - deleted_length
+
+    def remove(self, file_id: Optional[str] = None, chunk_ids: Optional[List[str]] = None) -> None:
+        """删除某个文件的全部分块，或指定的分块"""
+        with self._lock:
+            with self._conn:
+                if chunk_ids is None:
+                    chunk_ids = [row[0] for row in self._conn.execute(
+                        "SELECT chunk_id FROM docs WHERE file_id = ?", (file_id,))]
+                deleted_docs, deleted_length = self._delete_chunks(chunk_ids)
+            self._num_docs -= deleted_docs
+            self._total_length -= deleted_length
+
+    def _delete_chunks(self, chunk_ids: List[str]) -> Tuple[int, int]:
+        """删除分块，调用方需持有锁并处于事务中；返回实际删除的分块数量与总长度"""
+        deleted_docs, deleted_length = 0, 0
+        for i in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            count, length = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE chunk_id IN ({placeholders})", batch
+            ).fetchone()
+            deleted_docs += count
+            deleted_length += length
+            self._conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM docs WHERE chunk_id IN ({placeholders})", batch)
+        return deleted_docs, deleted_length
+
+    def search(self, query_text: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        BM25 检索
+
+        Args:
+            query_text: 查询文本
+            top_k: 返回数量
+
+        Returns:
+            [(chunk_id, score)]，按分数降序
+        """
+        terms = Counter(tokenize(query_text))
+        if not terms or not self._num_docs:
+            return []
+
+        scores: Dict[str, float] = {}
+        with self._lock:
+            num_docs = self._num_docs
+            avg_length = self._total_length / num_docs
+            for term, query_tf in terms.items():
+                rows = self._conn.execute(
+                    "SELECT p.chunk_id, p.tf, d.length FROM postings p JOIN docs d ON p.chunk_id = d.chunk_id "
+                    "WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not rows:
+                    continue
+
+                idf = math.log(1 + (num_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for chunk_id, tf, length in rows:
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + query_tf * idf * norm
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.warning(f"Failed to close lexical index {self.db_path}: {e}")
@@ -1,17 +1,23 @@
 import os
 import time
+import asyncio
 import traceback
+import numpy as np
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Callable
 from datetime import datetime
 
 from lightrag import LightRAG, QueryParam
+from lightrag.base import DocStatus
 from lightrag.llm.openai import openai_complete_if_cache, openai_embed
 from lightrag.utils import EmbeddingFunc, setup_logger
 from lightrag.kg.shared_storage import initialize_pipeline_status
 
-from src.knowledge.knowledge_base import KnowledgeBase
+from src.knowledge.knowledge_base import KnowledgeBase, holds_instance
+from src.knowledge.ingestion import IngestionPipeline
+from src.knowledge.doc_chunk_index import DocChunkIndex
 from src.knowledge.kb_utils import split_text_into_chunks, prepare_item_metadata, get_embedding_config
+from src.models.embedding_cache import get_embedding_cache
 from src import config
 from src.utils import logger, hashstr, get_docker_safe_url
 
@@ -31,10 +37,25 @@ class LightRagKB(KnowledgeBase):
             work_dir: 工作目录
             **kwargs: 其他配置参数
         """
-        super().__init__(work_dir)
+        super().__init__(work_dir, **kwargs)
 
-        # 存储 LightRAG 实例映射 {db_id: LightRAG}
-        self.instances: Dict[str, LightRAG] = {}
+        # 存储 LightRAG 实例映射 {db_id: LightRAG}，冷数据库的实例被淘汰时关闭其存储，下次使用时重新初始化
+        self.instances = self._create_instance_pool(release=self._release_lightrag_instance)
+
+        # 文档到分块的索引 {db_id: DocChunkIndex}，是否已全量重建的标记保存在索引中
+        self._chunk_indexes: Dict[str, DocChunkIndex] = {}
+
+        # 批量写入：多个文件先进入缓冲区，凑满 insert_batch_size 个文档或等待 insert_linger 秒后
+        # 一次性交给 LightRAG，使其内部流水线（分块、实体抽取、合并）能够并行处理多个文档
+        self.insert_batch_size = kwargs.get('insert_batch_size', 8)
+        self.insert_linger = kwargs.get('insert_linger', 2.0)
+        self._insert_buffers: Dict[str, Dict] = {}
+        self._pending_commits: Dict[tuple, asyncio.Future] = {}
+
+        # LightRAG 内部的并发配置，可在创建数据库时按数据库覆盖（修改后重新加载实例生效）
+        self.llm_max_async = kwargs.get('llm_max_async', 4)
+        self.embedding_batch_size = kwargs.get('embedding_batch_size', 32)
+        self.max_parallel_insert = kwargs.get('max_parallel_insert', 4)
 
         # 设置 LightRAG 日志
         log_dir = os.path.join(work_dir, "logs", "lightrag")
@@ -68,7 +89,10 @@ class LightRagKB(KnowledgeBase):
             working_dir=working_dir,
             workspace=db_id,
             llm_model_func=self._get_llm_func(llm_info),
+            llm_model_max_async=self._get_db_option(db_id, "llm_max_async"),
             embedding_func=self._get_embedding_func(embed_info),
+            embedding_batch_num=self._get_db_option(db_id, "embedding_batch_size"),
+            max_parallel_insert=self._get_db_option(db_id, "max_parallel_insert"),
             vector_storage="MilvusVectorDBStorage",
             kv_storage="JsonKVStorage",
             graph_storage="Neo4JStorage",
@@ -78,6 +102,11 @@ class LightRagKB(KnowledgeBase):
 
         return rag
 
+    def _get_db_option(self, db_id: str, key: str) -> int:
+        """读取数据库级别的整数配置，未指定时使用知识库的默认值"""
+        db_config = self.databases_meta.get(db_id, {}).get("metadata") or {}
+        return max(1, int(db_config.get(key) or getattr(self, key)))
+
     async def _initialize_kb_instance(self, instance: LightRAG) -> None:
         """初始化 LightRAG 实例"""
         logger.info(f"Initializing LightRAG instance for {instance.working_dir}")
@@ -92,20 +121,81 @@ class LightRagKB(KnowledgeBase):
         if db_id not in self.databases_meta:
             return None
 
-        try:
-            # 创建实例
-            rag = await self._create_kb_instance(db_id, {})
+        async def create():
+            try:
+                # 创建实例并异步初始化存储
+                rag = await self._create_kb_instance(db_id, {})
+                await self._initialize_kb_instance(rag)
+                return rag
+            except Exception as e:
+                logger.error(f"Failed to create LightRAG instance for {db_id}: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                return None
+
+        return await self.instances.get_or_create(db_id, create)
+
+    async def _release_lightrag_instance(self, db_id: str, rag: LightRAG) -> None:
+        """实例池淘汰实例时关闭其存储（落盘 KV、断开图数据库与向量库连接）"""
+        await rag.finalize_storages()
+        logger.info(f"Finalized LightRAG instance of {db_id}")
 
-            # 异步初始化存储
-            await self._initialize_kb_instance(rag)
+    def get_instance_stats(self) -> Dict:
+        """常驻 LightRAG 实例统计"""
+        return self.instances.stats()
 
-            self.instances[db_id] = rag
-            return rag
+    def _is_instance_busy(self, db_id: str) -> bool:
+        """有未写入的缓冲文档时实例不能被淘汰"""
+        return super()._is_instance_busy(db_id) or db_id in self._insert_buffers
+
+    def _get_chunk_index(self, db_id: str) -> DocChunkIndex:
+        """获取数据库的文档到分块索引，保存在数据库工作目录下"""
+        if db_id not in self._chunk_indexes:
+            self._chunk_indexes[db_id] = DocChunkIndex(os.path.join(self.work_dir, db_id, "doc_chunk_index.db"))
+        return self._chunk_indexes[db_id]
+
+    async def _index_doc_chunks(self, db_id: str, rag: LightRAG, doc_id: str) -> None:
+        """插入文档后，从 doc_status 的 chunks_list 记录文档的分块；失败时下次读取该文档时全量重建索引"""
+        try:
+            status = await rag.doc_status.get_by_id(doc_id)
+            chunk_ids = (status or {}).get("chunks_list")
+            if not chunk_ids:
+                # 旧版本 LightRAG 的 doc_status 不记录分块
+                await asyncio.to_thread(self._get_chunk_index(db_id).set_rebuilt, False)
+                return
+
+            chunks = await rag.text_chunks.get_by_ids(chunk_ids)
+            entries = [(chunk_id, (chunk or {}).get("chunk_order_index", i))
+                       for i, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks))]
+            await asyncio.to_thread(self._get_chunk_index(db_id).set_doc, doc_id, entries)
 
         except Exception as e:
-            logger.error(f"Failed to create LightRAG instance for {db_id}: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return None
+            logger.error(f"Failed to index chunks of {doc_id} in {db_id}: {e}")
+            try:
+                await asyncio.to_thread(self._get_chunk_index(db_id).set_rebuilt, False)
+            except Exception as e:
+                logger.error(f"Failed to clear rebuilt marker of doc chunk index of {db_id}: {e}")
+
+    async def _rebuild_chunk_index(self, db_id: str, rag: LightRAG) -> None:
+        """从 text_chunks 全量重建文档到分块的索引，用于索引建立之前入库的数据"""
+        start = time.time()
+        all_chunks = await rag.text_chunks.get_all()  # type: ignore
+        docs: Dict[str, List] = {}
+        for chunk_id, chunk_data in all_chunks.items():
+            if isinstance(chunk_data, dict) and chunk_data.get("full_doc_id"):
+                docs.setdefault(chunk_data["full_doc_id"], []).append(
+                    (chunk_id, chunk_data.get("chunk_order_index", 0)))
+        chunk_index = self._get_chunk_index(db_id)
+        await asyncio.to_thread(chunk_index.set_docs, docs)
+        await asyncio.to_thread(chunk_index.set_rebuilt, True)
+        logger.info(f"Rebuilt doc chunk index of {db_id}: {len(docs)} docs, {len(all_chunks)} chunks "
+                    f"in {time.time() - start:.2f}s")
+
+    def delete_database(self, db_id: str) -> Dict:
+        """删除数据库，先关闭文档到分块的索引"""
+        chunk_index = self._chunk_indexes.pop(db_id, None)
+        if chunk_index is not None:
+            chunk_index.close()
+        return super().delete_database(db_id)
 
     def _get_llm_func(self, llm_info: Dict):
         """获取 LLM 函数"""
@@ -129,19 +219,29 @@ class LightRagKB(KnowledgeBase):
         """获取 embedding 函数"""
         config_dict = get_embedding_config(embed_info)
 
+        async def embedding_func(texts):
+            # 经过 embedding 缓存，只对未缓存的文本请求接口
+            vectors = await get_embedding_cache().aembed(
+                config_dict["model"],
+                list(texts),
+                lambda missing: openai_embed(
+                    texts=missing,
+                    model=config_dict["model"],
+                    api_key=config_dict["api_key"],
+                    base_url=config_dict["base_url"].replace("/embeddings", ""),
+                )
+            )
+            return np.array(vectors)
+
         return EmbeddingFunc(
             embedding_dim=config_dict["dimension"],
             max_token_size=4096,
-            func=lambda texts: openai_embed(
-                texts=texts,
-                model=config_dict["model"],
-                api_key=config_dict["api_key"],
-                base_url=config_dict["base_url"].replace("/embeddings", ""),
-            ),
+            func=embedding_func,
         )
 
     async def add_content(self, db_id: str, items: List[str],
-                         params: Optional[Dict] = None) -> List[Dict]:
+                         params: Optional[Dict] = None,
+                         progress_callback: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
         """添加内容（文件/URL）"""
         if db_id not in self.databases_meta:
             raise ValueError(f"Database {db_id} not found")
@@ -150,57 +250,110 @@ class LightRagKB(KnowledgeBase):
         if not rag:
             raise ValueError(f"Failed to get LightRAG instance for {db_id}")
 
-        content_type = params.get('content_type', 'file') if params else 'file'
-        processed_items_info = []
-
-        for item in items:
-            # 准备文件元数据
-            metadata = prepare_item_metadata(item, content_type, db_id)
-            file_id = metadata["file_id"]
-            filename = metadata["filename"]
-            item_path = metadata["path"]
-
-            # 添加文件记录
-            file_record = metadata.copy()
-            self.files_meta[file_id] = file_record
-            self._save_metadata()
-
-            try:
-                # 根据内容类型处理内容
-                if content_type == "file":
-                    markdown_content = await self._process_file_to_markdown(item, params=params)
-                    markdown_content_lines = markdown_content[:100].replace('\n', ' ')
-                    logger.info(f"Markdown content: {markdown_content_lines}...")
-                else:  # URL
-                    markdown_content = await self._process_url_to_markdown(item, params=params)
-
-                # 使用 LightRAG 插入内容
-                await rag.ainsert(
-                    input=markdown_content,
-                    ids=file_id,
-                    file_paths=item_path
-                )
+        return await IngestionPipeline(self, db_id, params, progress_callback).run(items)
 
-                logger.info(f"Inserted {content_type} {item} into LightRAG. Done.")
+    async def _ingest_parse(self, db_id: str, item: str, content_type: str,
+                            params: Optional[Dict] = None) -> str:
+        """解析阶段"""
+        markdown_content = await super()._ingest_parse(db_id, item, content_type, params)
+        if content_type == "file":
+            markdown_content_lines = markdown_content[:100].replace('\n', ' ')
+            logger.info(f"Markdown content: {markdown_content_lines}...")
+        return markdown_content
 
-                # 更新状态为完成
-                self.files_meta[file_id]["status"] = "done"
-                self._save_metadata()
-                file_record['status'] = "done"
+    async def _ingest_insert(self, db_id: str, file_meta: Dict, content: str,
+                             chunks: List[Dict], embeddings: Optional[List[List[float]]]) -> None:
+        """写入阶段：分块、向量化与实体抽取均由 LightRAG 内部完成"""
+        rag = await self._get_lightrag_instance(db_id)
+        if not rag:
+            raise ValueError(f"Failed to get LightRAG instance for {db_id}")
 
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"处理{content_type} {item} 失败: {error_msg}, {traceback.format_exc()}")
-                self.files_meta[file_id]["status"] = "failed"
-                self.files_meta[file_id]["error"] = error_msg
-                self._save_metadata()
-                file_record['status'] = "failed"
-                file_record['error'] = error_msg
+        # 写入缓冲区，由 _ingest_commit 等待该文件所在批次的处理结果
+        buffer = self._insert_buffers.get(db_id)
+        if buffer is None:
+            buffer = {"docs": [], "futures": {}}
+            buffer["timer"] = asyncio.create_task(self._drain_after_linger(db_id, buffer))
+            self._insert_buffers[db_id] = buffer
+
+        file_id = file_meta["file_id"]
+        future = asyncio.get_running_loop().create_future()
+        buffer["docs"].append((file_id, content, file_meta["path"]))
+        buffer["futures"][file_id] = future
+        self._pending_commits[(db_id, file_id)] = future
+
+        # 同时处理的文件数量受入库并发限制，批次大小不超过该限制，避免凑不满时每批都等待 insert_linger
+        batch_size = min(self._get_db_option(db_id, "insert_batch_size"), self.get_ingest_concurrency(db_id))
+        if len(buffer["docs"]) >= batch_size:
+            await self._drain_insert_buffer(db_id)
+
+    async def _ingest_commit(self, db_id: str, file_id: str) -> None:
+        """等待文件所在批次处理完成，该文件在 LightRAG 中处理失败时抛出异常"""
+        future = self._pending_commits.pop((db_id, file_id), None)
+        if future is not None:
+            await asyncio.shield(future)
+
+    async def _ingest_finalize(self, db_id: str) -> None:
+        """入库结束：处理剩余的缓冲文档"""
+        await self._drain_insert_buffer(db_id)
+
+    async def _drain_after_linger(self, db_id: str, buffer: Dict):
+        """缓冲区建立 insert_linger 秒后，无论是否凑满都写入"""
+        await asyncio.sleep(self.insert_linger)
+        if self._insert_buffers.get(db_id) is buffer:
+            await self._drain_insert_buffer(db_id)
+
+    async def _drain_insert_buffer(self, db_id: str):
+        """将缓冲区中的文档一次性交给 LightRAG，并按 doc_status 逐个文件设置结果"""
+        buffer = self._insert_buffers.pop(db_id, None)
+        if buffer is None:
+            return
+        if buffer["timer"] is not asyncio.current_task():
+            buffer["timer"].cancel()
+
+        file_ids, contents, paths = (list(column) for column in zip(*buffer["docs"]))
+        futures = buffer["futures"]
+        try:
+            rag = await self._get_lightrag_instance(db_id)
+            if not rag:
+                raise ValueError(f"Failed to get LightRAG instance for {db_id}")
+
+            start = time.time()
+            await rag.ainsert(input=contents, ids=file_ids, file_paths=paths)
+            logger.info(f"Inserted {len(file_ids)} documents into LightRAG {db_id} in {time.time() - start:.2f}s")
+
+            # LightRAG 不会因单个文档失败而抛出异常，失败信息记录在 doc_status 中
+            for file_id in file_ids:
+                status = await rag.doc_status.get_by_id(file_id) or {}
+                if status.get("status") == DocStatus.PROCESSED:
+                    await self._index_doc_chunks(db_id, rag, file_id)
+                    futures[file_id].set_result(None)
+                else:
+                    error = status.get("error_msg") or status.get("error") or f"status: {status.get('status')}"
+                    self._fail_future(futures[file_id], Exception(f"LightRAG failed to process {file_id}: {error}"))
 
-            processed_items_info.append(file_record)
+        except Exception as e:
+            logger.error(f"Failed to insert documents into LightRAG {db_id}: {e}, {traceback.format_exc()}")
+            for future in futures.values():
+                if not future.done():
+                    self._fail_future(future, e)
+
+    @staticmethod
+    def _fail_future(future: asyncio.Future, error: Exception) -> None:
+        future.set_exception(error)
+        # 没有文件等待时避免出现 "exception was never retrieved" 警告
+        future.exception()
+
+    async def _ingest_remove(self, db_id: str, file_id: str,
+                             chunk_ids: Optional[List[str]] = None) -> None:
+        """删除文档的旧版本，LightRAG 只支持按文档整体删除"""
+        rag = await self._get_lightrag_instance(db_id)
+        if not rag:
+            raise ValueError(f"Failed to get LightRAG instance for {db_id}")
 
-        return processed_items_info
+        await rag.adelete_by_doc_id(file_id)
+        await asyncio.to_thread(self._get_chunk_index(db_id).remove_doc, file_id)
 
+    @holds_instance
     async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
         """异步查询知识库"""
         rag = await self._get_lightrag_instance(db_id)
@@ -226,6 +379,7 @@ class LightRagKB(KnowledgeBase):
             logger.error(f"Query error: {e}, {traceback.format_exc()}")
             return ""
 
+    @holds_instance
     async def delete_file(self, db_id: str, file_id: str) -> None:
         """删除文件"""
         rag = await self._get_lightrag_instance(db_id)
@@ -233,16 +387,17 @@ class LightRagKB(KnowledgeBase):
             try:
                 # 使用 LightRAG 删除文档
                 await rag.adelete_by_doc_id(file_id)
+                await asyncio.to_thread(self._get_chunk_index(db_id).remove_doc, file_id)
             except Exception as e:
                 logger.error(f"Error deleting file {file_id} from LightRAG: {e}")
 
         # 删除文件记录
-        if file_id in self.files_meta:
-            del self.files_meta[file_id]
-            self._save_metadata()
+        self._remove_file_meta(file_id)
 
-    async def get_file_info(self, db_id: str, file_id: str) -> Dict:
-        """获取文件信息和chunks"""
+    @holds_instance
+    async def get_file_info(self, db_id: str, file_id: str, page: int = 1,
+                            page_size: Optional[int] = None) -> Dict:
+        """获取文件信息和chunks，通过文档到分块的索引只读取该文档（当前页）的 chunks"""
         if file_id not in self.files_meta:
             raise Exception(f"File not found: {file_id}")
 
@@ -250,23 +405,32 @@ class LightRagKB(KnowledgeBase):
         rag = await self._get_lightrag_instance(db_id)
         if rag:
             try:
-                # 获取文档的所有 chunks
-                assert hasattr(rag.text_chunks, 'get_all'), "text_chunks does not have get_all method"
-                all_chunks = await rag.text_chunks.get_all()  # type: ignore
-
-                # 筛选属于该文档的 chunks
+                chunk_index = self._get_chunk_index(db_id)
+                total = await asyncio.to_thread(chunk_index.count, file_id)
+                if not total and not chunk_index.rebuilt:
+                    await self._rebuild_chunk_index(db_id, rag)
+                    total = await asyncio.to_thread(chunk_index.count, file_id)
+
+                if page_size is None:
+                    chunk_ids = await asyncio.to_thread(chunk_index.get_chunk_ids, file_id)
+                else:
+                    page, page_size = max(1, page), max(1, page_size)
+                    chunk_ids = await asyncio.to_thread(chunk_index.get_chunk_ids, file_id,
+                                                        offset=(page - 1) * page_size, limit=page_size)
+
+                # 按 chunk_order_index 顺序读取
                 doc_chunks = []
-                for chunk_id, chunk_data in all_chunks.items():
-                    if isinstance(chunk_data, dict) and chunk_data.get("full_doc_id") == file_id:
+                for chunk_id, chunk_data in zip(chunk_ids, await rag.text_chunks.get_by_ids(chunk_ids)):
+                    if isinstance(chunk_data, dict):
                         chunk_data["id"] = chunk_id
                         chunk_data["content_vector"] = []
                         doc_chunks.append(chunk_data)
 
-                # 按 chunk_order_index 排序
-                doc_chunks.sort(key=lambda x: x.get("chunk_order_index", 0))
-                return {"lines": doc_chunks}
+                if page_size is None:
+                    return {"lines": doc_chunks}
+                return {"lines": doc_chunks, "total": total, "page": page, "page_size": page_size}
 
             except Exception as e:
                 logger.error(f"Error getting chunks for file {file_id}: {e}")
 
-        return {"lines": []}
\ No newline at end of file
+        return {"lines": []}
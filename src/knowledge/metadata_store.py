@@ -0,0 +1,213 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from src.utils import logger
+
+
+class MetadataStore:
+    """
+    知识库元数据存储
+
+    基于 SQLite (WAL 模式)，按行更新数据库与文件记录，替代每次状态变化都整体重写的 JSON 文件。
+    表结构参照 server/models/kb_models.py 中的 KnowledgeDatabase / KnowledgeFile，
+    常用字段单独成列并建立索引，其余字段以 JSON 形式保存在 data 列中。
+    入库任务及其每个文件的进度同样按行保存，进度变化时只更新对应的一行。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS knowledge_databases (
+                db_id TEXT PRIMARY KEY,
+                kb_type TEXT,
+                name TEXT,
+                description TEXT,
+                created_at TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS knowledge_files (
+                file_id TEXT PRIMARY KEY,
+                database_id TEXT NOT NULL,
+                filename TEXT,
+                path TEXT,
+                file_type TEXT,
+                status TEXT,
+                content_hash TEXT,
+                created_at REAL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_knowledge_files_database_id ON knowledge_files (database_id);
+            CREATE INDEX IF NOT EXISTS idx_knowledge_files_status ON knowledge_files (database_id, status);
+            CREATE INDEX IF NOT EXISTS idx_knowledge_files_content_hash ON knowledge_files (database_id, content_hash);
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                job_id TEXT PRIMARY KEY,
+                db_id TEXT,
+                status TEXT,
+                created_at REAL,
+                finished_at REAL,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ingest_job_files (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                status TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, finished_at);
+        """)
+        self._conn.commit()
+
+    def load_databases(self) -> Dict[str, Dict]:
+        """加载全部数据库记录 {db_id: meta}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT db_id, data FROM knowledge_databases").fetchall()
+        return {db_id: json.loads(data) for db_id, data in rows}
+
+    def load_files(self) -> Dict[str, Dict]:
+        """加载全部文件记录 {file_id: meta}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT file_id, data FROM knowledge_files").fetchall()
+        return {file_id: json.loads(data) for file_id, data in rows}
+
+    def save_database(self, db_id: str, meta: Dict) -> None:
+        """新增或更新一条数据库记录"""
+        with self._lock, self._conn:
+            self._upsert_database(db_id, meta)
+
+    def delete_database(self, db_id: str) -> None:
+        """在同一事务中删除数据库记录及其所有文件记录"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM knowledge_files WHERE database_id = ?", (db_id,))
+            self._conn.execute("DELETE FROM knowledge_databases WHERE db_id = ?", (db_id,))
+
+    def save_file(self, file_id: str, meta: Dict) -> None:
+        """新增或更新一条文件记录"""
+        with self._lock, self._conn:
+            self._upsert_file(file_id, meta)
+
+    def delete_file(self, file_id: str) -> None:
+        """删除一条文件记录"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM knowledge_files WHERE file_id = ?", (file_id,))
+
+    def save_all(self, databases: Dict[str, Dict], files: Optional[Dict[str, Dict]] = None) -> None:
+        """在同一事务中批量写入记录（用于导入旧数据）"""
+        with self._lock, self._conn:
+            for db_id, meta in databases.items():
+                self._upsert_database(db_id, meta)
+            for file_id, meta in (files or {}).items():
+                self._upsert_file(file_id, meta)
+
+    def import_json(self, json_file: str, database_key: str = "databases", file_key: Optional[str] = "files") -> bool:
+        """
+        一次性导入旧版 JSON 元数据文件，导入成功后将其重命名为 *.imported
+
+        Args:
+            json_file: JSON 文件路径
+            database_key: 数据库记录所在的键
+            file_key: 文件记录所在的键，为 None 时不导入文件记录
+
+        Returns:
+            是否进行了导入
+        """
+        if not os.path.exists(json_file):
+            return False
+
+        with open(json_file, encoding='utf-8') as f:
+            data = json.load(f)
+        databases = data.get(database_key, {})
+        files = data.get(file_key, {}) if file_key else {}
+
+        # Milvus 的旧记录中不含 file_id，以键补齐
+        for file_id, meta in files.items():
+            meta.setdefault("file_id", file_id)
+
+        self.save_all(databases, files)
+        os.replace(json_file, f"{json_file}.imported")
+        logger.info(f"Imported {len(databases)} databases and {len(files)} files from {json_file}")
+        return True
+
+    def load_jobs(self) -> Dict[str, Dict]:
+        """加载全部入库任务 {job_id: job}，文件进度按提交顺序放在 files 中"""
+        with self._lock:
+            job_rows = self._conn.execute("SELECT job_id, data FROM ingest_jobs").fetchall()
+            file_rows = self._conn.execute(
+                "SELECT job_id, data FROM ingest_job_files ORDER BY job_id, position").fetchall()
+
+        jobs = {job_id: dict(json.loads(data), files=[]) for job_id, data in job_rows}
+        for job_id, data in file_rows:
+            if job_id in jobs:
+                jobs[job_id]["files"].append(json.loads(data))
+        return jobs
+
+    def save_job(self, job: Dict, with_files: bool = False) -> None:
+        """
+        新增或更新一条任务记录
+
+        Args:
+            job: 任务信息
+            with_files: 是否同时写入全部文件进度（提交任务时）
+        """
+        with self._lock, self._conn:
+            self._upsert_job(job)
+            if with_files:
+                for position, file_state in enumerate(job["files"]):
+                    self._upsert_job_file(job["job_id"], position, file_state)
+
+    def save_job_file(self, job_id: str, position: int, file_state: Dict) -> None:
+        """更新任务中一个文件的进度"""
+        with self._lock, self._conn:
+            self._upsert_job_file(job_id, position, file_state)
+
+    def delete_jobs(self, job_ids: List[str]) -> None:
+        """在同一事务中删除任务及其文件进度"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM ingest_job_files WHERE job_id = ?", [(i,) for i in job_ids])
+            self._conn.executemany("DELETE FROM ingest_jobs WHERE job_id = ?", [(i,) for i in job_ids])
+
+    def _upsert_database(self, db_id: str, meta: Dict) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO knowledge_databases (db_id, kb_type, name, description, created_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (db_id, meta.get("kb_type"), meta.get("name"), meta.get("description"),
+             meta.get("created_at"), json.dumps(meta, ensure_ascii=False))
+        )
+
+    def _upsert_file(self, file_id: str, meta: Dict) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO knowledge_files "
+            "(file_id, database_id, filename, path, file_type, status, content_hash, created_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_id, meta.get("database_id"), meta.get("filename"), meta.get("path"), meta.get("file_type"),
+             meta.get("status"), meta.get("content_hash"), meta.get("created_at"),
+             json.dumps(meta, ensure_ascii=False))
+        )
+
+    def _upsert_job(self, job: Dict) -> None:
+        meta = {k: v for k, v in job.items() if k != "files"}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO ingest_jobs (job_id, db_id, status, created_at, finished_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job["job_id"], job.get("db_id"), job.get("status"), job.get("created_at"), job.get("finished_at"),
+             json.dumps(meta, ensure_ascii=False))
+        )
+
+    def _upsert_job_file(self, job_id: str, position: int, file_state: Dict) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO ingest_job_files (job_id, position, status, data) VALUES (?, ?, ?, ?)",
+            (job_id, position, file_state.get("status"), json.dumps(file_state, ensure_ascii=False))
+        )
@@ -1,9 +1,11 @@
 import os
 import time
+import asyncio
 import traceback
 import json
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Callable
 from datetime import datetime
 
 try:
@@ -18,12 +20,90 @@ except ImportError:
     utility = None
     Collection = None
 
-from src.knowledge.knowledge_base import KnowledgeBase
-from src.knowledge.kb_utils import split_text_into_chunks, prepare_item_metadata, get_embedding_config
+from src.knowledge.knowledge_base import KnowledgeBase, holds_instance
+from src.knowledge.ingestion import IngestionPipeline
+from src.knowledge.retrieval import RetrievalHit, format_hits
+from src.knowledge.kb_utils import iter_chunks, prepare_item_metadata, get_embedding_config
+from src.models.embedding import get_embedding_client
 from src.utils import logger, hashstr
 from src import config
 
 
+# 检索时返回的标量字段
+RETRIEVAL_FIELDS = ["content", "source", "chunk_id", "file_id", "chunk_index"]
+
+# 旧版本创建的集合统一使用的索引
+LEGACY_INDEX_CONFIG = {"index_type": "IVF_FLAT", "params": {"nlist": 1024}}
+
+
+def select_index_config(num_vectors: int, dim: int, recall_target: float = 0.95) -> Dict:
+    """
+    根据集合规模与召回率目标选择索引类型及构建参数
+
+    - 2 万条以下：FLAT，暴力检索精确且足够快
+    - 200 万条以下（召回率要求 >= 0.98 时放宽到 500 万）：HNSW
+    - 更大规模：召回率要求 >= 0.97 或超过 5000 万条时使用 DISKANN，否则使用 IVF_PQ 节省内存
+
+    Args:
+        num_vectors: 向量数量
+        dim: 向量维度
+        recall_target: 召回率目标
+
+    Returns:
+        {"index_type": ..., "params": {...}}
+    """
+    if num_vectors < 20_000:
+        return {"index_type": "FLAT", "params": {}}
+
+    if num_vectors < 2_000_000 or (recall_target >= 0.98 and num_vectors < 5_000_000):
+        M = 32 if recall_target >= 0.98 else 16
+        return {"index_type": "HNSW", "params": {"M": M, "efConstruction": 360 if M == 32 else 200}}
+
+    if recall_target >= 0.97 or num_vectors >= 50_000_000:
+        return {"index_type": "DISKANN", "params": {}}
+
+    nlist = int(min(65536, max(1024, 4 * num_vectors ** 0.5)))
+    # PQ 子空间数需要整除向量维度
+    for m in (dim // 4, dim // 8, dim // 16):
+        if m > 0 and dim % m == 0:
+            return {"index_type": "IVF_PQ", "params": {"nlist": nlist, "m": m, "nbits": 8}}
+    return {"index_type": "IVF_FLAT", "params": {"nlist": nlist}}
+
+
+def build_search_params(index_config: Dict, top_k: int, recall_target: float = 0.95,
+                        ef: Optional[int] = None, nprobe: Optional[int] = None,
+                        search_list: Optional[int] = None) -> Dict:
+    """
+    根据索引类型与召回率目标计算检索参数，ef / nprobe / search_list 显式指定时优先
+
+    Args:
+        index_config: 索引配置
+        top_k: 返回数量
+        recall_target: 召回率目标
+        ef: HNSW 检索宽度
+        nprobe: IVF 检索的聚类数量
+        search_list: DISKANN 检索候选数量
+
+    Returns:
+        Milvus search 的 params
+    """
+    index_type = index_config["index_type"]
+    level = 0 if recall_target <= 0.9 else 1 if recall_target <= 0.95 else 2 if recall_target <= 0.98 else 3
+
+    if index_type == "HNSW":
+        return {"ef": max(top_k, ef or (64, 128, 256, 512)[level])}
+
+    if index_type.startswith("IVF"):
+        nlist = index_config["params"].get("nlist", 1024)
+        fraction = (0.01, 0.03, 0.06, 0.1)[level]
+        return {"nprobe": min(nlist, nprobe or max(1, int(nlist * fraction)))}
+
+    if index_type == "DISKANN":
+        return {"search_list": max(top_k, search_list or (50, 100, 200, 400)[level])}
+
+    return {}
+
+
 class MilvusKB(KnowledgeBase):
     """基于 Milvus 的生产级向量知识库实现"""
 
@@ -35,7 +115,7 @@ class MilvusKB(KnowledgeBase):
             work_dir: 工作目录
             **kwargs: 其他配置参数
         """
-        super().__init__(work_dir)
+        super().__init__(work_dir, **kwargs)
 
         if not MILVUS_AVAILABLE:
             raise ImportError("pymilvus is not installed. Please install it with: pip install pymilvus")
@@ -50,13 +130,34 @@ class MilvusKB(KnowledgeBase):
         # 连接名称
         self.connection_alias = f"milvus_{hashstr(work_dir, 6)}"
 
-        # 存储集合映射 {db_id: Collection}
-        self.collections: Dict[str, Any] = {}
+        # 存储集合映射 {db_id: Collection}，冷数据库的集合被淘汰时从内存中释放（release），下次使用时重新加载
+        self.collections = self._create_instance_pool(release=self._release_collection)
 
         # 分块配置
         self.chunk_size = kwargs.get('chunk_size', 1000)
         self.chunk_overlap = kwargs.get('chunk_overlap', 200)
 
+        # 单次 embedding 请求的文本数量
+        self.embed_batch_size = kwargs.get('embed_batch_size', 64)
+
+        # 批量写入：多个文件的分块先进入缓冲区，达到 bulk_insert_rows 行或等待 bulk_linger 秒后批量插入；
+        # 插入后不立即 flush，而是在入库结束或 flush_interval 秒后统一 flush 并触发压缩
+        self.bulk_insert_rows = kwargs.get('bulk_insert_rows', 2000)
+        self.bulk_linger = kwargs.get('bulk_linger', 1.0)
+        self.flush_interval = kwargs.get('flush_interval', 60)
+        self._insert_buffers: Dict[str, Dict] = {}
+        self._pending_commits: Dict[tuple, asyncio.Future] = {}
+        # 等待插入完成后写入倒排索引的分块 {(db_id, file_id): chunks}
+        self._pending_lexical: Dict[tuple, List[Dict]] = {}
+        # 进行中的写入（正在插入的缓冲批次、删除与更新）{db_id: {future}}，重建索引复制数据前等待其完成
+        self._inflight_writes: Dict[str, set] = {}
+        self._flush_timers: Dict[str, asyncio.Task] = {}
+
+        # 在线重建索引：任务、进度，以及重建期间阻塞写入的事件
+        self._reindex_tasks: Dict[str, asyncio.Task] = {}
+        self._reindex_status: Dict[str, Dict] = {}
+        self._write_gates: Dict[str, asyncio.Event] = {}
+
         # 初始化连接
         self._init_connection()
 
@@ -99,12 +200,13 @@ class MilvusKB(KnowledgeBase):
             raise ValueError(f"Database {db_id} not found")
 
         embed_info = self.databases_meta[db_id].get("embed_info", {})
-        collection_name = f"kb_{db_id}"
+        collection_name = self.databases_meta[db_id].get("collection_name", f"kb_{db_id}")
 
         try:
-            # 检查集合是否存在
-            if utility.has_collection(collection_name, using=self.connection_alias):
-                collection = Collection(
+            # 检查集合是否存在（实例池每次重新加载被淘汰的集合都会调用，pymilvus 调用在线程中执行）
+            if await asyncio.to_thread(utility.has_collection, collection_name, using=self.connection_alias):
+                collection = await asyncio.to_thread(
+                    Collection,
                     name=collection_name,
                     using=self.connection_alias
                 )
@@ -115,7 +217,7 @@ class MilvusKB(KnowledgeBase):
 
                 if expected_model not in description:
                     logger.warning(f"Collection {collection_name} model mismatch, recreating...")
-                    utility.drop_collection(collection_name, using=self.connection_alias)
+                    await asyncio.to_thread(utility.drop_collection, collection_name, using=self.connection_alias)
                     raise Exception("Model mismatch, recreating collection")
 
                 logger.info(f"Retrieved existing collection: {collection_name}")
@@ -144,65 +246,50 @@ class MilvusKB(KnowledgeBase):
             )
 
             # 创建集合
-            collection = Collection(
+            collection = await asyncio.to_thread(
+                Collection,
                 name=collection_name,
                 schema=schema,
                 using=self.connection_alias
             )
 
-            # 创建索引
-            index_params = {
-                "metric_type": "COSINE",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 1024}
-            }
-            collection.create_index("embedding", index_params)
+            # 按预估规模（创建数据库时的 expected_size）与召回率目标选择索引
+            db_config = self.databases_meta[db_id].get("metadata") or {}
+            index_config = select_index_config(int(db_config.get("expected_size") or 0), embedding_dim,
+                                               float(db_config.get("recall_target") or 0.95))
+            await asyncio.to_thread(collection.create_index, "embedding", {"metric_type": "COSINE", **index_config})
+            self.databases_meta[db_id]["index_config"] = index_config
+            self._save_database_meta(db_id)
+            logger.info(f"Created {index_config['index_type']} index for {collection_name}: {index_config['params']}")
 
             logger.info(f"Created new Milvus collection: {collection_name}")
 
         return collection
 
     async def _initialize_kb_instance(self, instance: Any) -> None:
-        """初始化 Milvus 集合（加载到内存）"""
+        """初始化 Milvus 集合（加载到内存），大集合加载耗时较长，在线程中执行以免阻塞事件循环"""
         try:
-            instance.load()
+            await asyncio.to_thread(instance.load)
             logger.info("Milvus collection loaded into memory")
         except Exception as e:
             logger.warning(f"Failed to load collection into memory: {e}")
 
-    def _get_embedding_function(self, embed_info: Dict):
-        """获取 embedding 函数"""
+    async def _aembed_texts(self, db_id: str, texts: List[str]) -> List[List[float]]:
+        """
+        异步计算向量（经过 embedding 缓存），未命中的文本通过共享的 embedding 客户端按批次请求，
+        并发数受客户端的 max_concurrency 限制，限流与临时错误自动重试
+
+        Args:
+            db_id: 数据库ID
+            texts: 文本列表
+
+        Returns:
+            与 texts 一一对应的向量
+        """
+        embed_info = self.databases_meta[db_id].get("embed_info", {})
         config_dict = get_embedding_config(embed_info)
-        model = config_dict["model"]
-        api_key = config_dict["api_key"]
-        base_url = config_dict["base_url"]
-
-        # 返回同步的嵌入函数
-        def embedding_function(texts):
-            import asyncio
-            import concurrent.futures
-            from lightrag.llm.openai import openai_embed
-
-            def run_embedding():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    return loop.run_until_complete(
-                        openai_embed(
-                            texts=texts,
-                            model=model,
-                            api_key=api_key,
-                            base_url=base_url.replace("/embeddings", ""),
-                        )
-                    )
-                finally:
-                    loop.close()
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(run_embedding)
-                return future.result()
-
-        return embedding_function
+        client = get_embedding_client(config_dict["model"], config_dict["base_url"], config_dict["api_key"])
+        return await client.abatch_encode(list(texts), batch_size=self.embed_batch_size)
 
     async def _get_milvus_collection(self, db_id: str):
         """获取或创建 Milvus 集合"""
@@ -212,25 +299,44 @@ class MilvusKB(KnowledgeBase):
         if db_id not in self.databases_meta:
             return None
 
-        try:
-            # 创建集合
-            collection = await self._create_kb_instance(db_id, {})
-            await self._initialize_kb_instance(collection)
-
-            self.collections[db_id] = collection
-            return collection
-
-        except Exception as e:
-            logger.error(f"Failed to create Milvus collection for {db_id}: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return None
-
-    def _split_text_into_chunks(self, text: str, file_id: str, filename: str) -> List[Dict]:
-        """将文本分割成块"""
-        return split_text_into_chunks(text, file_id, filename, self.chunk_size, self.chunk_overlap)
+        async def create():
+            try:
+                collection = await self._create_kb_instance(db_id, {})
+                await self._initialize_kb_instance(collection)
+                return collection
+            except Exception as e:
+                logger.error(f"Failed to create Milvus collection for {db_id}: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                return None
+
+        return await self.collections.get_or_create(db_id, create)
+
+    async def _release_collection(self, db_id: str, collection: Any) -> None:
+        """实例池淘汰集合时将其从 Milvus 内存中释放"""
+        await asyncio.to_thread(collection.release)
+        logger.info(f"Released Milvus collection {collection.name} of {db_id}")
+
+    def _is_instance_busy(self, db_id: str) -> bool:
+        """有未写入的缓冲、待执行的 flush 或正在重建索引的数据库不能被淘汰"""
+        return (super()._is_instance_busy(db_id) or db_id in self._insert_buffers
+                or db_id in self._flush_timers or db_id in self._reindex_tasks)
+
+    def get_instance_stats(self) -> Dict:
+        """常驻（已加载到内存的）集合统计"""
+        return self.collections.stats()
+
+    def _split_text_into_chunks(self, text: str, file_id: str, filename: str,
+                                params: Optional[Dict] = None) -> List[Dict]:
+        """将文本分割成块，params 中的 chunk_size / chunk_overlap / chunk_unit 优先于知识库默认配置"""
+        params = params or {}
+        return list(iter_chunks(text, file_id, filename,
+                                chunk_size=int(params.get("chunk_size") or self.chunk_size),
+                                chunk_overlap=int(params.get("chunk_overlap", self.chunk_overlap)),
+                                chunk_unit=params.get("chunk_unit", "char")))
 
     async def add_content(self, db_id: str, items: List[str],
-                         params: Optional[Dict] = None) -> List[Dict]:
+                         params: Optional[Dict] = None,
+                         progress_callback: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
         """添加内容（文件/URL）"""
         if db_id not in self.databases_meta:
             raise ValueError(f"Database {db_id} not found")
@@ -239,158 +345,525 @@ class MilvusKB(KnowledgeBase):
         if not collection:
             raise ValueError(f"Failed to get Milvus collection for {db_id}")
 
-        embed_info = self.databases_meta[db_id].get("embed_info", {})
-        embedding_function = self._get_embedding_function(embed_info)
+        return await IngestionPipeline(self, db_id, params, progress_callback).run(items)
 
-        content_type = params.get('content_type', 'file') if params else 'file'
-        processed_items_info = []
+    def _ingest_chunk(self, db_id: str, file_meta: Dict, content: str,
+                      params: Optional[Dict] = None) -> List[Dict]:
+        """分块阶段"""
+        return self._split_text_into_chunks(content, file_meta["file_id"], file_meta["filename"], params)
 
-        for item in items:
-            # 准备文件元数据
-            metadata = prepare_item_metadata(item, content_type, db_id)
-            file_id = metadata["file_id"]
-            filename = metadata["filename"]
-            item_path = metadata["path"]
+    async def _ingest_embed(self, db_id: str, chunks: List[Dict]) -> Optional[List[List[float]]]:
+        """向量化阶段"""
+        if not chunks:
+            return None
 
-            # 添加文件记录
-            file_record = metadata.copy()
-            del file_record["file_id"]  # 从记录中移除file_id，因为它是key
-            self.files_meta[file_id] = file_record
-            self._save_metadata()
+        return await self._aembed_texts(db_id, [chunk["content"] for chunk in chunks])
+
+    async def _ingest_insert(self, db_id: str, file_meta: Dict, content: str,
+                             chunks: List[Dict], embeddings: Optional[List[List[float]]]) -> None:
+        """写入阶段"""
+        if not chunks:
+            return
+
+        # 写入缓冲区，由 _ingest_commit 等待实际插入；追加过程中没有 await，不会与开始重建索引交错
+        async with self._collection_for_write(db_id):
+            buffer = self._insert_buffers.get(db_id)
+            if buffer is None:
+                buffer = {"rows": [], "future": asyncio.get_running_loop().create_future()}
+                buffer["timer"] = asyncio.create_task(self._drain_after_linger(db_id, buffer))
+                self._insert_buffers[db_id] = buffer
+
+            buffer["rows"].extend(zip(
+                [chunk["id"] for chunk in chunks],                    # id
+                [chunk["content"] for chunk in chunks],              # content
+                [chunk["source"] for chunk in chunks],               # source
+                [chunk["chunk_id"] for chunk in chunks],             # chunk_id
+                [chunk["file_id"] for chunk in chunks],              # file_id
+                [chunk["chunk_index"] for chunk in chunks],          # chunk_index
+                embeddings                                            # embedding
+            ))
+            self._pending_commits[(db_id, file_meta["file_id"])] = buffer["future"]
+            self._pending_lexical[(db_id, file_meta["file_id"])] = chunks
+
+        if len(buffer["rows"]) >= self.bulk_insert_rows:
+            await self._drain_insert_buffer(db_id)
+
+    async def _ingest_commit(self, db_id: str, file_id: str) -> None:
+        """等待文件所在的缓冲区插入完成，插入失败时抛出异常；插入成功后再写入倒排索引"""
+        key = (db_id, file_id)
+        try:
+            future = self._pending_commits.get(key)
+            if future is not None:
+                await asyncio.shield(future)
+            chunks = self._pending_lexical.get(key)
+            if chunks:
+                await self._lexical_add(db_id, chunks)
+        finally:
+            self._pending_commits.pop(key, None)
+            self._pending_lexical.pop(key, None)
+
+    async def _ingest_abort(self, db_id: str, file_id: str) -> None:
+        """文件处理失败：丢弃缓冲区中该文件尚未插入的分块"""
+        removed = self._discard_buffered_rows(db_id, file_id)
+        self._pending_commits.pop((db_id, file_id), None)
+        self._pending_lexical.pop((db_id, file_id), None)
+        if removed:
+            logger.info(f"Discarded {removed} buffered chunks of failed file {file_id}")
+
+    def _discard_buffered_rows(self, db_id: str, file_id: str) -> int:
+        """从尚未插入的缓冲区中移除文件的分块，返回移除的行数"""
+        buffer = self._insert_buffers.get(db_id)
+        if buffer is None:
+            return 0
+        rows = buffer["rows"]
+        buffer["rows"] = [row for row in rows if row[4] != file_id]
+        return len(rows) - len(buffer["rows"])
+
+    async def _wait_for_writes(self, db_id: str) -> None:
+        """等待进行中的写入完成（不论成功与否）"""
+        futures = list(self._inflight_writes.get(db_id, ()))
+        if futures:
+            await asyncio.wait(futures)
+
+    @asynccontextmanager
+    async def _collection_for_write(self, db_id: str):
+        """
+        获取用于写入的集合，并在写入期间登记为进行中的写入
 
-            # 添加 file_id 到返回数据
-            file_record = file_record.copy()
-            file_record["file_id"] = file_id
+        先等待进行中的重建索引结束；获取集合需要 await，期间可能开始新的重建，因此获取后重新检查。
+        登记后开始的重建索引会在复制数据前等待本次写入完成。
 
-            try:
-                # 根据内容类型处理内容
-                if content_type == "file":
-                    markdown_content = await self._process_file_to_markdown(item, params=params)
-                else:  # URL
-                    markdown_content = await self._process_url_to_markdown(item, params=params)
-
-                # 分割文本成块
-                chunks = self._split_text_into_chunks(markdown_content, file_id, filename)
-                logger.info(f"Split {filename} into {len(chunks)} chunks")
-
-                # 准备 Milvus 插入的数据
-                if chunks:
-                    # 生成嵌入向量
-                    texts = [chunk["content"] for chunk in chunks]
-                    embeddings = embedding_function(texts)
-
-                    # 准备插入数据
-                    entities = [
-                        [chunk["id"] for chunk in chunks],                    # id
-                        [chunk["content"] for chunk in chunks],              # content
-                        [chunk["source"] for chunk in chunks],               # source
-                        [chunk["chunk_id"] for chunk in chunks],             # chunk_id
-                        [chunk["file_id"] for chunk in chunks],              # file_id
-                        [chunk["chunk_index"] for chunk in chunks],          # chunk_index
-                        embeddings                                            # embedding
-                    ]
-
-                    # 插入到 Milvus
-                    collection.insert(entities)
-                    collection.flush()
-
-                logger.info(f"Inserted {content_type} {item} into Milvus. Done.")
-
-                # 更新状态为完成
-                self.files_meta[file_id]["status"] = "done"
-                self._save_metadata()
-                file_record['status'] = "done"
+        Raises:
+            ValueError: 集合不存在
+        """
+        while True:
+            await self._wait_for_reindex(db_id)
+            collection = await self._get_milvus_collection(db_id)
+            if not collection:
+                raise ValueError(f"Failed to get Milvus collection for {db_id}")
+            if db_id not in self._write_gates:
+                break
+
+        done = asyncio.get_running_loop().create_future()
+        writes = self._inflight_writes.setdefault(db_id, set())
+        writes.add(done)
+        try:
+            yield collection
+        finally:
+            writes.discard(done)
+            done.set_result(None)
+
+    async def _ingest_finalize(self, db_id: str) -> None:
+        """入库结束：插入剩余的缓冲数据，flush 一次并触发压缩"""
+        await self._drain_insert_buffer(db_id)
+        if db_id in self._flush_timers:
+            await self._flush_and_compact(db_id)
+
+    async def _drain_after_linger(self, db_id: str, buffer: Dict):
+        """缓冲区建立 bulk_linger 秒后，无论是否写满都插入"""
+        await asyncio.sleep(self.bulk_linger)
+        if self._insert_buffers.get(db_id) is buffer:
+            await self._drain_insert_buffer(db_id)
+
+    async def _drain_insert_buffer(self, db_id: str):
+        """将缓冲区中的数据分批插入 Milvus（不 flush）"""
+        buffer = self._insert_buffers.pop(db_id, None)
+        if buffer is None:
+            return
+        if buffer["timer"] is not asyncio.current_task():
+            buffer["timer"].cancel()
+
+        rows = buffer["rows"]
+        writes = self._inflight_writes.setdefault(db_id, set())
+        writes.add(buffer["future"])
+        try:
+            collection = await self._get_milvus_collection(db_id)
+            if not collection:
+                raise ValueError(f"Failed to get Milvus collection for {db_id}")
 
-            except Exception as e:
-                logger.error(f"处理{content_type} {item} 失败: {e}, {traceback.format_exc()}")
-                self.files_meta[file_id]["status"] = "failed"
-                self._save_metadata()
-                file_record['status'] = "failed"
+            for i in range(0, len(rows), self.bulk_insert_rows):
+                entities = [list(column) for column in zip(*rows[i:i + self.bulk_insert_rows])]
+                await asyncio.to_thread(collection.insert, entities)
+            logger.info(f"Inserted {len(rows)} buffered rows into {db_id}")
+            buffer["future"].set_result(len(rows))
+            self._schedule_flush(db_id)
 
-            processed_items_info.append(file_record)
+        except Exception as e:
+            logger.error(f"Failed to insert buffered rows into {db_id}: {e}, {traceback.format_exc()}")
+            buffer["future"].set_exception(e)
+            # 没有文件等待时避免出现 "exception was never retrieved" 警告
+            buffer["future"].exception()
 
-        return processed_items_info
+        finally:
+            writes.discard(buffer["future"])
 
-    async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
-        """异步查询知识库"""
+    def _schedule_flush(self, db_id: str):
+        """在 flush_interval 秒后 flush 并压缩，期间的多次写入/删除只触发一次"""
+        if db_id not in self._flush_timers:
+            self._flush_timers[db_id] = asyncio.create_task(self._flush_later(db_id))
+
+    async def _flush_later(self, db_id: str):
+        await asyncio.sleep(self.flush_interval)
+        await self._flush_and_compact(db_id)
+
+    async def _flush_and_compact(self, db_id: str):
+        """flush 集合，并在 flush 后触发压缩以合并小 segment"""
+        timer = self._flush_timers.pop(db_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        collection = self.collections.get(db_id)
+        if collection is None:
+            return
+
+        try:
+            start = time.time()
+            await asyncio.to_thread(collection.flush)
+            await asyncio.to_thread(collection.compact)
+            logger.info(f"Flushed and compacted Milvus collection for {db_id} in {time.time() - start:.2f}s")
+
+            # 规模超出当前索引的适用范围时提示重建
+            index_info = await self.aget_index_info(db_id)
+            if index_info["needs_reindex"]:
+                logger.warning(f"Milvus collection for {db_id} has {index_info['num_vectors']} vectors, "
+                               f"{index_info['recommended']['index_type']} index is recommended over "
+                               f"{index_info['index_config']['index_type']}, consider reindexing")
+        except Exception as e:
+            logger.error(f"Failed to flush/compact Milvus collection for {db_id}: {e}")
+
+    async def _get_file_chunk_index(self, db_id: str, file_id: str) -> Optional[Dict[str, int]]:
+        """获取文件已入库分块的 {chunk_id: chunk_index}"""
         collection = await self._get_milvus_collection(db_id)
         if not collection:
+            raise ValueError(f"Failed to get Milvus collection for {db_id}")
+
+        results = await self._query_all(collection, f'file_id == "{file_id}"', ["id", "chunk_index"])
+        return {result["id"]: result.get("chunk_index", -1) for result in results}
+
+    async def _ingest_remove(self, db_id: str, file_id: str,
+                             chunk_ids: Optional[List[str]] = None) -> None:
+        """删除文件的旧分块"""
+        async with self._collection_for_write(db_id) as collection:
+            if chunk_ids is None:
+                await asyncio.to_thread(collection.delete, f'file_id == "{file_id}"')
+            elif chunk_ids:
+                await asyncio.to_thread(collection.delete, f"id in {json.dumps(chunk_ids)}")
+                logger.info(f"Deleted {len(chunk_ids)} stale chunks for file {file_id}")
+        await self._lexical_remove(db_id, file_id, chunk_ids)
+
+    async def _ingest_update_chunks(self, db_id: str, chunks: List[Dict]) -> None:
+        """更新位置变化的分块，Milvus 需要带上原向量整行 upsert"""
+        async with self._collection_for_write(db_id) as collection:
+            chunk_ids = [chunk["id"] for chunk in chunks]
+            rows = await asyncio.to_thread(
+                collection.query,
+                expr=f"id in {json.dumps(chunk_ids)}",
+                output_fields=["id", "embedding"]
+            )
+            embeddings = {row["id"]: row["embedding"] for row in rows}
+            chunks = [chunk for chunk in chunks if chunk["id"] in embeddings]
+            if not chunks:
+                return
+
+            await asyncio.to_thread(collection.upsert, [
+                [chunk["id"] for chunk in chunks],
+                [chunk["content"] for chunk in chunks],
+                [chunk["source"] for chunk in chunks],
+                [chunk["chunk_id"] for chunk in chunks],
+                [chunk["file_id"] for chunk in chunks],
+                [chunk["chunk_index"] for chunk in chunks],
+                [embeddings[chunk["id"]] for chunk in chunks]
+            ])
+
+    def _get_index_config(self, db_id: str) -> Dict:
+        """当前集合的索引配置，旧版本创建的集合为 IVF_FLAT"""
+        return self.databases_meta.get(db_id, {}).get("index_config") or LEGACY_INDEX_CONFIG
+
+    def _get_recall_target(self, db_id: str) -> float:
+        db_config = self.databases_meta.get(db_id, {}).get("metadata") or {}
+        return float(db_config.get("recall_target") or 0.95)
+
+    def _count_vectors(self, db_id: str) -> int:
+        """读取集合的实体数量（同步 RPC，需在线程中调用）；已被淘汰的集合不需要重新加载，只需要集合句柄"""
+        collection = self.collections.get(db_id)
+        if collection is None:
+            collection_name = self.databases_meta[db_id].get("collection_name", f"kb_{db_id}")
+            if not utility.has_collection(collection_name, using=self.connection_alias):
+                return 0
+            collection = Collection(name=collection_name, using=self.connection_alias)
+        return collection.num_entities
+
+    async def aget_index_info(self, db_id: str) -> Dict:
+        """
+        获取索引信息：当前索引、向量数量、按当前规模推荐的索引以及重建进度
+
+        Args:
+            db_id: 数据库ID
+
+        Returns:
+            索引信息
+        """
+        if db_id not in self.databases_meta:
             raise ValueError(f"Database {db_id} not found")
 
+        embed_info = self.databases_meta[db_id].get("embed_info") or {}
+        num_vectors = await asyncio.to_thread(self._count_vectors, db_id)
+        index_config = self._get_index_config(db_id)
+        recommended = select_index_config(num_vectors, embed_info.get("dimension", 1024), self._get_recall_target(db_id))
+
+        return {
+            "db_id": db_id,
+            "collection_name": self.databases_meta[db_id].get("collection_name", f"kb_{db_id}"),
+            "num_vectors": num_vectors,
+            "index_config": index_config,
+            "recommended": recommended,
+            "needs_reindex": recommended["index_type"] != index_config["index_type"],
+            "reindex": self._reindex_status.get(db_id),
+        }
+
+    async def reindex(self, db_id: str, index_type: Optional[str] = None,
+                      index_params: Optional[Dict] = None, recall_target: Optional[float] = None) -> Dict:
+        """
+        在线重建索引：在后台将数据复制到使用新索引的集合，完成后切换，期间查询仍由旧集合提供
+
+        Args:
+            db_id: 数据库ID
+            index_type: 指定索引类型，为 None 时根据规模自动选择
+            index_params: 指定索引参数
+            recall_target: 召回率目标，会保存为数据库配置
+
+        Returns:
+            索引信息
+        """
+        if await self._get_milvus_collection(db_id) is None:
+            raise ValueError(f"Database {db_id} not found")
+        if db_id in self._reindex_tasks:
+            raise ValueError(f"Database {db_id} is already being reindexed")
+
+        if recall_target is not None:
+            self.databases_meta[db_id].setdefault("metadata", {})["recall_target"] = recall_target
+            self._save_database_meta(db_id)
+
+        self._reindex_status[db_id] = {"status": "running", "copied": 0, "total": None,
+                                       "error": None, "started_at": time.time(), "finished_at": None}
+        self._write_gates[db_id] = asyncio.Event()
+        self._reindex_tasks[db_id] = asyncio.create_task(self._run_reindex(db_id, index_type, index_params))
+        return await self.aget_index_info(db_id)
+
+    async def _wait_for_reindex(self, db_id: str):
+        """重建索引期间写入需要等待切换完成，避免写入即将被替换的旧集合"""
+        gate = self._write_gates.get(db_id)
+        if gate is not None:
+            await gate.wait()
+
+    async def _run_reindex(self, db_id: str, index_type: Optional[str], index_params: Optional[Dict]):
+        status = self._reindex_status[db_id]
+        gate = self._write_gates[db_id]
+        new_collection = None
         try:
-            # 设置查询参数 - Milvus 知识库特有的参数
-            top_k = kwargs.get("top_k", 10)
-            similarity_threshold = kwargs.get("similarity_threshold", 0.0)  # 相似度阈值
-            include_distances = kwargs.get("include_distances", True)  # 是否包含距离信息
-            metric_type = kwargs.get("metric_type", "COSINE")  # 距离度量类型
-
-            # 生成查询向量
-            embed_info = self.databases_meta[db_id].get("embed_info", {})
-            embedding_function = self._get_embedding_function(embed_info)
-            query_embedding = embedding_function([query_text])
-
-            # 执行相似性搜索
-            search_params = {"metric_type": metric_type, "params": {"nprobe": 10}}
-            results = collection.search(
-                data=query_embedding,
-                anns_field="embedding",
-                param=search_params,
-                limit=top_k,
-                output_fields=["content", "source", "chunk_id", "file_id", "chunk_index"]
-            )
+            # 先写入缓冲数据并等待进行中的写入完成，再以旧集合的当前数据为准复制
+            await self._drain_insert_buffer(db_id)
+            await self._wait_for_writes(db_id)
+            old_collection = self.collections[db_id]
+            await asyncio.to_thread(old_collection.flush)
+            status["total"] = total = await asyncio.to_thread(lambda: old_collection.num_entities)
+
+            embed_info = self.databases_meta[db_id].get("embed_info") or {}
+            if index_type:
+                index_config = {"index_type": index_type, "params": index_params or {}}
+            else:
+                index_config = select_index_config(total, embed_info.get("dimension", 1024), self._get_recall_target(db_id))
+
+            new_name = f"kb_{db_id}_{int(time.time())}"
+            new_collection = await asyncio.to_thread(Collection, name=new_name, schema=old_collection.schema,
+                                                     using=self.connection_alias)
+            logger.info(f"Reindexing {db_id} into {new_name} with {index_config}, {total} vectors")
 
-            # 处理结果
-            if results and len(results) > 0 and len(results[0]) > 0:
-                contexts = []
-                for i, hit in enumerate(results[0]):
-                    # 计算相似度
-                    similarity = 1 - hit.distance if metric_type == "COSINE" else 1 / (1 + hit.distance)
+            field_names = [field.name for field in old_collection.schema.fields]
+            iterator = await asyncio.to_thread(old_collection.query_iterator, batch_size=1000, expr='id != ""',
+                                               output_fields=field_names)
+            try:
+                while True:
+                    rows = await asyncio.to_thread(iterator.next)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(new_collection.insert, rows)
+                    status["copied"] += len(rows)
+            finally:
+                await asyncio.to_thread(iterator.close)
+
+            await asyncio.to_thread(new_collection.flush)
+            await asyncio.to_thread(new_collection.create_index, "embedding", {"metric_type": "COSINE", **index_config})
+            await asyncio.to_thread(new_collection.load)
+
+            # 切换到新集合并删除旧集合
+            self.collections[db_id] = new_collection
+            self.databases_meta[db_id]["collection_name"] = new_name
+            self.databases_meta[db_id]["index_config"] = index_config
+            self._save_database_meta(db_id)
+            await asyncio.to_thread(utility.drop_collection, old_collection.name, using=self.connection_alias)
+
+            status["status"] = "done"
+            logger.info(f"Reindexed {db_id}: {status['copied']} vectors, {index_config['index_type']}")
 
-                    # 应用相似度阈值过滤
-                    if similarity < similarity_threshold:
-                        continue
+        except Exception as e:
+            logger.error(f"Failed to reindex {db_id}: {e}, {traceback.format_exc()}")
+            status["status"] = "failed"
+            status["error"] = str(e)
+            if new_collection is not None and self.collections.get(db_id) is not new_collection:
+                try:
+                    await asyncio.to_thread(utility.drop_collection, new_collection.name, using=self.connection_alias)
+                except Exception as drop_error:
+                    logger.error(f"Failed to drop partial collection {new_collection.name}: {drop_error}")
 
-                    entity = hit.entity
-                    content = entity.get("content", "")
-                    source = entity.get("source", "未知来源")
-                    chunk_id = entity.get("chunk_id", f"chunk_{i}")
+        finally:
+            status["finished_at"] = time.time()
+            self._write_gates.pop(db_id, None)
+            self._reindex_tasks.pop(db_id, None)
+            gate.set()
 
-                    context = f"[文档片段 {i+1}]:\n{content}\n"
-                    context += f"来源: {source} ({chunk_id})\n"
-                    if include_distances:
-                        context += f"相似度: {similarity:.3f}\n"
-                    contexts.append(context)
+    async def aquery(self, query_text: str, db_id: str, **kwargs) -> str:
+        """异步查询知识库"""
+        return (await self.abatch_query([query_text], db_id, **kwargs))[0]
 
-                response = "\n".join(contexts)
-                logger.debug(f"Milvus query response: {len(contexts)} chunks found (after similarity filtering)")
-                return response
+    async def abatch_query(self, queries: List[str], db_id: str, **kwargs) -> List[str]:
+        """批量查询：检索后格式化为上下文文本"""
+        if not queries:
+            return []
 
-            return ""
+        try:
+            include_distances = kwargs.get("include_distances", True)  # 是否包含距离信息
+            results = await self.abatch_retrieve(queries, db_id, **kwargs)
+            logger.debug(f"Milvus query response: {[len(hits) for hits in results]} chunks found")
+            return [format_hits(hits, include_distances) for hits in results]
 
         except Exception as e:
             logger.error(f"Milvus query error: {e}, {traceback.format_exc()}")
-            return ""
+            return [""] * len(queries)
 
+    async def abatch_retrieve(self, queries: List[str], db_id: str, **kwargs) -> List[List[RetrievalHit]]:
+        """批量结构化检索：向量检索一次计算所有查询向量、一次 search 完成，按 fusion_mode 与 BM25 结果融合"""
+        collection = await self._get_milvus_collection(db_id)
+        if not collection:
+            raise ValueError(f"Database {db_id} not found")
+
+        return await super().abatch_retrieve(queries, db_id, **kwargs)
+
+    def _to_hit(self, db_id: str, entity, similarity: Optional[float] = None) -> RetrievalHit:
+        return RetrievalHit(
+            id=entity.get("id"),
+            content=entity.get("content", ""),
+            chunk_id=entity.get("chunk_id"),
+            file_id=entity.get("file_id"),
+            chunk_index=entity.get("chunk_index"),
+            source=entity.get("source"),
+            similarity=similarity,
+            db_id=db_id,
+        )
+
+    async def _vector_search(self, db_id: str, queries: List[str], top_k: int,
+                             params: Dict) -> List[List[RetrievalHit]]:
+        """向量检索"""
+        collection = await self._get_milvus_collection(db_id)
+        metric_type = params.get("metric_type", "COSINE")  # 距离度量类型
+
+        # 生成查询向量
+        query_embeddings = await self._aembed_texts(db_id, queries)
+
+        # 执行相似性搜索，检索强度由索引类型与召回率目标决定，可按查询覆盖 ef / nprobe / search_list
+        search_params = {
+            "metric_type": metric_type,
+            "params": build_search_params(
+                self._get_index_config(db_id), top_k,
+                recall_target=float(params.get("recall_target") or self._get_recall_target(db_id)),
+                ef=params.get("ef"), nprobe=params.get("nprobe"), search_list=params.get("search_list")
+            )
+        }
+        results = await asyncio.to_thread(
+            collection.search,
+            data=query_embeddings,
+            anns_field="embedding",
+            param=search_params,
+            limit=top_k,
+            output_fields=RETRIEVAL_FIELDS
+        )
+
+        hits = []
+        for q in range(len(queries)):
+            hits.append([self._to_hit(
+                db_id, {**{field: hit.entity.get(field) for field in RETRIEVAL_FIELDS}, "id": hit.id},
+                # 计算相似度
+                similarity=1 - hit.distance if metric_type == "COSINE" else 1 / (1 + hit.distance),
+            ) for hit in (results[q] if results and q < len(results) else [])])
+        return hits
+
+    async def _fetch_chunks(self, db_id: str, chunk_ids: List[str]) -> Dict[str, RetrievalHit]:
+        """按分块ID读取分块内容"""
+        collection = await self._get_milvus_collection(db_id)
+        results = await asyncio.to_thread(
+            collection.query,
+            expr=f"id in {json.dumps(chunk_ids)}",
+            output_fields=["id", *RETRIEVAL_FIELDS]
+        )
+        return {result["id"]: self._to_hit(db_id, result) for result in results}
+
+    async def _iter_stored_chunks(self, db_id: str, batch_size: int = 1000):
+        """分批读取集合中的全部分块"""
+        collection = await self._get_milvus_collection(db_id)
+        iterator = await asyncio.to_thread(collection.query_iterator, batch_size=batch_size, expr='id != ""',
+                                           output_fields=["id", "file_id", "content"])
+        try:
+            while True:
+                rows = await asyncio.to_thread(iterator.next)
+                if not rows:
+                    break
+                yield [{"id": row["id"], "file_id": row.get("file_id", ""), "content": row.get("content", "")}
+                       for row in rows]
+        finally:
+            await asyncio.to_thread(iterator.close)
+
+    async def _query_all(self, collection, expr: str, output_fields: List[str],
+                         batch_size: int = 1000) -> List[Dict]:
+        """分批读取满足条件的全部行，不受单次 query 的 limit 上限限制"""
+        iterator = await asyncio.to_thread(collection.query_iterator, batch_size=batch_size, expr=expr,
+                                           output_fields=output_fields)
+        results = []
+        try:
+            while True:
+                rows = await asyncio.to_thread(iterator.next)
+                if not rows:
+                    break
+                results.extend(rows)
+        finally:
+            await asyncio.to_thread(iterator.close)
+        return results
+
+    @holds_instance
     async def delete_file(self, db_id: str, file_id: str) -> None:
         """删除文件"""
-        collection = await self._get_milvus_collection(db_id)
-        if collection:
-            try:
+        # 缓冲区中尚未插入的分块直接丢弃，已在插入中的等待完成后随下面的删除一并删除
+        self._discard_buffered_rows(db_id, file_id)
+        self._pending_lexical.pop((db_id, file_id), None)
+        await self._wait_for_writes(db_id)
+
+        try:
+            async with self._collection_for_write(db_id) as collection:
                 # 删除所有相关chunks
-                expr = f'file_id == "{file_id}"'
-                collection.delete(expr)
-                collection.flush()
-                logger.info(f"Deleted chunks for file {file_id} from Milvus")
+                await asyncio.to_thread(collection.delete, f'file_id == "{file_id}"')
+            self._schedule_flush(db_id)
+            logger.info(f"Deleted chunks for file {file_id} from Milvus")
 
-            except Exception as e:
-                logger.error(f"Error deleting file {file_id} from Milvus: {e}")
+        except Exception as e:
+            logger.error(f"Error deleting file {file_id} from Milvus: {e}")
+
+        await self._lexical_remove(db_id, file_id)
 
         # 删除文件记录
-        if file_id in self.files_meta:
-            del self.files_meta[file_id]
-            self._save_metadata()
+        self._remove_file_meta(file_id)
 
-    async def get_file_info(self, db_id: str, file_id: str) -> Dict:
+    @holds_instance
+    async def get_file_info(self, db_id: str, file_id: str, page: int = 1,
+                            page_size: Optional[int] = None) -> Dict:
         """获取文件信息和chunks"""
         if file_id not in self.files_meta:
             raise Exception(f"File not found: {file_id}")
@@ -400,12 +873,8 @@ class MilvusKB(KnowledgeBase):
         if collection:
             try:
                 # 查询文档的所有chunks
-                expr = f'file_id == "{file_id}"'
-                results = collection.query(
-                    expr=expr,
-                    output_fields=["content", "chunk_id", "chunk_index"],
-                    limit=10000  # 假设单个文件不会超过10000个chunks
-                )
+                results = await self._query_all(collection, f'file_id == "{file_id}"',
+                                                ["content", "chunk_id", "chunk_index"])
 
                 # 构建chunks数据
                 doc_chunks = []
@@ -419,7 +888,7 @@ class MilvusKB(KnowledgeBase):
 
                 # 按 chunk_order_index 排序
                 doc_chunks.sort(key=lambda x: x.get("chunk_order_index", 0))
-                return {"lines": doc_chunks}
+                return self._paginate_lines(doc_chunks, page, page_size)
 
             except Exception as e:
                 logger.error(f"Error getting chunks for file {file_id}: {e}")
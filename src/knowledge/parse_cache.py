@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from src import config
+from src.utils import logger
+
+
+class ParseCache:
+    """
+    文档解析结果的持久化缓存
+
+    以 (文件内容哈希, 解析器, 解析参数) 为键保存解析得到的文本，同一文件重试入库或加入其他知识库时
+    不再重复执行 PDF 解析与 OCR。总大小超过上限时按最近访问时间淘汰。
+    """
+
+    # 解析逻辑变化时递增，使旧的缓存失效
+    VERSION = 1
+
+    def __init__(self, db_path: str, max_size_mb: int = 4096):
+        """
+        Args:
+            db_path: SQLite 文件路径
+            max_size_mb: 缓存文本的总大小上限（MB）
+        """
+        self.db_path = db_path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS parsed (
+                key TEXT PRIMARY KEY,
+                parser TEXT NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parsed_last_access ON parsed (last_access)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parsed").fetchone()[0]
+
+    @classmethod
+    def _key(cls, content_hash: str, parser: str, parser_params: Optional[Dict]) -> str:
+        params = json.dumps(parser_params or {}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{cls.VERSION}:{content_hash}:{parser}:{params}".encode("utf-8")).hexdigest()
+
+    def get(self, content_hash: str, parser: str, parser_params: Optional[Dict] = None) -> Optional[str]:
+        """
+        读取解析结果
+
+        Args:
+            content_hash: 文件内容的 sha256
+            parser: 解析器名称
+            parser_params: 影响解析结果的参数
+
+        Returns:
+            解析得到的文本，未命中时返回 None
+        """
+        key = self._key(content_hash, parser, parser_params)
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM parsed WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE parsed SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, content_hash: str, parser: str, parser_params: Optional[Dict], text: str) -> None:
+        """写入解析结果，超过大小上限时淘汰最久未访问的记录"""
+        key = self._key(content_hash, parser, parser_params)
+        size = len(text.encode("utf-8", errors="replace"))
+        if size > self.max_size:
+            return
+
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM parsed WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parsed (key, parser, text, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, parser, text, size, time.time())
+            )
+            self._total_size += size - (old[0] if old else 0)
+            self._evict()
+
+    def stats(self) -> Dict:
+        """命中/未命中次数与缓存大小"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size_mb": round(self._total_size / 1024 / 1024, 2),
+        }
+
+    def _evict(self) -> None:
+        """超过大小上限时按最久未访问的顺序逐条删除记录，降到上限以内即停止，调用方持有锁"""
+        if self._total_size <= self.max_size:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM parsed ORDER BY last_access"):
+            if self._total_size <= self.max_size:
+                break
+            evicted.append((key,))
+            self._total_size -= size
+        self._conn.executemany("DELETE FROM parsed WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} parsed documents from cache")
+
+
+_parse_cache: Optional[ParseCache] = None
+_parse_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> ParseCache:
+    """获取全局共享的解析结果缓存"""
+    global _parse_cache
+    if _parse_cache is None:
+        with _parse_cache_lock:
+            if _parse_cache is None:
+                db_path = os.path.join(config.save_dir, "cache", "parsed.sqlite")
+                max_size_mb = int(os.getenv("PARSE_CACHE_SIZE_MB", "4096"))
+                _parse_cache = ParseCache(db_path, max_size_mb=max_size_mb)
+                logger.info(f"Parse cache at {db_path}, max size {max_size_mb}MB")
+    return _parse_cache
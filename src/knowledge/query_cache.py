@@ -0,0 +1,112 @@
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class QueryCache:
+    """
+    检索结果缓存
+
+    以 (数据库ID, 规范化后的查询文本, 查询参数) 为键的 LRU + TTL 缓存。
+    数据库内容发生变化（添加内容、删除文件、删除数据库）时按数据库整体失效。
+    每次失效递增数据库的版本号，检索开始前记录版本号，写入时版本号已变化说明结果可能过期，不再写入。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """
+        Args:
+            max_size: 最多缓存的结果数量
+            ttl: 结果有效期（秒）
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        # {key: (expires_at, result)}，按访问顺序排列
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        # 数据库到缓存键的索引，用于按数据库失效 {db_id: {key}}
+        self._db_keys: Dict[str, Set[Tuple]] = {}
+        # 数据库的版本号（失效次数）{db_id: generation}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(db_id: str, query_text: str, params: Optional[Dict] = None) -> Tuple:
+        """构建缓存键，查询文本去除首尾空白并合并连续空白"""
+        normalized = re.sub(r"\s+", " ", query_text).strip()
+        params_key = json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return (db_id, normalized, params_key)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def generation(self, db_id: str) -> int:
+        """数据库当前的版本号，在检索开始前获取并传给 put"""
+        with self._lock:
+            return self._generations.get(db_id, 0)
+
+    def put(self, key: Tuple, result: Any, generation: Optional[int] = None) -> None:
+        """
+        写入缓存，超过容量时淘汰最久未访问的结果
+
+        Args:
+            key: 缓存键
+            result: 检索结果
+            generation: 检索开始前的版本号，与当前版本号不一致（检索期间数据库已失效）时不写入
+        """
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key[0], 0):
+                return
+            self._entries[key] = (time.time() + self.ttl, result)
+            self._entries.move_to_end(key)
+            self._db_keys.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, db_id: str) -> None:
+        """使某个数据库的全部缓存失效"""
+        with self._lock:
+            self._generations[db_id] = self._generations.get(db_id, 0) + 1
+            keys = self._db_keys.pop(db_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                self.invalidations += 1
+
+    def _remove(self, key: Tuple) -> None:
+        """删除单个缓存项，调用方需持有锁"""
+        self._entries.pop(key, None)
+        db_keys = self._db_keys.get(key[0])
+        if db_keys is not None:
+            db_keys.discard(key)
+            if not db_keys:
+                del self._db_keys[key[0]]
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "invalidations": self.invalidations,
+        }
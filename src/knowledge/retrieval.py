@@ -0,0 +1,54 @@
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, List, Optional
+
+
+@dataclass(frozen=True)
+class RetrievalHit:
+    """
+    单条检索结果
+
+    score 为最终排序所用的分数：vector 模式为相似度，lexical 模式为 BM25 分数，
+    hybrid 模式为 RRF 融合分数；重排序后另有 rerank_score。
+    """
+    id: str
+    content: str
+    score: float = 0.0
+    chunk_id: Optional[str] = None
+    file_id: Optional[str] = None
+    chunk_index: Optional[int] = None
+    source: Optional[str] = None
+    similarity: Optional[float] = None
+    rerank_score: Optional[float] = None
+    db_id: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def with_scores(self, **scores) -> "RetrievalHit":
+        """返回更新了分数（score / similarity / rerank_score）的副本"""
+        return replace(self, **scores)
+
+
+def format_hits(hits: List[RetrievalHit], include_distances: bool = True,
+                db_names: Optional[Dict[str, str]] = None) -> str:
+    """
+    将单个查询的检索结果格式化为上下文文本
+
+    Args:
+        hits: 检索结果
+        include_distances: 是否包含相似度
+        db_names: 数据库ID到名称的映射，提供时注明每个片段所属的知识库（用于联合检索）
+
+    Returns:
+        上下文文本
+    """
+    contexts = []
+    for i, hit in enumerate(hits):
+        context = f"[文档片段 {i+1}]:\n{hit.content}\n"
+        context += f"来源: {hit.source or '未知来源'} ({hit.chunk_id or f'chunk_{i}'})\n"
+        if db_names is not None and hit.db_id:
+            context += f"知识库: {db_names.get(hit.db_id, hit.db_id)}\n"
+        if include_distances and hit.similarity is not None:
+            context += f"相似度: {hit.similarity:.3f}\n"
+        contexts.append(context)
+    return "\n".join(contexts)
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import shutil
+from typing import BinaryIO, Dict, List, Optional
+
+from src.knowledge.kb_utils import save_stream, hash_file
+from src.utils import logger, hashstr
+
+
+class UploadSessionManager:
+    """
+    可续传的分片上传
+
+    客户端先创建上传会话，然后并发上传编号从 1 开始的分片（可重复上传同一分片），
+    随时可以查询已收到的分片，全部上传后合并为最终文件。每个分片单独落盘，
+    合并时使用 copy_file_range 在内核中拼接，不经过用户态内存。
+    会话保存在 work_dir/upload_sessions/<upload_id>/ 下，服务重启后仍可继续上传。
+    """
+
+    PART_PATTERN = re.compile(r"^part_(\d{6})$")
+
+    def __init__(self, work_dir: str, session_ttl: float = 24 * 3600):
+        """
+        Args:
+            work_dir: 工作目录
+            session_ttl: 会话的有效期（秒），过期未完成的会话会被清理
+        """
+        self.sessions_dir = os.path.join(work_dir, "upload_sessions")
+        self.session_ttl = session_ttl
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    def initiate(self, filename: str, file_path: str, total_size: Optional[int] = None,
+                 db_id: Optional[str] = None) -> Dict:
+        """
+        创建上传会话
+
+        Args:
+            filename: 原始文件名
+            file_path: 合并后的文件路径
+            total_size: 文件总大小（字节），用于合并时校验
+            db_id: 数据库ID
+
+        Returns:
+            会话信息
+        """
+        self.cleanup_expired()
+
+        upload_id = f"upload_{hashstr(file_path, 12, with_salt=True)}"
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "file_path": file_path,
+            "total_size": total_size,
+            "db_id": db_id,
+            "status": "uploading",
+            "created_at": time.time(),
+        }
+        os.makedirs(self._session_dir(upload_id))
+        self._save_session(session)
+        logger.info(f"Created upload session {upload_id} for {filename}")
+        return session
+
+    def save_part(self, upload_id: str, part_number: int, stream: BinaryIO,
+                  max_size: Optional[int] = None) -> Dict:
+        """
+        写入一个分片，已存在的同编号分片会被覆盖
+
+        Args:
+            upload_id: 会话ID
+            part_number: 分片编号，从 1 开始
+            stream: 分片内容
+            max_size: 文件大小上限，已收到的分片与本分片之和超出时拒绝
+
+        Returns:
+            {"part_number", "size", "sha256"}
+
+        Raises:
+            FileNotFoundError: 会话不存在
+            UploadTooLargeError: 超出大小上限
+            ValueError: 会话已结束或分片编号无效
+        """
+        session = self.get_session(upload_id)
+        if session["status"] != "uploading":
+            raise ValueError(f"Upload session {upload_id} is {session['status']}")
+        if not 1 <= part_number <= 999999:
+            raise ValueError(f"Invalid part number: {part_number}")
+
+        part_path = self._part_path(upload_id, part_number)
+        remaining = None
+        if max_size is not None:
+            received = sum(part["size"] for part in self._list_parts(upload_id) if part["part_number"] != part_number)
+            remaining = max(0, max_size - received)
+
+        sha256, size = save_stream(stream, part_path, remaining)
+        return {"part_number": part_number, "size": size, "sha256": sha256}
+
+    def get_status(self, upload_id: str) -> Dict:
+        """
+        查询会话状态与已收到的分片
+
+        Raises:
+            FileNotFoundError: 会话不存在
+        """
+        session = self.get_session(upload_id)
+        parts = self._list_parts(upload_id)
+        return {**session, "parts": parts, "received_size": sum(part["size"] for part in parts)}
+
+    def complete(self, upload_id: str, total_parts: Optional[int] = None) -> Dict:
+        """
+        合并分片为最终文件并删除会话
+
+        Args:
+            upload_id: 会话ID
+            total_parts: 分片总数，用于校验是否缺少末尾的分片
+
+        Returns:
+            {"file_path", "db_id", "content_hash", "size"}
+
+        Raises:
+            FileNotFoundError: 会话不存在
+            ValueError: 分片不连续、数量或总大小与声明的不一致
+        """
+        session = self.get_session(upload_id)
+        parts = self._list_parts(upload_id)
+        numbers = [part["part_number"] for part in parts]
+        expected = total_parts if total_parts is not None else len(parts)
+        missing = sorted(set(range(1, expected + 1)) - set(numbers))
+        if not parts or missing or len(numbers) != expected:
+            raise ValueError(f"Upload {upload_id} is incomplete, missing parts: {missing or 'unknown'}")
+
+        size = sum(part["size"] for part in parts)
+        if session["total_size"] is not None and size != session["total_size"]:
+            raise ValueError(f"Upload {upload_id} has {size} bytes, expected {session['total_size']}")
+
+        session["status"] = "completing"
+        self._save_session(session)
+
+        start = time.time()
+        file_path = session["file_path"]
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            self._concat([self._part_path(upload_id, number) for number in numbers], file_path)
+        except Exception:
+            session["status"] = "uploading"
+            self._save_session(session)
+            raise
+
+        # 合并后的文件刚写入，读取哈希时命中页缓存；哈希会被记录，入库时不再重复计算
+        content_hash = hash_file(file_path)
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        logger.info(f"Assembled {len(parts)} parts of {upload_id} into {file_path} ({size} bytes) "
+                    f"in {time.time() - start:.2f}s")
+        return {"file_path": file_path, "db_id": session["db_id"], "content_hash": content_hash, "size": size}
+
+    def abort(self, upload_id: str) -> None:
+        """删除会话与已上传的分片"""
+        self.get_session(upload_id)
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        logger.info(f"Aborted upload session {upload_id}")
+
+    def get_session(self, upload_id: str) -> Dict:
+        """
+        读取会话信息
+
+        Raises:
+            FileNotFoundError: 会话不存在
+        """
+        session_file = os.path.join(self._session_dir(upload_id), "session.json")
+        if not re.fullmatch(r"upload_\w+", upload_id) or not os.path.exists(session_file):
+            raise FileNotFoundError(f"Upload session {upload_id} not found")
+        with open(session_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def cleanup_expired(self) -> int:
+        """删除超过 session_ttl 未完成的会话，返回删除数量"""
+        removed = 0
+        now = time.time()
+        for upload_id in os.listdir(self.sessions_dir):
+            session_dir = self._session_dir(upload_id)
+            try:
+                if now - os.path.getmtime(session_dir) > self.session_ttl:
+                    shutil.rmtree(session_dir, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"Removed {removed} expired upload sessions")
+        return removed
+
+    @staticmethod
+    def _concat(part_paths: List[str], file_path: str) -> None:
+        """依次拼接分片，优先使用 copy_file_range（内核内拷贝），不支持时退回普通拷贝"""
+        tmp_path = f"{file_path}.{hashstr(file_path, 6, with_salt=True)}.part"
+        try:
+            with open(tmp_path, "wb") as out:
+                for part_path in part_paths:
+                    with open(part_path, "rb") as src:
+                        remaining = os.fstat(src.fileno()).st_size
+                        try:
+                            while remaining > 0:
+                                copied = os.copy_file_range(src.fileno(), out.fileno(), remaining)
+                                if copied == 0:
+                                    break
+                                remaining -= copied
+                        except (AttributeError, OSError):
+                            # 旧内核、非 Linux 平台或不支持的文件系统，从当前位置继续拷贝
+                            src.seek(os.fstat(src.fileno()).st_size - remaining)
+                            out.seek(0, os.SEEK_END)
+                            shutil.copyfileobj(src, out, 1 << 20)
+                            remaining = 0
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _session_dir(self, upload_id: str) -> str:
+        return os.path.join(self.sessions_dir, upload_id)
+
+    def _part_path(self, upload_id: str, part_number: int) -> str:
+        return os.path.join(self._session_dir(upload_id), f"part_{part_number:06d}")
+
+    def _list_parts(self, upload_id: str) -> List[Dict]:
+        """已完整写入的分片（写入中的分片以 .part 结尾，不计入）"""
+        parts = []
+        for name in os.listdir(self._session_dir(upload_id)):
+            match = self.PART_PATTERN.match(name)
+            if match:
+                size = os.path.getsize(os.path.join(self._session_dir(upload_id), name))
+                parts.append({"part_number": int(match.group(1)), "size": size})
+        return sorted(parts, key=lambda part: part["part_number"])
+
+    def _save_session(self, session: Dict) -> None:
+        session_file = os.path.join(self._session_dir(session["upload_id"]), "session.json")
+        tmp_file = f"{session_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(session, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, session_file)
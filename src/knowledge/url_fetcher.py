@@ -0,0 +1,303 @@
+import os
+import re
+import time
+import sqlite3
+import asyncio
+import threading
+import weakref
+from html import unescape
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from src import config
+from src.utils import logger
+
+
+class ResponseTooLargeError(ValueError):
+    """响应内容超过大小上限"""
+
+
+class _TextExtractor(HTMLParser):
+    """流式提取 HTML 正文，不构建文档树；跳过脚本、样式等不可见内容，块级元素之间换行"""
+
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "head", "iframe", "canvas"}
+    BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article", "header", "footer",
+                  "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr", "dd", "dt", "figcaption"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.title = ""
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """
+    将 HTML 转换为纯文本，保留段落结构
+
+    Args:
+        html: HTML 文本
+
+    Returns:
+        纯文本，段落之间以空行分隔
+    """
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception as e:
+        # 残缺的 HTML 只保留已解析的部分
+        logger.warning(f"Failed to parse HTML completely: {e}")
+
+    lines = [re.sub(r"[ \t\r\f\v\xa0]+", " ", line).strip() for line in "".join(extractor.parts).split("\n")]
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+    title = unescape(extractor.title).strip()
+    return f"{title}\n\n{text}" if title and not text.startswith(title) else text
+
+
+class UrlFetcher:
+    """
+    异步 URL 抓取器
+
+    所有请求共享连接池（按事件循环区分），并限制每个域名的并发数；响应以流式读取，超过大小上限时中止。
+    响应的纯文本与 ETag / Last-Modified 保存在 SQLite 中，再次抓取时发送条件请求，服务端返回 304 时直接使用缓存。
+    缓存总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, db_path: str, max_connections: int = 32, per_host: int = 4,
+                 timeout: float = 30, max_size_mb: int = 512, max_response_mb: int = 20):
+        """
+        Args:
+            db_path: 缓存的 SQLite 文件路径
+            max_connections: 连接池的最大连接数
+            per_host: 每个域名的最大并发请求数
+            timeout: 请求超时（秒）
+            max_size_mb: 缓存文本的总大小上限（MB）
+            max_response_mb: 单个响应的大小上限（MB）
+        """
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_response_size = max_response_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+
+        # {event_loop: (AsyncClient, {host: Semaphore})}
+        self._clients = weakref.WeakKeyDictionary()
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    async def fetch_text(self, url: str) -> str:
+        """
+        抓取 URL 并提取纯文本，缓存仍然有效时不重新下载
+
+        Args:
+            url: URL地址
+
+        Returns:
+            纯文本内容
+
+        Raises:
+            httpx.HTTPError: 请求失败或返回错误状态码
+            ResponseTooLargeError: 响应超过大小上限
+        """
+        cached = await asyncio.to_thread(self._get_cached, url)
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        client, semaphore = self._get_client(url)
+        start = time.time()
+        async with semaphore, client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                self.hits += 1
+                logger.debug(f"URL not modified, using cache: {url}")
+                return cached["text"]
+
+            response.raise_for_status()
+            content = await self._read_limited(url, response)
+        self.misses += 1
+
+        body = content.decode(response.charset_encoding or "utf-8", errors="replace")
+        content_type = response.headers.get("content-type", "")
+        if "html" in content_type or not content_type:
+            text = await asyncio.to_thread(html_to_text, body)
+        else:
+            text = body
+        logger.debug(f"Fetched {url} ({len(content)} bytes) in {time.time() - start:.2f}s")
+
+        etag, last_modified = response.headers.get("etag"), response.headers.get("last-modified")
+        if etag or last_modified:
+            await asyncio.to_thread(self._put_cached, url, etag, last_modified, text)
+        elif cached is not None:
+            # 不再提供校验信息的 URL 无法发送条件请求，删除过期的缓存
+            await asyncio.to_thread(self._delete_cached, url)
+        return text
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池，服务关闭时调用"""
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+    def stats(self) -> Dict:
+        """命中（304）/未命中次数与缓存大小"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size_mb": round(self._total_size / 1024 / 1024, 2),
+        }
+
+    async def _read_limited(self, url: str, response: httpx.Response) -> bytes:
+        """流式读取响应内容，超过 max_response_size 时中止"""
+        declared = response.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > self.max_response_size:
+            raise ResponseTooLargeError(f"{url} is {declared} bytes, exceeds {self.max_response_size} bytes")
+
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_response_size:
+                raise ResponseTooLargeError(f"{url} exceeds {self.max_response_size} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _get_client(self, url: str):
+        """获取当前事件循环的连接池与该域名的信号量"""
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections),
+            )
+            self._clients[loop] = (client, {})
+        client, semaphores = self._clients[loop]
+        host = urlsplit(url).netloc
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self.per_host)
+        return client, semaphores[host]
+
+    def _get_cached(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, text FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+        return {"etag": row[0], "last_modified": row[1], "text": row[2]}
+
+    def _put_cached(self, url: str, etag: Optional[str], last_modified: Optional[str], text: str) -> None:
+        size = len(text.encode("utf-8", errors="replace"))
+        if size > self.max_size:
+            return
+
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, text, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, text, size, time.time())
+            )
+            self._total_size += size - (old[0] if old else 0)
+            self._evict()
+
+    def _delete_cached(self, url: str) -> None:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._total_size -= row[0]
+
+    def _evict(self) -> None:
+        """超过大小上限时按最久未访问的顺序逐条删除缓存，降到上限以内即停止，调用方持有锁"""
+        if self._total_size <= self.max_size:
+            return
+        evicted = []
+        for url, size in self._conn.execute("SELECT url, size FROM responses ORDER BY last_access"):
+            if self._total_size <= self.max_size:
+                break
+            evicted.append((url,))
+            self._total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+
+_url_fetcher: Optional[UrlFetcher] = None
+_url_fetcher_lock = threading.Lock()
+
+
+def get_url_fetcher() -> UrlFetcher:
+    """获取全局共享的 URL 抓取器"""
+    global _url_fetcher
+    if _url_fetcher is None:
+        with _url_fetcher_lock:
+            if _url_fetcher is None:
+                _url_fetcher = UrlFetcher(
+                    os.path.join(config.save_dir, "cache", "url_cache.sqlite"),
+                    max_connections=int(os.getenv("URL_FETCH_MAX_CONNECTIONS", "32")),
+                    per_host=int(os.getenv("URL_FETCH_PER_HOST", "4")),
+                    timeout=float(os.getenv("URL_FETCH_TIMEOUT", "30")),
+                    max_size_mb=int(os.getenv("URL_CACHE_SIZE_MB", "512")),
+                    max_response_mb=int(os.getenv("URL_FETCH_MAX_SIZE_MB", "20")),
+                )
+    return _url_fetcher
+
+
+async def close_url_fetcher() -> None:
+    """关闭全局 URL 抓取器的连接池（未创建时不做任何事）"""
+    if _url_fetcher is not None:
+        await _url_fetcher.aclose()
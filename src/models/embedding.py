@@ -1,112 +1,192 @@
 import os
-import json
-import requests
 import asyncio
 from abc import abstractmethod
 from langchain_huggingface import HuggingFaceEmbeddings
 
 from src import config
 from src.utils import hashstr, logger, get_docker_safe_url
+from src.models.embedding_cache import get_embedding_cache
+from src.models.http_client import PooledHttpClient
 
 
 class BaseEmbeddingModel:
     embed_state = {}
 
-    def __init__(self, model_id):
+    def __init__(self, model_id, info=None):
         self.model_id = model_id
-        self.info = config.embed_model_names[model_id]
+        self.info = info or config.embed_model_names[model_id]
         self.model = self.info["name"]
         self.dimension = self.info.get("dimension", None)
         self.url = get_docker_safe_url(self.info["base_url"])
         self.base_url = get_docker_safe_url(self.info["base_url"])
         self.api_key = os.getenv(self.info["api_key"], self.info["api_key"])
+        self.headers = {"Content-Type": "application/json"}
+
+        # 并发批次数、重试次数与超时，可在模型配置或环境变量中指定
+        self.max_concurrency = int(self.info.get("max_concurrency") or os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+        self.max_retries = int(self.info.get("max_retries") or os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+        self.timeout = float(self.info.get("timeout") or os.getenv("EMBEDDING_TIMEOUT", "60"))
+
+        # 长连接客户端：同步客户端全局复用，异步客户端与信号量按事件循环区分
+        self.http = PooledHttpClient("Embedding", max_concurrency=self.max_concurrency,
+                                     max_retries=self.max_retries, timeout=self.timeout)
 
     @abstractmethod
-    def predict(self, message):
+    def build_payload(self, message):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    @abstractmethod
+    def parse_response(self, response):
         raise NotImplementedError("Subclasses must implement this method")
 
+    def predict(self, message):
+        if isinstance(message, str):
+            message = [message]
+        return self.parse_response(self._post(self.build_payload(message)))
+
+    async def apredict(self, message):
+        if isinstance(message, str):
+            message = [message]
+        return self.parse_response(await self._apost(self.build_payload(message)))
+
+    def _post(self, payload):
+        return self.http.post(self.url, payload, self.headers)
+
+    async def _apost(self, payload):
+        return await self.http.apost(self.url, payload, self.headers)
+
     def encode(self, message):
-        return self.predict(message)
+        texts = [message] if isinstance(message, str) else list(message)
+        return get_embedding_cache().embed(self.model, texts, self.predict)
 
     def encode_queries(self, queries):
-        return self.predict(queries)
+        return self.encode(queries)
 
     async def aencode(self, message):
-        return await asyncio.to_thread(self.encode, message)
+        texts = [message] if isinstance(message, str) else list(message)
+        return await get_embedding_cache().aembed(self.model, texts, self.apredict)
 
     async def aencode_queries(self, queries):
-        return await asyncio.to_thread(self.encode_queries, queries)
+        return await self.aencode(queries)
 
     async def abatch_encode(self, messages, batch_size=20):
-        return await asyncio.to_thread(self.batch_encode, messages, batch_size)
+        logger.info(f"Async batch encoding {len(messages)} messages")
+        return await get_embedding_cache().aembed(
+            self.model, list(messages), lambda texts: self._abatch_predict(texts, batch_size)
+        )
+
+    async def _abatch_predict(self, messages, batch_size=20):
+        """并发发送所有批次（并发数受 max_concurrency 限制），按输入顺序返回"""
+        task_id = self._start_embed_state(messages, batch_size)
+
+        async def predict_batch(i):
+            response = await self.apredict(messages[i:i+batch_size])
+            if task_id:
+                self.embed_state[task_id]['progress'] += len(response)
+            return response
+
+        results = await asyncio.gather(*[predict_batch(i) for i in range(0, len(messages), batch_size)])
+        self._finish_embed_state(task_id, messages)
+        return [vector for batch in results for vector in batch]
 
     def batch_encode(self, messages, batch_size=20):
         logger.info(f"Batch encoding {len(messages)} messages")
-        data = []
+        # 先查缓存，只对未命中的文本分批请求
+        return get_embedding_cache().embed(
+            self.model, list(messages), lambda texts: self._batch_predict(texts, batch_size)
+        )
 
-        if len(messages) > batch_size:
-            task_id = hashstr(messages)
-            self.embed_state[task_id] = {
-                'status': 'in-progress',
-                'total': len(messages),
-                'progress': 0
-            }
+    def _batch_predict(self, messages, batch_size=20):
+        data = []
+        task_id = self._start_embed_state(messages, batch_size)
 
         for i in range(0, len(messages), batch_size):
             group_msg = messages[i:i+batch_size]
             logger.info(f"Encoding {i} to {i+batch_size} with {len(messages)} messages")
-            response = self.encode(group_msg)
+            response = self.predict(group_msg)
             # logger.debug(f"Response: {len(response)=}, {len(group_msg)=}, {len(response[0])=}")
             data.extend(response)
+            if task_id:
+                self.embed_state[task_id]['progress'] += len(response)
+
+        self._finish_embed_state(task_id, messages)
+        return data
+
+    def _start_embed_state(self, messages, batch_size):
+        if len(messages) <= batch_size:
+            return None
+        task_id = hashstr(messages)
+        self.embed_state[task_id] = {
+            'status': 'in-progress',
+            'total': len(messages),
+            'progress': 0
+        }
+        return task_id
 
-        if len(messages) > batch_size:
+    def _finish_embed_state(self, task_id, messages):
+        if task_id:
             self.embed_state[task_id]['progress'] = len(messages)
             self.embed_state[task_id]['status'] = 'completed'
 
-        return data
 
 class OllamaEmbedding(BaseEmbeddingModel):
     """
     Ollama Embedding Model
     """
 
-    def __init__(self, model_id) -> None:
-        super().__init__(model_id)
+    def __init__(self, model_id, info=None) -> None:
+        super().__init__(model_id, info)
         self.url = self.url or get_docker_safe_url("http://localhost:11434/api/embed")
 
-    def predict(self, message: list[str] | str):
-        if isinstance(message, str):
-            message = [message]
-
-        payload = {
+    def build_payload(self, message):
+        return {
             "model": self.model,
             "input": message,
         }
-        response = requests.request("POST", self.url, json=payload)
-        response = json.loads(response.text)
+
+    def parse_response(self, response):
         assert response.get("embeddings"), f"Ollama Embedding failed: {response}"
         return response["embeddings"]
 
 
 class OtherEmbedding(BaseEmbeddingModel):
 
-    def __init__(self, model_id) -> None:
-        super().__init__(model_id)
+    def __init__(self, model_id, info=None) -> None:
+        super().__init__(model_id, info)
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-    def predict(self, message):
-        payload = self.build_payload(message)
-        response = requests.request("POST", self.url, json=payload, headers=self.headers)
-        response = json.loads(response.text)
-        assert response["data"], f"Other Embedding failed: {response}"
-        data = [a["embedding"] for a in response["data"]]
-        return data
-
     def build_payload(self, message):
         return {
             "model": self.model,
             "input": message,
         }
+
+    def parse_response(self, response):
+        assert response["data"], f"Other Embedding failed: {response}"
+        data = [a["embedding"] for a in response["data"]]
+        return data
+
+
+# 按 (模型, 接口地址, api_key) 复用的 OpenAI 兼容 embedding 客户端，向量知识库按数据库的 embed_info 获取
+_embedding_clients = {}
+
+
+def get_embedding_client(model, base_url, api_key):
+    """
+    获取共享的 OpenAI 兼容 embedding 客户端，连接池、并发上限、重试与 embedding 缓存与其他 embedding 模型一致
+
+    Args:
+        model: 模型名称
+        base_url: embeddings 接口地址
+        api_key: API Key
+
+    Returns:
+        OtherEmbedding 实例
+    """
+    key = (model, base_url, api_key)
+    if key not in _embedding_clients:
+        _embedding_clients[key] = OtherEmbedding(model, info={"name": model, "base_url": base_url, "api_key": api_key})
+    return _embedding_clients[key]
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from array import array
+from typing import Callable, Dict, List, Optional
+
+from src import config
+from src.utils import logger
+
+
+class EmbeddingCache:
+    """
+    向量持久化缓存
+
+    以 (模型名, 文本哈希) 为键，将 embedding 结果保存在 SQLite 文件中，所有向量库与图数据库共享。
+    总大小超过上限时按最近访问时间淘汰，并统计命中/未命中次数。
+    """
+
+    def __init__(self, db_path: str, max_size_mb: int = 2048):
+        """
+        Args:
+            db_path: SQLite 文件路径
+            max_size_mb: 缓存向量的总大小上限（MB）
+        """
+        self.db_path = db_path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+        return f"{model}:{text_hash}"
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量读取缓存
+
+        Args:
+            model: 模型名称
+            texts: 文本列表
+
+        Returns:
+            与 texts 一一对应的向量，未命中的位置为 None
+        """
+        keys = [self._key(model, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """批量写入缓存，超过大小上限时淘汰最久未访问的向量"""
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = array('f', [float(v) for v in vector]).tobytes()
+            key = self._key(model, text)
+            rows[key] = (key, model, blob, len(blob), now)
+
+        with self._lock:
+            keys = list(rows)
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                list(rows.values())
+            )
+            self._total_size += sum(row[3] for row in rows.values()) - replaced
+            if self._total_size > self.max_size:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未访问的向量，直到总大小降到上限的 90%，调用方需持有锁"""
+        target = int(self.max_size * 0.9)
+        evicted = 0
+        while self._total_size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._total_size = 0
+                break
+
+            keys = []
+            for key, size in rows:
+                if self._total_size <= target:
+                    break
+                keys.append((key,))
+                self._total_size -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+            evicted += len(keys)
+        logger.info(f"Embedding cache evicted {evicted} vectors, size now {self._total_size / 1024 / 1024:.1f}MB")
+
+    def embed(self, model: str, texts: List[str],
+              embed_func: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        带缓存的同步 embedding，只对未命中的文本调用 embed_func
+
+        Args:
+            model: 模型名称
+            texts: 文本列表
+            embed_func: 实际计算向量的函数
+
+        Returns:
+            与 texts 一一对应的向量
+        """
+        vectors = self.get_many(model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = [[float(x) for x in v] for v in embed_func(missing_texts)]
+            self.put_many(model, missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed(self, model: str, texts: List[str], embed_func) -> List[List[float]]:
+        """带缓存的异步 embedding，embed_func 为返回向量列表的协程函数"""
+        vectors = await asyncio.to_thread(self.get_many, model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = [[float(x) for x in v] for v in await embed_func(missing_texts)]
+            await asyncio.to_thread(self.put_many, model, missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "count": count,
+            "size_mb": round(self._total_size / 1024 / 1024, 2),
+            "max_size_mb": round(self.max_size / 1024 / 1024, 2),
+        }
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取全局共享的 embedding 缓存"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                db_path = os.path.join(config.save_dir, "cache", "embeddings.sqlite")
+                max_size_mb = int(os.getenv("EMBEDDING_CACHE_SIZE_MB", "2048"))
+                _embedding_cache = EmbeddingCache(db_path, max_size_mb=max_size_mb)
+                logger.info(f"Embedding cache at {db_path}, max size {max_size_mb}MB")
+    return _embedding_cache
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import weakref
+from typing import Dict, Optional
+
+import httpx
+
+from src.utils import logger
+
+
+class PooledHttpClient:
+    """
+    模型接口共用的 JSON POST 客户端
+
+    同步客户端全局复用，异步客户端与并发信号量按事件循环区分（httpx.AsyncClient 不能跨事件循环使用）；
+    限流与服务端临时错误按指数退避重试。
+    """
+
+    # 可重试的 HTTP 状态码（限流与服务端临时错误）
+    RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self, name: str, max_concurrency: int = 4, max_retries: int = 3, timeout: float = 60):
+        """
+        Args:
+            name: 接口名称，用于日志
+            max_concurrency: 同时进行的请求数量（同时也是连接池大小）
+            max_retries: 最大重试次数
+            timeout: 请求超时（秒）
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self._client: Optional[httpx.Client] = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def post(self, url: str, payload: Dict, headers: Optional[Dict] = None) -> Dict:
+        """
+        发送同步请求
+
+        Args:
+            url: 接口地址
+            payload: 请求体
+            headers: 请求头
+
+        Returns:
+            响应 JSON
+
+        Raises:
+            httpx.HTTPError: 请求失败且不可重试或重试次数用尽
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._get_client().post(url, json=payload, headers=headers)
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                logger.warning(f"{self.name} request failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                time.sleep(self._backoff(attempt))
+
+    async def apost(self, url: str, payload: Dict, headers: Optional[Dict] = None) -> Dict:
+        """发送异步请求，并发数受 max_concurrency 限制，重试等待期间不占用并发额度"""
+        client, semaphore = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    response = await client.post(url, json=payload, headers=headers)
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                logger.warning(f"{self.name} request failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的异步客户端"""
+        entry = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+    def _get_client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(timeout=self.timeout,
+                                        limits=httpx.Limits(max_connections=self.max_concurrency))
+        return self._client
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            client = httpx.AsyncClient(timeout=self.timeout,
+                                       limits=httpx.Limits(max_connections=self.max_concurrency))
+            self._async_clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return self._async_clients[loop]
+
+    def _should_retry(self, attempt: int, error: Exception) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.RETRY_STATUS_CODES
+        return isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return 0.5 * 2 ** attempt
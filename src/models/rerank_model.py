@@ -1,9 +1,13 @@
 import os
-import json
-import requests
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
 from src import config
+from src.models.http_client import PooledHttpClient
 from src.utils import logger, get_docker_safe_url
 
 def sigmoid(x):
@@ -19,21 +23,54 @@ class OnlineReranker:
             "Content-Type": "application/json"
         }
 
+        # 并发批次数、重试次数与请求超时，可通过参数或环境变量指定
+        self.max_concurrency = int(kwargs.get("max_concurrency") or os.getenv("RERANKER_MAX_CONCURRENCY", "4"))
+        self.max_retries = int(kwargs.get("max_retries") or os.getenv("RERANKER_MAX_RETRIES", "2"))
+        self.timeout = float(kwargs.get("timeout") or os.getenv("RERANKER_TIMEOUT", "30"))
+
+        # 长连接客户端：同步客户端全局复用，异步客户端与信号量按事件循环区分
+        self.http = PooledHttpClient("Reranker", max_concurrency=self.max_concurrency,
+                                     max_retries=self.max_retries, timeout=self.timeout)
+
+        # (query, 文本哈希, max_length) -> 原始分数 的 LRU 缓存
+        self.score_cache_size = int(kwargs.get("score_cache_size") or os.getenv("RERANKER_CACHE_SIZE", "20000"))
+        self._score_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
     def compute_score(self, sentence_pairs, batch_size = 256, max_length = 512, normalize = False):
-        # TODO 还没实现 batch_size
         query, sentences = sentence_pairs[0], sentence_pairs[1]
-        payload = self.build_payload(query, sentences, max_length)
-        response = requests.request("POST", self.url, json=payload, headers=self.headers)
-        response = json.loads(response.text)
-        # logger.debug(f"SiliconFlow Reranker response: {response}")
+        scores, missing = self._get_cached_scores(query, sentences, max_length)
 
-        results = sorted(response["results"], key=lambda x: x["index"])
-        all_scores = [result["relevance_score"] for result in results]
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            response = self._post(self.build_payload(query, [sentences[j] for j in batch], max_length))
+            self._fill_scores(query, sentences, max_length, batch, self.parse_response(response), scores)
 
-        if normalize:
-            all_scores = [sigmoid(score) for score in all_scores]
+        return self._finish_scores(scores, normalize)
+
+    async def acompute_score(self, sentence_pairs, batch_size = 32, max_length = 512, normalize = False):
+        """
+        异步计算相关性分数：未命中缓存的文本按 batch_size 分批并发请求（并发数受 max_concurrency 限制）
+
+        Args:
+            sentence_pairs: (query, 文本列表)
+            batch_size: 每个请求包含的文本数量
+            max_length: 每个文本的最大长度
+            normalize: 是否对分数做 sigmoid 归一化
+
+        Returns:
+            与文本列表一一对应的分数
+        """
+        query, sentences = sentence_pairs[0], sentence_pairs[1]
+        scores, missing = self._get_cached_scores(query, sentences, max_length)
+
+        async def score_batch(batch):
+            response = await self._apost(self.build_payload(query, [sentences[j] for j in batch], max_length))
+            # 每个批次完成后立即写入缓存，整体超时被取消时已完成的批次不会浪费
+            self._fill_scores(query, sentences, max_length, batch, self.parse_response(response), scores)
 
-        return all_scores
+        await asyncio.gather(*[score_batch(missing[i:i + batch_size]) for i in range(0, len(missing), batch_size)])
+        return self._finish_scores(scores, normalize)
 
     def build_payload(self, query, sentences, max_length = 512):
         return {
@@ -43,17 +80,70 @@ class OnlineReranker:
             "max_chunks_per_doc": max_length,
         }
 
+    def parse_response(self, response):
+        assert "results" in response, f"Reranker failed: {response}"
+        results = sorted(response["results"], key=lambda x: x["index"])
+        return [result["relevance_score"] for result in results]
+
+    def _post(self, payload):
+        return self.http.post(self.url, payload, self.headers)
+
+    async def _apost(self, payload):
+        return await self.http.apost(self.url, payload, self.headers)
+
+    @staticmethod
+    def _cache_key(query, sentence, max_length):
+        return (query, hashlib.sha1(sentence.encode('utf-8', errors='replace')).hexdigest(), max_length)
+
+    def _get_cached_scores(self, query, sentences, max_length):
+        """读取缓存，返回 (分数列表, 未命中的下标列表)，未命中的位置为 None"""
+        scores = [None] * len(sentences)
+        with self._cache_lock:
+            for i, sentence in enumerate(sentences):
+                key = self._cache_key(query, sentence, max_length)
+                if key in self._score_cache:
+                    self._score_cache.move_to_end(key)
+                    scores[i] = self._score_cache[key]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if len(missing) < len(sentences):
+            logger.debug(f"Reranker cache hit {len(sentences) - len(missing)}/{len(sentences)}")
+        return scores, missing
+
+    def _fill_scores(self, query, sentences, max_length, batch, batch_scores, scores):
+        """将一个批次的分数写回结果列表与缓存"""
+        assert len(batch_scores) == len(batch), f"Reranker returned {len(batch_scores)} scores for {len(batch)} documents"
+        with self._cache_lock:
+            for j, score in zip(batch, batch_scores):
+                scores[j] = score
+                self._score_cache[self._cache_key(query, sentences[j], max_length)] = score
+            while len(self._score_cache) > self.score_cache_size:
+                self._score_cache.popitem(last=False)
+
+    def _finish_scores(self, scores, normalize):
+        if normalize:
+            scores = [sigmoid(score) for score in scores]
+        return scores
+
+# 按模型复用 reranker，使连接与分数缓存在多次查询间共享
+_rerankers = {}
+
 def get_reranker(model_id, **kwargs):
     support_rerankers = config.reranker_names.keys()
     assert model_id in support_rerankers, f"Unsupported Reranker: {model_id}, only support {support_rerankers}"
 
+    if not kwargs and model_id in _rerankers:
+        return _rerankers[model_id]
+
     model_info = config.reranker_names[model_id]
     base_url = model_info["base_url"]
     api_key = os.getenv(model_info["api_key"], model_info["api_key"])
     assert api_key, f"{model_info['name']} api_key is required"
-    return OnlineReranker(
+    reranker = OnlineReranker(
         model_name=model_info["name"],
         api_key=api_key,
         base_url=base_url,
         **kwargs
     )
+    if not kwargs:
+        _rerankers[model_id] = reranker
+    return reranker
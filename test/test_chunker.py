@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.kb_utils import iter_chunks, split_text_into_chunks
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "data", "A_Dream_of_Red_Mansions.txt")
+
+
+def legacy_split(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
+    """旧版按段落拼接字符串的分块实现，仅用于对比"""
+    chunks = []
+    current_chunk = ""
+    for paragraph in text.split('\n\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
+            chunks.append({"content": current_chunk.strip()})
+            if len(current_chunk) > chunk_overlap:
+                current_chunk = current_chunk[-chunk_overlap:] + "\n\n" + paragraph
+            else:
+                current_chunk = paragraph
+        else:
+            current_chunk = current_chunk + "\n\n" + paragraph if current_chunk else paragraph
+    if current_chunk.strip():
+        chunks.append({"content": current_chunk.strip()})
+    return chunks
+
+
+def benchmark(name: str, func, repeat: int = 3):
+    """运行分块函数，输出最快耗时、峰值内存与分块数（内存单独测量，避免 tracemalloc 影响耗时）"""
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<28} {best * 1000:>9.1f} ms  峰值内存 {peak / 1024 / 1024:>7.1f} MB  分块数 {count}")
+
+
+if __name__ == "__main__":
+    with open(DATA_FILE, encoding="utf-8") as f:
+        text = f.read()
+
+    # 模拟大体积 OCR 输出
+    multiplier = int(os.getenv("CHUNKER_TEXT_MULTIPLIER", "4"))
+    text = "\n\n".join([text] * multiplier)
+    print(f"文本长度: {len(text)} 字符\n")
+
+    benchmark("legacy split", lambda: len(legacy_split(text)))
+    benchmark("split_text_into_chunks", lambda: len(split_text_into_chunks(text, "file_test", "test.txt")))
+    benchmark("iter_chunks (streaming)", lambda: sum(1 for _ in iter_chunks(text, "file_test", "test.txt")))
+    benchmark("iter_chunks (token)", lambda: sum(1 for _ in iter_chunks(text, "file_test", "test.txt",
+                                                                        chunk_size=512, chunk_overlap=64,
+                                                                        chunk_unit="token")), repeat=1)
+
+    # 校验偏移量与分块内容一致
+    for chunk in iter_chunks(text, "file_test", "test.txt"):
+        assert text[chunk["start"]:chunk["end"]] == chunk["content"]
+    print("\n偏移量校验通过")
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.doc_chunk_index import DocChunkIndex
+
+# 验证文档到分块索引的按序分页，以及全量重建标记在重新打开后仍有效
+
+
+def test_paging():
+    index = DocChunkIndex(os.path.join(tempfile.mkdtemp(), "doc_chunk_index.db"))
+    index.set_docs({"doc_a": [("a2", 2), ("a0", 0), ("a1", 1)], "doc_b": [("b0", 0)]})
+    assert index.count("doc_a") == 3 and index.count("missing") == 0
+    assert index.get_chunk_ids("doc_a") == ["a0", "a1", "a2"]
+    assert index.get_chunk_ids("doc_a", offset=1, limit=1) == ["a1"]
+
+    index.set_doc("doc_a", [("a0", 0)])
+    index.remove_doc("doc_b")
+    assert index.get_chunk_ids("doc_a") == ["a0"] and index.count("doc_b") == 0
+    print("按序分页通过")
+
+
+def test_rebuilt_marker_persisted():
+    db_path = os.path.join(tempfile.mkdtemp(), "doc_chunk_index.db")
+    index = DocChunkIndex(db_path)
+    assert not index.rebuilt
+    index.set_rebuilt(True)
+    index.close()
+
+    reopened = DocChunkIndex(db_path)
+    assert reopened.rebuilt
+    reopened.set_rebuilt(False)
+    reopened.close()
+    assert not DocChunkIndex(db_path).rebuilt
+    print("重建标记持久化通过")
+
+
+if __name__ == "__main__":
+    test_paging()
+    test_rebuilt_marker_persisted()
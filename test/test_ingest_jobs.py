@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.ingest_jobs import IngestionJobManager
+from src.knowledge.metadata_store import MetadataStore
+
+# 用假的知识库管理器驱动 IngestionJobManager，验证任务持久化、中断后恢复与过期清理
+
+
+class FakeManager:
+    """按 IngestionPipeline 的方式上报进度；hang=True 时模拟处理到一半服务中断"""
+
+    def __init__(self, hang: bool = False):
+        self.hang = hang
+        self.calls = []
+        self.deleted = []
+
+    async def add_content(self, db_id, items, params=None, progress_callback=None):
+        self.calls.append(list(items))
+        for index, item in enumerate(items):
+            # updated.txt 是已入库文件的新版本，复用已有的 file_id
+            progress_callback(index, {"stage": "waiting", "file_id": f"file_{item}",
+                                      "created_new": item != "updated.txt"})
+            if not self.hang or item == "a.txt":
+                progress_callback(index, {"stage": "done", "status": "done", "chunks": 1})
+        if self.hang:
+            await asyncio.Event().wait()
+        return []
+
+    async def delete_file(self, db_id, file_id):
+        self.deleted.append(file_id)
+
+
+def test_resume_interrupted_job():
+    """重启后只重新处理未完成的文件，只删除本任务新建的记录"""
+    work_dir = tempfile.mkdtemp()
+    db_path = os.path.join(work_dir, "global_metadata.db")
+    items = ["a.txt", "b.txt", "updated.txt"]
+
+    async def interrupted():
+        manager = IngestionJobManager(FakeManager(hang=True), MetadataStore(db_path))
+        job = manager.submit("kb_test", items)
+        await asyncio.sleep(0.05)
+        return job["job_id"]
+
+    job_id = asyncio.run(interrupted())
+
+    fake = FakeManager()
+
+    async def resumed():
+        manager = IngestionJobManager(fake, MetadataStore(db_path))
+        assert manager.get_job(job_id)["status"] == "running"
+        manager.start()
+        await manager._queue.join()
+        return manager.get_job(job_id)
+
+    job = asyncio.run(resumed())
+    assert fake.calls == [["b.txt", "updated.txt"]], fake.calls
+    assert fake.deleted == ["file_b.txt"], fake.deleted
+    assert job["status"] == "done"
+    assert job["progress"]["completed"] == 3
+
+    # 进度已按行落盘，重新加载后与内存中一致
+    reloaded = IngestionJobManager(FakeManager(), MetadataStore(db_path)).get_job(job_id)
+    assert [f["status"] for f in reloaded["files"]] == ["done", "done", "done"]
+    print("中断任务恢复通过")
+
+
+def test_expired_jobs_pruned():
+    """超过保留期限的已结束任务在启动时清理"""
+    work_dir = tempfile.mkdtemp()
+    store = MetadataStore(os.path.join(work_dir, "global_metadata.db"))
+    old_job = {"job_id": "job_old", "db_id": "kb_test", "params": {}, "status": "done",
+               "created_at": time.time() - 10 * 86400, "started_at": None,
+               "finished_at": time.time() - 10 * 86400, "error": None, "files": []}
+    store.save_job(old_job, with_files=True)
+
+    async def run():
+        manager = IngestionJobManager(FakeManager(), store, retention_days=7)
+        manager.start()
+        recent = manager.submit("kb_test", ["a.txt"])
+        await manager._queue.join()
+        return manager, recent["job_id"]
+
+    manager, recent_id = asyncio.run(run())
+    assert manager.get_job("job_old") is None
+    assert manager.get_job(recent_id)["status"] == "done"
+    assert set(store.load_jobs()) == {recent_id}
+    print("过期任务清理通过")
+
+
+if __name__ == "__main__":
+    test_resume_interrupted_job()
+    test_expired_jobs_pruned()
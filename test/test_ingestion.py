@@ -0,0 +1,138 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.knowledge_base import KnowledgeBase
+from src.knowledge.ingestion import IngestionPipeline
+from src.knowledge.kb_utils import split_text_into_chunks
+
+# 用内存字典代替向量库的知识库，验证入库流水线的去重与增量更新，无需启动 Milvus/Chroma
+
+
+class MemoryKB(KnowledgeBase):
+    kb_type = "memory"
+
+    def __init__(self, work_dir: str, **kwargs):
+        super().__init__(work_dir, **kwargs)
+        self.store = {}
+        self.embedded = []
+
+    async def _create_kb_instance(self, db_id, config):
+        pass
+
+    async def _initialize_kb_instance(self, instance):
+        pass
+
+    async def add_content(self, db_id, items, params=None, progress_callback=None):
+        return await IngestionPipeline(self, db_id, params, progress_callback).run(items)
+
+    def _ingest_chunk(self, db_id, file_meta, content, params=None):
+        return split_text_into_chunks(content, file_meta["file_id"], file_meta["filename"], 20, 0)
+
+    async def _ingest_embed(self, db_id, chunks):
+        # 让出事件循环，使并发入库的文件交错执行
+        await asyncio.sleep(0.01)
+        self.embedded.extend(chunk["content"] for chunk in chunks)
+        return [[0.0]] * len(chunks)
+
+    async def _ingest_insert(self, db_id, file_meta, content, chunks, embeddings):
+        for chunk in chunks:
+            self.store[chunk["id"]] = (chunk["file_id"], chunk["chunk_index"])
+
+    async def _get_file_chunk_index(self, db_id, file_id):
+        return {chunk_id: index for chunk_id, (owner, index) in self.store.items() if owner == file_id}
+
+    async def _ingest_remove(self, db_id, file_id, chunk_ids):
+        for chunk_id in list(self.store):
+            if self.store[chunk_id][0] == file_id and (chunk_ids is None or chunk_id in chunk_ids):
+                del self.store[chunk_id]
+
+    async def _ingest_update_chunks(self, db_id, chunks):
+        for chunk in chunks:
+            self.store[chunk["id"]] = (chunk["file_id"], chunk["chunk_index"])
+
+    async def aquery(self, query_text, db_id, **kwargs):
+        return ""
+
+    async def delete_file(self, db_id, file_id):
+        await self._ingest_remove(db_id, file_id, None)
+        self._remove_file_meta(file_id)
+
+    async def get_file_info(self, db_id, file_id):
+        return {}
+
+
+def write_file(path: str, text: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_concurrent_duplicates_ingested_once():
+    """内容相同的文件并发入库时只处理一次，其余标记为跳过"""
+    work_dir = tempfile.mkdtemp()
+    kb = MemoryKB(work_dir)
+    db_id = kb.create_database("dedup", "")["db_id"]
+    text = "alpha paragraph\n\nbeta paragraph"
+    files = [write_file(os.path.join(work_dir, f"copy_{i}.txt"), text) for i in range(3)]
+
+    async def run():
+        # 两个独立的入库任务同时提交相同内容
+        return await asyncio.gather(kb.add_content(db_id, files[:2]), kb.add_content(db_id, files[2:]))
+
+    results = [record for batch in asyncio.run(run()) for record in batch]
+    processed = [record for record in results if not record.get("skipped")]
+    assert len(processed) == 1, results
+    assert len(kb.embedded) == processed[0]["chunk_count"], kb.embedded
+    assert len(kb.files_meta) == 1
+    print("并发重复文件去重通过")
+
+
+def test_changed_file_updates_changed_chunks():
+    """同一路径的文件修改后复用 file_id，只向量化新增的分块"""
+    work_dir = tempfile.mkdtemp()
+    kb = MemoryKB(work_dir)
+    db_id = kb.create_database("update", "")["db_id"]
+    path = write_file(os.path.join(work_dir, "doc.txt"), "alpha paragraph\n\nbeta paragraph")
+
+    first = asyncio.run(kb.add_content(db_id, [path]))[0]
+    kb.embedded.clear()
+    write_file(path, "alpha paragraph\n\ngamma paragraph")
+    second = asyncio.run(kb.add_content(db_id, [path]))[0]
+
+    assert second["file_id"] == first["file_id"]
+    assert kb.embedded == ["gamma paragraph"], kb.embedded
+    assert len(kb.store) == second["chunk_count"]
+    print("增量更新通过")
+
+
+def test_interrupted_update_rerun():
+    """更新过程中服务中断，重启后再次入库时继续更新原文件而不是当作重复内容跳过"""
+    work_dir = tempfile.mkdtemp()
+    kb = MemoryKB(work_dir)
+    db_id = kb.create_database("resume", "")["db_id"]
+    path = write_file(os.path.join(work_dir, "doc.txt"), "alpha paragraph\n\nbeta paragraph")
+    file_id = asyncio.run(kb.add_content(db_id, [path]))[0]["file_id"]
+
+    # 模拟新版本写入一半时中断：记录停留在 processing 状态
+    write_file(path, "alpha paragraph\n\ngamma paragraph")
+    kb.files_meta[file_id]["status"] = "processing"
+    kb._save_file_meta(file_id)
+
+    restarted = MemoryKB(work_dir)
+    restarted.store = kb.store
+    assert restarted.files_meta[file_id]["status"] == "failed"
+    result = asyncio.run(restarted.add_content(db_id, [path]))[0]
+    assert result["file_id"] == file_id and not result.get("skipped")
+    assert result["status"] == "done"
+    assert restarted.embedded == ["gamma paragraph"], restarted.embedded
+    print("中断更新恢复通过")
+
+
+if __name__ == "__main__":
+    test_concurrent_duplicates_ingested_once()
+    test_changed_file_updates_changed_chunks()
+    test_interrupted_update_rerun()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.instance_pool import InstancePool
+
+# 验证实例池的 LRU 淘汰、跳过正在使用的实例、空闲淘汰，以及释放完成前不重新创建同一数据库的实例
+
+
+class Recorder:
+    """记录创建与释放顺序的工厂，释放需要一定时间"""
+
+    def __init__(self, release_delay: float = 0.0):
+        self.release_delay = release_delay
+        self.events = []
+
+    def factory(self, key: str):
+        async def create():
+            self.events.append(("create", key))
+            await asyncio.sleep(0.01)
+            return f"instance {key}"
+        return create
+
+    async def release(self, key: str, instance):
+        self.events.append(("release start", key))
+        await asyncio.sleep(self.release_delay)
+        self.events.append(("release end", key))
+
+
+def test_lru_overflow_skips_busy():
+    """超过容量时淘汰最久未使用且未在使用的实例"""
+    recorder = Recorder()
+    busy = {"a"}
+    pool = InstancePool("test", max_size=2, idle_timeout=0, release=recorder.release, is_busy=lambda key: key in busy)
+
+    async def run():
+        for key in ("a", "b", "c"):
+            await pool.get_or_create(key, recorder.factory(key))
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert set(pool.keys()) == {"a", "c"}, list(pool.keys())
+    assert ("release start", "b") in recorder.events
+    assert pool.stats()["evictions"] == 1
+    print("LRU 淘汰跳过使用中实例通过")
+
+
+def test_evict_idle():
+    pool = InstancePool("test", max_size=4, idle_timeout=10)
+    pool["a"] = "instance a"
+    pool["b"] = "instance b"
+    pool._last_used["a"] = time.time() - 60
+    assert pool.evict_idle() == 1
+    assert list(pool.keys()) == ["b"]
+    print("空闲淘汰通过")
+
+
+def test_concurrent_create_once():
+    """同一数据库的并发创建只执行一次"""
+    recorder = Recorder()
+    pool = InstancePool("test", max_size=4, idle_timeout=0)
+
+    async def run():
+        return await asyncio.gather(*[pool.get_or_create("a", recorder.factory("a")) for _ in range(5)])
+
+    instances = asyncio.run(run())
+    assert instances == ["instance a"] * 5
+    assert recorder.events == [("create", "a")] and pool.loads == 1
+    print("并发创建一次通过")
+
+
+def test_recreate_waits_for_release():
+    """被淘汰的实例释放完成后才重新创建"""
+    recorder = Recorder(release_delay=0.05)
+    pool = InstancePool("test", max_size=1, idle_timeout=0, release=recorder.release)
+
+    async def run():
+        await pool.get_or_create("a", recorder.factory("a"))
+        await pool.get_or_create("b", recorder.factory("b"))  # 淘汰 a
+        await asyncio.sleep(0)
+        await pool.get_or_create("a", recorder.factory("a"))  # 淘汰 b，并等待 a 释放完成
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    events = recorder.events
+    recreated = max(i for i, event in enumerate(events) if event == ("create", "a"))
+    assert events.index(("release end", "a")) < recreated, events
+    assert pool.stats()["releasing"] == 0
+    print("释放完成后重新创建通过")
+
+
+if __name__ == "__main__":
+    test_lru_overflow_skips_busy()
+    test_evict_idle()
+    test_concurrent_create_once()
+    test_recreate_waits_for_release()
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from src.knowledge.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from test_ingestion import MemoryKB
+
+# 验证 BM25 倒排索引、倒数排名融合，以及已有数据库的倒排索引后台补建与持久化的补建标记
+
+
+class StoredKB(MemoryKB):
+    """在内存知识库的基础上提供底层存储中的已有分块，用于补建倒排索引"""
+
+    def __init__(self, work_dir: str, chunks, **kwargs):
+        super().__init__(work_dir, **kwargs)
+        self.chunks = chunks
+        self.reads = 0
+
+    async def _iter_stored_chunks(self, db_id):
+        self.reads += 1
+        for i in range(0, len(self.chunks), 2):
+            await asyncio.sleep(0.01)
+            yield self.chunks[i:i + 2]
+
+
+def test_tokenize():
+    assert tokenize("GPT-4o 模型") == ["gpt-4o", "模型"]
+    assert tokenize("知识库检索") == ["知识", "识库", "库检", "检索"]
+    print("分词通过")
+
+
+def test_search_and_remove():
+    index = LexicalIndex(os.path.join(tempfile.mkdtemp(), "lexical_index.db"))
+    index.add([
+        {"id": "c1", "file_id": "f1", "content": "milvus vector database"},
+        {"id": "c2", "file_id": "f1", "content": "chroma is a lightweight database"},
+        {"id": "c3", "file_id": "f2", "content": "bm25 keyword search with milvus milvus"},
+    ])
+    assert index.num_docs == 3
+    assert [chunk_id for chunk_id, _ in index.search("milvus")] == ["c3", "c1"]
+    assert index.search("unknown") == []
+
+    # 覆盖已存在的分块
+    index.add([{"id": "c3", "file_id": "f2", "content": "keyword search"}])
+    assert [chunk_id for chunk_id, _ in index.search("milvus")] == ["c1"]
+
+    index.remove("f1")
+    assert index.num_docs == 1 and index.search("database") == []
+    index.remove("f2", ["c3"])
+    assert index.num_docs == 0
+    print("BM25 检索与删除通过")
+
+
+def test_incremental_stats():
+    """写入、覆盖与删除后增量维护的统计与重新打开时的全量统计一致"""
+    db_path = os.path.join(tempfile.mkdtemp(), "lexical_index.db")
+    index = LexicalIndex(db_path)
+    index.add([{"id": f"c{i}", "file_id": f"f{i % 2}", "content": "word " * (i + 1)} for i in range(6)])
+    index.add([{"id": "c0", "file_id": "f0", "content": "longer text " * 5},
+               {"id": "c9", "file_id": "f1", "content": "new"}])
+    index.remove("f0")
+    index.remove(chunk_ids=["c1", "missing"])
+
+    reopened = LexicalIndex(db_path)
+    assert (index.num_docs, index._total_length) == (reopened.num_docs, reopened._total_length) == (3, 11)
+    print("增量统计通过")
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [item_id for item_id, _ in fused] == ["a", "c", "b"]
+    assert abs(fused[0][1] - (1 / 61 + 1 / 62)) < 1e-9
+    print("RRF 通过")
+
+
+def test_backfill_in_background():
+    """已有分块的数据库首次检索时后台补建，补建完成前返回 None，完成后的标记在重新打开后仍有效"""
+    work_dir = tempfile.mkdtemp()
+    chunks = [{"id": f"c{i}", "file_id": "f1", "content": f"chunk {i} keyword"} for i in range(5)]
+    kb = StoredKB(work_dir, chunks)
+    db_id = kb.create_database("lexical", "")["db_id"]
+    kb.files_meta["f1"] = {"database_id": db_id, "filename": "a.txt", "status": "done", "chunk_count": 5}
+    kb._save_file_meta("f1")
+
+    # 补建前入库流程已写入的分块不影响补建
+    kb.get_lexical_index(db_id).add(chunks[:1])
+
+    async def run():
+        first, second = await asyncio.gather(kb._ensure_lexical_index(db_id), kb._ensure_lexical_index(db_id))
+        assert first is None and second is None
+        await kb._lexical_backfills[db_id]
+        return await kb._ensure_lexical_index(db_id)
+
+    index = asyncio.run(run())
+    assert index is not None and index.num_docs == 5 and kb.reads == 1
+
+    reopened = StoredKB(work_dir, chunks)
+    assert asyncio.run(reopened._ensure_lexical_index(db_id)) is not None and reopened.reads == 0
+    print("倒排索引后台补建通过")
+
+
+def test_empty_database_skips_backfill():
+    kb = StoredKB(tempfile.mkdtemp(), [])
+    db_id = kb.create_database("empty", "")["db_id"]
+    assert asyncio.run(kb._ensure_lexical_index(db_id)) is not None
+    assert kb.get_lexical_index(db_id).backfilled and kb.reads == 0
+    print("空数据库跳过补建通过")
+
+
+def test_fusion_mode_defaults_to_vector():
+    """默认只用向量检索，hybrid 可按数据库开启"""
+    kb = MemoryKB(tempfile.mkdtemp())
+    default_db = kb.create_database("default", "")["db_id"]
+    hybrid_db = kb.create_database("hybrid", "", fusion_mode="hybrid")["db_id"]
+    assert kb.get_fusion_mode(default_db) == "vector"
+    assert kb.get_fusion_mode(hybrid_db) == "hybrid"
+    print("融合模式默认值通过")
+
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_search_and_remove()
+    test_incremental_stats()
+    test_reciprocal_rank_fusion()
+    test_backfill_in_background()
+    test_empty_database_skips_backfill()
+    test_fusion_mode_defaults_to_vector()
@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.metadata_store import MetadataStore
+
+# 验证旧版 JSON 元数据导入 SQLite 以及按行更新、删除
+
+
+def write_legacy_json(path: str) -> None:
+    data = {
+        "databases": {
+            "kb_a": {"name": "A", "description": "first", "kb_type": "milvus", "created_at": "2025-01-01T00:00:00"},
+            "kb_b": {"name": "B", "description": "second", "kb_type": "milvus", "created_at": "2025-01-02T00:00:00"},
+        },
+        # 旧版 Milvus 的文件记录中不含 file_id
+        "files": {
+            "file_1": {"database_id": "kb_a", "filename": "a.txt", "path": "/data/a.txt", "status": "done",
+                       "created_at": 1.0},
+            "file_2": {"database_id": "kb_b", "filename": "b.txt", "path": "/data/b.txt", "status": "failed",
+                       "created_at": 2.0},
+        },
+        "updated_at": "2025-01-02T00:00:00",
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def test_import_legacy_json():
+    """首次启动导入旧版 JSON，之后不再重复导入"""
+    work_dir = tempfile.mkdtemp()
+    json_file = os.path.join(work_dir, "metadata_milvus.json")
+    write_legacy_json(json_file)
+
+    store = MetadataStore(os.path.join(work_dir, "metadata_milvus.db"))
+    assert store.import_json(json_file)
+    assert not os.path.exists(json_file) and os.path.exists(f"{json_file}.imported")
+    assert not store.import_json(json_file)
+
+    databases, files = store.load_databases(), store.load_files()
+    assert set(databases) == {"kb_a", "kb_b"} and databases["kb_a"]["name"] == "A"
+    assert files["file_1"]["file_id"] == "file_1" and files["file_2"]["status"] == "failed"
+
+    # 重新打开后数据仍在
+    reopened = MetadataStore(os.path.join(work_dir, "metadata_milvus.db"))
+    assert reopened.load_files() == files
+    print("旧版 JSON 导入通过")
+
+
+def test_row_updates():
+    """单行更新与删除数据库时级联删除文件记录"""
+    work_dir = tempfile.mkdtemp()
+    json_file = os.path.join(work_dir, "metadata_milvus.json")
+    write_legacy_json(json_file)
+    store = MetadataStore(os.path.join(work_dir, "metadata_milvus.db"))
+    store.import_json(json_file)
+
+    file_meta = store.load_files()["file_1"]
+    file_meta["status"] = "processing"
+    store.save_file("file_1", file_meta)
+    store.save_file("file_3", {"database_id": "kb_a", "filename": "c.txt", "status": "done", "created_at": 3.0})
+    files = store.load_files()
+    assert files["file_1"]["status"] == "processing" and "file_3" in files
+
+    store.delete_file("file_3")
+    store.delete_database("kb_a")
+    assert set(store.load_databases()) == {"kb_b"}
+    assert set(store.load_files()) == {"file_2"}
+    print("按行更新通过")
+
+
+def test_import_global_metadata_without_files():
+    """全局元数据只导入数据库记录"""
+    work_dir = tempfile.mkdtemp()
+    json_file = os.path.join(work_dir, "global_metadata.json")
+    write_legacy_json(json_file)
+    store = MetadataStore(os.path.join(work_dir, "global_metadata.db"))
+    store.import_json(json_file, file_key=None)
+    assert set(store.load_databases()) == {"kb_a", "kb_b"}
+    assert store.load_files() == {}
+    print("全局元数据导入通过")
+
+
+if __name__ == "__main__":
+    test_import_legacy_json()
+    test_row_updates()
+    test_import_global_metadata_without_files()
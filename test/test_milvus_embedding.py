@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.milvus_kb import MilvusKB
+from src.models.embedding import get_embedding_client
+
+# 用 httpx.MockTransport 替代 embedding 接口，驱动真实的 MilvusKB._aembed_texts，
+# 验证批次并发上限、限流重试、结果顺序与 embedding 缓存，无需启动 Milvus 与 embedding 服务
+
+URL = "http://embedding.test/v1/embeddings"
+API_KEY = "test-key"
+LATENCY = float(os.getenv("EMBEDDING_LATENCY", "0.02"))
+
+
+def make_kb(model: str, batch_size: int) -> MilvusKB:
+    """只初始化 _aembed_texts 用到的属性，不连接 Milvus"""
+    kb = MilvusKB.__new__(MilvusKB)
+    kb.databases_meta = {"kb_test": {"embed_info": {"name": model, "base_url": URL, "api_key": API_KEY}}}
+    kb.embed_batch_size = batch_size
+    return kb
+
+
+class FakeEmbeddingService:
+    """按文本长度生成向量；第一个请求返回 429，记录请求数与峰值并发"""
+
+    def __init__(self):
+        self.requests = 0
+        self.inflight = 0
+        self.peak = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests == 1:
+            return httpx.Response(429, json={"error": "rate limited"})
+
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        await asyncio.sleep(LATENCY)
+        self.inflight -= 1
+
+        texts = json.loads(request.content)["input"]
+        return httpx.Response(200, json={"data": [{"embedding": [float(len(text)), 1.0]} for text in texts]})
+
+
+def test_aembed_texts():
+    model = f"test-embedding-{uuid.uuid4().hex[:8]}"
+    kb = make_kb(model, batch_size=4)
+    service = FakeEmbeddingService()
+    texts = [f"text {'x' * i}" for i in range(40)]
+
+    async def run():
+        # 在当前事件循环中注入 mock 客户端，并发上限为 3
+        http = get_embedding_client(model, URL, API_KEY).http
+        http._async_clients[asyncio.get_running_loop()] = (
+            httpx.AsyncClient(transport=httpx.MockTransport(service)), asyncio.Semaphore(3))
+
+        start = time.perf_counter()
+        vectors = await kb._aembed_texts("kb_test", texts)
+        elapsed = time.perf_counter() - start
+
+        requests = service.requests
+        cached = await kb._aembed_texts("kb_test", texts[:10])
+        return vectors, cached, requests, elapsed
+
+    vectors, cached, requests, elapsed = asyncio.run(run())
+
+    assert [vector[0] for vector in vectors] == [float(len(text)) for text in texts]
+    assert requests == 10 + 1, requests  # 10 个批次，外加一次被限流后的重试
+    assert service.peak <= 3, service.peak
+    assert cached == vectors[:10] and service.requests == requests
+    print(f"{len(texts)} 个文本 {requests} 个请求，峰值并发 {service.peak}，耗时 {elapsed:.3f}s，缓存命中通过")
+
+
+if __name__ == "__main__":
+    test_aembed_texts()
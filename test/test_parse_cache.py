@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.parse_cache import ParseCache
+
+# 验证解析结果缓存的命中、按参数区分，以及超过上限时只淘汰最久未访问的记录
+
+
+def make_cache(**kwargs) -> ParseCache:
+    return ParseCache(os.path.join(tempfile.mkdtemp(), "parsed.sqlite"), **kwargs)
+
+
+def test_get_put():
+    cache = make_cache()
+    assert cache.get("hash", "pdf") is None
+    cache.put("hash", "pdf", {"ocr": False}, "text")
+    assert cache.get("hash", "pdf", {"ocr": False}) == "text"
+    assert cache.get("hash", "pdf", {"ocr": True}) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+    print("读写缓存通过")
+
+
+def test_evict_least_recently_used():
+    """超过上限时逐条淘汰最久未访问的记录，降到上限以内即停止"""
+    cache = make_cache()
+    cache.max_size = 30
+    for i in range(3):
+        cache.put(f"hash {i}", "pdf", None, "x" * 10)
+        time.sleep(0.001)
+    cache.get("hash 0", "pdf")
+    cache.put("hash 3", "pdf", None, "x" * 10)
+
+    assert cache.get("hash 1", "pdf") is None
+    assert all(cache.get(f"hash {i}", "pdf") is not None for i in (0, 2, 3))
+    assert cache._total_size == 30
+
+    # 重新打开后按实际记录计算大小
+    reopened = ParseCache(cache.db_path)
+    assert reopened._total_size == 30
+    print("缓存淘汰通过")
+
+
+if __name__ == "__main__":
+    test_get_put()
+    test_evict_least_recently_used()
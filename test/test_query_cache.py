@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.kb_manager import KnowledgeBaseManager
+from src.knowledge.query_cache import QueryCache
+
+# 验证检索结果缓存的 LRU / TTL、按数据库失效，以及检索期间失效时不写入过期结果
+
+
+def test_lru_and_ttl():
+    cache = QueryCache(max_size=2, ttl=0.2)
+    key_a = cache.make_key("kb_a", "  hello   world ")
+    assert key_a == cache.make_key("kb_a", "hello world")
+
+    cache.put(key_a, "A")
+    cache.put(cache.make_key("kb_a", "b"), "B")
+    cache.get(key_a)
+    cache.put(cache.make_key("kb_a", "c"), "C")  # 淘汰最久未访问的 b
+    assert cache.get(key_a) == "A"
+    assert cache.get(cache.make_key("kb_a", "b")) is None
+
+    time.sleep(0.25)
+    assert cache.get(key_a) is None
+    print("LRU / TTL 通过")
+
+
+def test_invalidate_by_database():
+    cache = QueryCache()
+    key_a, key_b = cache.make_key("kb_a", "q"), cache.make_key("kb_b", "q")
+    cache.put(key_a, "A")
+    cache.put(key_b, "B")
+
+    cache.invalidate("kb_a")
+    assert cache.get(key_a) is None and cache.get(key_b) == "B"
+    assert cache.stats()["invalidations"] == 1
+    print("按数据库失效通过")
+
+
+def test_stale_put_skipped():
+    """检索开始后数据库失效，检索结果不写入缓存"""
+    cache = QueryCache()
+    key = cache.make_key("kb_a", "q")
+    generation = cache.generation("kb_a")
+    cache.invalidate("kb_a")
+    cache.put(key, "stale", generation=generation)
+    assert cache.get(key) is None
+
+    cache.put(key, "fresh", generation=cache.generation("kb_a"))
+    assert cache.get(key) == "fresh"
+    print("过期结果不写入通过")
+
+
+def test_manager_skips_results_fetched_across_invalidation():
+    """检索进行中入库完成（缓存失效），这次检索的结果不缓存，下一次检索重新执行"""
+    manager = KnowledgeBaseManager(tempfile.mkdtemp())
+    calls = []
+
+    async def fetch(queries):
+        calls.append(list(queries))
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            manager.query_cache.invalidate("kb_a")
+        return [f"result {len(calls)}" for _ in queries]
+
+    async def run():
+        first = await manager._cached_batch("kb_a", ["q"], {}, fetch, True)
+        second = await manager._cached_batch("kb_a", ["q"], {}, fetch, True)
+        third = await manager._cached_batch("kb_a", ["q"], {}, fetch, True)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == ["result 1"] and second == ["result 2"] and third == ["result 2"]
+    assert len(calls) == 2
+    print("检索期间失效不缓存通过")
+
+
+if __name__ == "__main__":
+    test_lru_and_ttl()
+    test_invalidate_by_database()
+    test_stale_put_skipped()
+    test_manager_skips_results_fetched_across_invalidation()
@@ -0,0 +1,62 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from server.routers import knowledge_router
+from test_ingestion import MemoryKB
+
+# 直接调用上传接口的处理函数，验证上传后的文件在入库时的行为，无需启动服务
+
+
+def upload(filename: str, data: bytes, db_id: str) -> dict:
+    file = SimpleNamespace(filename=filename, size=len(data), file=io.BytesIO(data))
+    return asyncio.run(knowledge_router.upload_file(file=file, db_id=db_id, current_user=None))
+
+
+def test_reupload_updates_existing_file():
+    """同名文件修改后重新上传，保存到新路径（旧文件不被替换），入库时更新原文件而不是新增一个文件"""
+    work_dir = tempfile.mkdtemp()
+    kb = MemoryKB(work_dir)
+    db_id = kb.create_database("upload", "")["db_id"]
+    knowledge_router.knowledge_base = kb
+
+    first_upload = upload("Report.txt", "alpha paragraph\n\nbeta paragraph".encode("utf-8"), db_id)
+    first = asyncio.run(kb.add_content(db_id, [first_upload["file_path"]]))[0]
+    kb.embedded.clear()
+
+    second_upload = upload("Report.txt", "alpha paragraph\n\ngamma paragraph".encode("utf-8"), db_id)
+    assert second_upload["file_path"] != first_upload["file_path"]
+    assert os.path.basename(second_upload["file_path"]) == "Report.txt"
+    with open(first_upload["file_path"], encoding="utf-8") as f:
+        assert f.read() == "alpha paragraph\n\nbeta paragraph"
+    second = asyncio.run(kb.add_content(db_id, [second_upload["file_path"]]))[0]
+
+    assert second["file_id"] == first["file_id"] and not second.get("skipped")
+    assert kb.files_meta[first["file_id"]]["path"] == second_upload["file_path"]
+    assert kb.embedded == ["gamma paragraph"], kb.embedded
+    assert len(kb.files_meta) == 1
+    print("重新上传更新通过")
+
+
+def test_names_differing_in_case_are_separate_files():
+    work_dir = tempfile.mkdtemp()
+    kb = MemoryKB(work_dir)
+    db_id = kb.create_database("upload", "")["db_id"]
+    knowledge_router.knowledge_base = kb
+
+    upper = upload("Report.txt", b"upper case", db_id)
+    lower = upload("report.txt", b"lower case", db_id)
+    results = asyncio.run(kb.add_content(db_id, [upper["file_path"], lower["file_path"]]))
+    assert results[0]["file_id"] != results[1]["file_id"] and len(kb.files_meta) == 2
+    print("大小写不同的文件名互不影响通过")
+
+
+if __name__ == "__main__":
+    test_reupload_updates_existing_file()
+    test_names_differing_in_case_are_separate_files()
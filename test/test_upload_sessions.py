@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.kb_utils import UploadTooLargeError
+from src.knowledge.upload_sessions import UploadSessionManager
+
+# 验证分片上传：乱序与重复上传分片、查询进度、合并校验、大小上限与取消
+
+
+def make_session(total_size=None):
+    work_dir = tempfile.mkdtemp()
+    manager = UploadSessionManager(work_dir)
+    file_path = os.path.join(work_dir, "kb_test", "report.txt")
+    session = manager.initiate("report.txt", file_path, total_size=total_size, db_id="kb_test")
+    return manager, session["upload_id"], file_path
+
+
+def test_assemble_out_of_order():
+    """分片乱序、重复上传，合并后的内容与哈希正确，会话被删除"""
+    parts = [b"a" * 1000, b"b" * 1000, b"c" * 10]
+    data = b"".join(parts)
+    manager, upload_id, file_path = make_session(total_size=len(data))
+
+    for number in (3, 1, 2, 1):
+        manager.save_part(upload_id, number, io.BytesIO(parts[number - 1]))
+    status = manager.get_status(upload_id)
+    assert [part["part_number"] for part in status["parts"]] == [1, 2, 3]
+    assert status["received_size"] == len(data)
+
+    result = manager.complete(upload_id, total_parts=3)
+    assert result["db_id"] == "kb_test" and result["size"] == len(data)
+    assert result["content_hash"] == hashlib.sha256(data).hexdigest()
+    with open(file_path, "rb") as f:
+        assert f.read() == data
+    assert not [name for name in os.listdir(os.path.dirname(file_path)) if name.endswith(".part")]
+    try:
+        manager.get_status(upload_id)
+        assert False, "会话应已删除"
+    except FileNotFoundError:
+        pass
+    print("乱序分片合并通过")
+
+
+def test_complete_verifies_parts_and_size():
+    """缺少分片或总大小不一致时拒绝合并，会话保持可继续上传"""
+    manager, upload_id, file_path = make_session(total_size=20)
+    manager.save_part(upload_id, 1, io.BytesIO(b"x" * 10))
+
+    for total_parts in (2, None):
+        try:
+            manager.complete(upload_id, total_parts=total_parts)
+            assert False, "应拒绝合并"
+        except ValueError:
+            pass
+
+    manager.save_part(upload_id, 2, io.BytesIO(b"y" * 5))
+    try:
+        manager.complete(upload_id, total_parts=2)
+        assert False, "总大小不一致应拒绝合并"
+    except ValueError:
+        pass
+    assert manager.get_status(upload_id)["status"] == "uploading" and not os.path.exists(file_path)
+
+    manager.save_part(upload_id, 2, io.BytesIO(b"y" * 10))
+    assert manager.complete(upload_id, total_parts=2)["size"] == 20
+    print("合并校验通过")
+
+
+def test_max_size_and_abort():
+    manager, upload_id, _ = make_session()
+    manager.save_part(upload_id, 1, io.BytesIO(b"x" * 10), max_size=15)
+    try:
+        manager.save_part(upload_id, 2, io.BytesIO(b"y" * 10), max_size=15)
+        assert False, "超出大小上限应拒绝"
+    except UploadTooLargeError:
+        pass
+    assert [part["part_number"] for part in manager.get_status(upload_id)["parts"]] == [1]
+
+    manager.abort(upload_id)
+    try:
+        manager.save_part(upload_id, 2, io.BytesIO(b"y"))
+        assert False, "取消后的会话不能继续上传"
+    except FileNotFoundError:
+        pass
+    print("大小上限与取消通过")
+
+
+if __name__ == "__main__":
+    test_assemble_out_of_order()
+    test_complete_verifies_parts_and_size()
+    test_max_size_and_abort()
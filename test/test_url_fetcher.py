@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.knowledge.url_fetcher import ResponseTooLargeError, UrlFetcher, html_to_text
+
+# 用 httpx.MockTransport 替代网站，验证条件请求、无校验信息时删除缓存、响应大小上限与缓存淘汰，无需访问网络
+
+URL = "http://site.test/page"
+HTML = "<html><head><title>标题</title><script>var x = 1;</script></head>" \
+       "<body><p>第一段</p><div>第二段&amp;更多</div></body></html>"
+
+
+class FakeSite:
+    """按 responses 依次返回响应，并记录每个请求的条件请求头"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request.headers.get("if-none-match"))
+        return self.responses.pop(0)
+
+
+def make_fetcher(**kwargs) -> UrlFetcher:
+    return UrlFetcher(os.path.join(tempfile.mkdtemp(), "url_cache.sqlite"), **kwargs)
+
+
+def fetch(fetcher: UrlFetcher, site: FakeSite, urls):
+    async def run():
+        fetcher._clients[asyncio.get_running_loop()] = (
+            httpx.AsyncClient(transport=httpx.MockTransport(site)), {})
+        try:
+            return [await fetcher.fetch_text(url) for url in urls]
+        finally:
+            await fetcher.aclose()
+    return asyncio.run(run())
+
+
+def test_html_to_text():
+    assert html_to_text(HTML) == "标题\n\n第一段\n\n第二段&更多"
+    print("HTML 提取通过")
+
+
+def test_conditional_fetch():
+    """带 ETag 的响应被缓存，再次抓取时发送条件请求，304 时使用缓存"""
+    fetcher = make_fetcher()
+    site = FakeSite(
+        httpx.Response(200, html=HTML, headers={"etag": '"v1"'}),
+        httpx.Response(304),
+    )
+    first, second = fetch(fetcher, site, [URL, URL])
+    assert first == second == "标题\n\n第一段\n\n第二段&更多"
+    assert site.requests == [None, '"v1"']
+    assert fetcher.stats()["hits"] == 1 and fetcher.stats()["misses"] == 1
+    assert not fetcher._clients
+    print("条件请求通过")
+
+
+def test_response_without_validators_drops_cache():
+    """重新抓取的响应不再带 ETag / Last-Modified 时删除旧缓存，下次不再发送条件请求"""
+    fetcher = make_fetcher()
+    site = FakeSite(
+        httpx.Response(200, text="old", headers={"content-type": "text/plain", "etag": '"v1"'}),
+        httpx.Response(200, text="new", headers={"content-type": "text/plain"}),
+        httpx.Response(200, text="newer", headers={"content-type": "text/plain"}),
+    )
+    assert fetch(fetcher, site, [URL, URL, URL]) == ["old", "new", "newer"]
+    assert site.requests == [None, '"v1"', None]
+    assert fetcher._get_cached(URL) is None and fetcher.stats()["size_mb"] == 0
+    print("无校验信息时删除缓存通过")
+
+
+async def chunked_body(chunk: bytes, count: int):
+    for _ in range(count):
+        yield chunk
+
+
+def test_response_size_limit():
+    fetcher = make_fetcher(max_response_mb=1)
+    for response in (httpx.Response(200, text="x" * (1024 * 1024 + 1)),
+                     # 不声明 Content-Length 的分块响应在读取过程中中止
+                     httpx.Response(200, content=chunked_body(b"x" * 1024, 1025))):
+        try:
+            fetch(fetcher, FakeSite(response), [URL])
+            assert False, "超过大小上限应中止"
+        except ResponseTooLargeError:
+            pass
+    print("响应大小上限通过")
+
+
+def test_evict_least_recently_used():
+    """超过缓存上限时只删除最久未访问的缓存，降到上限以内即停止"""
+    fetcher = make_fetcher()
+    fetcher.max_size = 30
+    for i in range(3):
+        fetcher._put_cached(f"{URL}/{i}", '"v"', None, "x" * 10)
+    fetcher._get_cached(f"{URL}/0")
+    fetcher._put_cached(f"{URL}/3", '"v"', None, "x" * 10)
+
+    assert fetcher._get_cached(f"{URL}/1") is None
+    assert all(fetcher._get_cached(f"{URL}/{i}") is not None for i in (0, 2, 3))
+    assert fetcher._total_size == 30
+
+    # 超过缓存上限的单个文本不写入，也不淘汰已有缓存
+    fetcher._put_cached(f"{URL}/4", '"v"', None, "x" * 31)
+    assert fetcher._get_cached(f"{URL}/4") is None and fetcher._total_size == 30
+    print("缓存淘汰通过")
+
+
+if __name__ == "__main__":
+    test_html_to_text()
+    test_conditional_fetch()
+    test_response_without_validators_drops_cache()
+    test_response_size_limit()
+    test_evict_least_recently_used()